@@ -0,0 +1,284 @@
+"""
+Offline benchmarks for the graph construction, layout and export hot paths.
+
+    python benchmarks/bench.py run --sizes 1000 --sizes 100000
+    python benchmarks/bench.py compare results/a.json results/b.json
+    python benchmarks/bench.py startup --max-seconds 0.5
+
+Results are written to benchmarks/results/<commit>-<timestamp>.json.
+"""
+from datetime import datetime
+import gc
+import json
+import logging
+import os
+from pathlib import Path
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, List
+
+import networkx as nx
+import rich
+from rich.table import Table
+import typer
+
+# run from a checkout without installing ztnd or setting PYTHONPATH
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from synthetic import make_completions
+from ztnd.formats import GraphArrays
+from ztnd.formats import write_graph
+from ztnd.generations import append_completion
+from ztnd.generations import iter_completions
+from ztnd.generations import load_completions
+from ztnd.generations import save_completions
+from ztnd.graphs import build_token_graph
+from ztnd.graphs import build_token_pos_tree
+from ztnd.layout import bfs_level_layout
+from ztnd.tokens import build_token_table
+
+
+logger = logging.getLogger(__name__)
+app = typer.Typer(add_completion=False)
+
+RESULTS_PATH = Path(__file__).parent / "results"
+DEFAULT_SIZES = [1_000, 10_000, 100_000, 1_000_000]
+# nx.bfs_layout is only run on graphs up to this many nodes
+MAX_NX_LAYOUT_NODES = 200_000
+
+MAIN_PATH = Path(__file__).parent.parent / "scripts" / "main.py"
+HEAVY_MODULES = {"openai", "networkx", "numpy", "pydantic"}
+
+
+def get_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def measure(fn: Callable, memory: bool) -> tuple[object, float, int | None]:
+    """
+    Time one call of `fn` and, with `memory`, measure its peak traced
+    allocation in a second call (tracemalloc would skew the timing).
+    """
+    gc.collect()
+    start = time.perf_counter()
+    result = fn()
+    seconds = time.perf_counter() - start
+
+    peak_bytes = None
+    if memory:
+        del result
+        gc.collect()
+        tracemalloc.start()
+        result = fn()
+        _, peak_bytes = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return result, seconds, peak_bytes
+
+
+def run_size(
+    n_tokens: int,
+    vocab_size: int,
+    length: int,
+    branch_prob: float,
+    memory: bool,
+    work_path: Path,
+) -> list[dict]:
+
+    records = []
+
+    def record(stage: str, fn: Callable, **extra):
+        result, seconds, peak_bytes = measure(fn, memory)
+        records.append({
+            "n_tokens": n_tokens,
+            "stage": stage,
+            "seconds": seconds,
+            "peak_bytes": peak_bytes,
+            **extra,
+        })
+        rich.print(f"{n_tokens:>10} {stage:<22} {seconds:10.4f}s")
+        return result
+
+    completions = make_completions(
+        n_tokens, vocab_size=vocab_size, length=length, branch_prob=branch_prob
+    )
+
+    json_path = work_path / f"completions-{n_tokens}.json"
+    jsonl_path = work_path / f"completions-{n_tokens}.jsonl"
+    jsonl_path.unlink(missing_ok=True)
+    save_completions(completions, json_path)
+    for completion in completions:
+        append_completion(completion, jsonl_path)
+
+    record("load_completions", lambda: load_completions(json_path))
+    record("iter_completions", lambda: sum(1 for _ in iter_completions(jsonl_path)))
+    table = record("build_token_table", lambda: build_token_table(completions))
+    record("build_token_graph", lambda: build_token_graph(table, graph_type="token"))
+    record("build_token_pos_graph", lambda: build_token_graph(table, graph_type="token_pos"))
+    tree = record("build_token_pos_tree", lambda: build_token_pos_tree(table))
+    n_nodes = tree.number_of_nodes()
+    record("bfs_level_layout", lambda: bfs_level_layout(tree, 0, "token_index"), n_nodes=n_nodes)
+    if n_nodes <= MAX_NX_LAYOUT_NODES:
+        record("nx_bfs_layout", lambda: nx.bfs_layout(tree, 0), n_nodes=n_nodes)
+    record("write_node_link_json", lambda: write_graph(tree, work_path / "tree.json"))
+    record("write_ztnd", lambda: write_graph(tree, work_path / "tree.ztnd"))
+    record("load_ztnd", lambda: GraphArrays.load(work_path / "tree.ztnd").to_digraph())
+
+    return records
+
+
+@app.command()
+def run(
+    sizes: List[int] = DEFAULT_SIZES,
+    vocab_size: int = 1000,
+    length: int = 64,
+    branch_prob: float = 0.05,
+    memory: bool = True,
+    out_path: Path = RESULTS_PATH,
+):
+    """
+    Benchmark every stage on synthetic completions of each size (in
+    tokens). No API key or network access is needed.
+    """
+    records = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        for n_tokens in sizes:
+            records.extend(run_size(
+                n_tokens, vocab_size, length, branch_prob, memory, Path(work_dir)
+            ))
+
+    commit = get_commit()
+    result = {
+        "commit": commit,
+        "timestamp": datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "params": {
+            "vocab_size": vocab_size,
+            "length": length,
+            "branch_prob": branch_prob,
+        },
+        "records": records,
+    }
+    out_path.mkdir(parents=True, exist_ok=True)
+    result_path = out_path / "{}-{}.json".format(
+        commit, datetime.now().strftime("%Y-%m-%d-%H-%M-%S")
+    )
+    with result_path.open("w") as fp:
+        fp.write(json.dumps(result, indent=4))
+    rich.print(f"wrote {result_path}")
+
+
+@app.command()
+def compare(base_path: Path, head_path: Path):
+    """
+    Compare two result files stage by stage (head / base time ratio).
+    """
+    with base_path.open() as fp:
+        base = json.load(fp)
+    with head_path.open() as fp:
+        head = json.load(fp)
+
+    base_records = {(el["n_tokens"], el["stage"]): el for el in base["records"]}
+    table = Table(title=f"{base['commit']} -> {head['commit']}")
+    for column in ["n_tokens", "stage", "base s", "head s", "ratio", "base MB", "head MB"]:
+        table.add_column(column, justify="right")
+
+    def fmt_mb(value: int | None) -> str:
+        return "-" if value is None else f"{value / 1e6:.1f}"
+
+    for el in head["records"]:
+        key = (el["n_tokens"], el["stage"])
+        if key not in base_records:
+            continue
+        bel = base_records[key]
+        ratio = el["seconds"] / bel["seconds"] if bel["seconds"] > 0 else float("nan")
+        table.add_row(
+            str(el["n_tokens"]),
+            el["stage"],
+            f"{bel['seconds']:.4f}",
+            f"{el['seconds']:.4f}",
+            f"{ratio:.2f}",
+            fmt_mb(bel["peak_bytes"]),
+            fmt_mb(el["peak_bytes"]),
+        )
+    rich.print(table)
+
+
+def get_imported_modules(importtime_log: str) -> set[str]:
+    # top level packages in the output of python -X importtime
+    modules = set()
+    for line in importtime_log.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            name = line.rsplit("|", 1)[1].strip()
+            modules.add(name.split(".")[0])
+    return modules
+
+
+@app.command()
+def startup(
+    n_runs: int = 5,
+    max_seconds: float | None = None,
+):
+    """
+    Check the startup of scripts/main.py. Every command is run `n_runs`
+    times and its median wall time reported. Exits with 1 if a command
+    imports a heavy module it does not need or is slower than --max-seconds.
+    """
+    with tempfile.TemporaryDirectory() as work_dir:
+        graph = nx.path_graph(100, create_using=nx.DiGraph)
+        nx.set_node_attributes(graph, {node: node for node in graph}, "token_index")
+        graph_path = Path(work_dir) / "node_link_data.json"
+        write_graph(graph, graph_path)
+
+        # command -> heavy modules it must not import
+        checks = [
+            (["--help"], HEAVY_MODULES),
+            (["generate-completions", "--help"], HEAVY_MODULES),
+            (["export-graph", "--help"], HEAVY_MODULES),
+            (["make-bfs-layout-v2", "--help"], HEAVY_MODULES),
+            (["make-bfs-layout-v2", str(graph_path)], {"openai", "pydantic"}),
+        ]
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.pathsep.join(
+            [str(MAIN_PATH.parent.parent)] + [el for el in [env.get("PYTHONPATH")] if el]
+        )
+
+        table = Table(title="startup")
+        for column in ["command", "median s", "heavy imports"]:
+            table.add_column(column, justify="left" if column == "command" else "right")
+        failed = False
+        for args, forbidden in checks:
+            seconds = []
+            for _ in range(n_runs):
+                start = time.perf_counter()
+                proc = subprocess.run(
+                    [sys.executable, "-X", "importtime", str(MAIN_PATH), *args],
+                    capture_output=True, text=True, env=env,
+                )
+                seconds.append(time.perf_counter() - start)
+                if proc.returncode != 0:
+                    raise RuntimeError(f"{args} failed:\n{proc.stderr[-2000:]}")
+            median = statistics.median(seconds)
+            heavy = sorted(get_imported_modules(proc.stderr) & forbidden)
+            if heavy or (max_seconds is not None and median > max_seconds):
+                failed = True
+            command = " ".join(args).replace(str(graph_path), graph_path.name)
+            table.add_row(command, f"{median:.3f}", ", ".join(heavy) or "-")
+    rich.print(table)
+    if failed:
+        raise typer.Exit(code=1)
+
+
+if __name__ == "__main__":
+    app()
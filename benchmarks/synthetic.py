@@ -0,0 +1,97 @@
+from bisect import bisect
+from itertools import accumulate
+import math
+import random
+
+from openai.types.chat.chat_completion import ChatCompletion
+
+
+def make_vocab(vocab_size: int) -> list[str]:
+    return [f" tok{ii}" for ii in range(vocab_size)]
+
+
+def make_completion_dicts(
+    n_tokens: int,
+    vocab_size: int = 1000,
+    length: int = 64,
+    branch_prob: float = 0.05,
+    n_choices_per_call: int = 20,
+    top_logprobs: int = 0,
+    seed: int = 0,
+) -> list[dict]:
+    """
+    Synthetic completions (as ChatCompletion shaped dicts) with about
+    `n_tokens` sampled tokens in total.
+
+    Every choice follows a shared canonical sequence of `length` tokens and
+    diverges from it with probability `branch_prob` per position, after
+    which it samples tokens from a Zipf-like distribution over the vocab.
+    Lower `branch_prob` gives deeper shared prefixes (fewer tree nodes).
+    """
+    rng = random.Random(seed)
+    vocab = make_vocab(vocab_size)
+    vocab_bytes = [list(token.encode("utf-8")) for token in vocab]
+    cum_weights = list(accumulate(1.0 / (rank + 1) for rank in range(vocab_size)))
+    total_weight = cum_weights[-1]
+    canonical = [rng.randrange(vocab_size) for _ in range(length)]
+
+    def sample_zipf() -> int:
+        return min(bisect(cum_weights, rng.random() * total_weight), vocab_size - 1)
+
+    def make_token(tid: int, logprob: float) -> dict:
+        tops = []
+        for _ in range(top_logprobs):
+            alt = sample_zipf()
+            tops.append({
+                "token": vocab[alt],
+                "bytes": vocab_bytes[alt],
+                "logprob": logprob - rng.random() * 3,
+            })
+        return {
+            "token": vocab[tid],
+            "bytes": vocab_bytes[tid],
+            "logprob": logprob,
+            "top_logprobs": tops,
+        }
+
+    n_choices = max(1, math.ceil(n_tokens / length))
+    n_calls = math.ceil(n_choices / n_choices_per_call)
+    completions = []
+    ichoice = 0
+    for icall in range(n_calls):
+        choices = []
+        for index in range(min(n_choices_per_call, n_choices - ichoice)):
+            content = []
+            diverged = False
+            for pos in range(length):
+                if not diverged and rng.random() < branch_prob:
+                    diverged = True
+                if diverged:
+                    content.append(make_token(sample_zipf(), -rng.expovariate(0.5)))
+                else:
+                    content.append(make_token(canonical[pos], -rng.expovariate(20.0)))
+            choices.append({
+                "index": index,
+                "finish_reason": "length",
+                "logprobs": {"content": content, "refusal": None},
+                "message": {
+                    "role": "assistant",
+                    "content": "".join(el["token"] for el in content),
+                },
+            })
+            ichoice += 1
+        completions.append({
+            "id": f"chatcmpl-synthetic-{seed}-{icall}",
+            "choices": choices,
+            "created": 0,
+            "model": "synthetic",
+            "object": "chat.completion",
+        })
+    return completions
+
+
+def make_completions(n_tokens: int, **kwargs) -> list[ChatCompletion]:
+    """
+    Same as make_completion_dicts but validated into ChatCompletion objects.
+    """
+    return [ChatCompletion.model_validate(el) for el in make_completion_dicts(n_tokens, **kwargs)]
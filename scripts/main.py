@@ -1,23 +1,21 @@
 from datetime import datetime
 from enum import Enum
-import json
 import logging
 from pathlib import Path
+from typing import List, Optional
 
-import networkx as nx
-import numpy as np
 import rich
 import typer
 
-from ztnd.generations import (
-    create_completions,
-    save_completions,
-    load_completions,
-)
-from ztnd.graphs import (
-    build_token_graph,
-    build_token_pos_graph,
+# heavy dependencies (openai, networkx, numpy) are imported inside the
+# commands that need them, so --help and small commands start quickly
+from ztnd.profiling import (
+    Profiler,
+    stage,
+    start_profiler,
+    stop_profiler,
 )
+from ztnd.serialization import set_json_backend
 
 logger = logging.getLogger(__name__)
 app = typer.Typer(add_completion=False)
@@ -30,14 +28,102 @@ class LogLevel(str, Enum):
     error = "error"
     critical = "critical"
 
+class GraphFormat(str, Enum):
+    json = "json"
+    ztnd = "ztnd"
+
+GRAPH_FILE_NAMES = {
+    "json": "node_link_data.json",
+    "ztnd": "graph.ztnd",
+}
+
+class ExportFormat(str, Enum):
+    json = "json"
+    gexf = "gexf"
+    graphml = "graphml"
+    csv = "csv"
+
 class GraphType(str, Enum):
     token = "token"
     token_pos = "token_pos"
+    token_pos_tree = "token_pos_tree"
+    token_dag = "token_dag"
 
 
 DEFAULT_PROMPT = """Write a short story starting with "Once upon a time"."""
 
 
+def print_profile(profiler: Profiler) -> None:
+    from rich.table import Table
+
+    table = Table(title="profile")
+    for column in ["stage", "count", "wall s", "cpu s", "peak MB", "max rss MB"]:
+        table.add_column(column, justify="left" if column == "stage" else "right")
+    for record in profiler.records:
+        table.add_row(
+            "  " * record.depth + record.name,
+            "" if record.count is None else str(record.count),
+            f"{record.wall_seconds:.4f}",
+            f"{record.cpu_seconds:.4f}",
+            "" if record.peak_bytes is None else f"{record.peak_bytes / 1e6:.1f}",
+            f"{record.max_rss_bytes / 1e6:.1f}",
+        )
+    table.add_row("total", "", f"{profiler.wall_seconds:.4f}", f"{profiler.cpu_seconds:.4f}", "", "")
+    rich.print(table)
+
+
+@app.callback()
+def main(
+    ctx: typer.Context,
+    profile: bool = False,
+    profile_path: Optional[Path] = None,
+    trace_memory: bool = False,
+    cprofile_path: Optional[Path] = None,
+    json_backend: Optional[str] = None,
+):
+    """
+    With --profile every command records wall / CPU time, item counts and
+    memory per pipeline stage and writes a JSON report to --profile-path
+    (default profile-<timestamp>.json). --trace-memory adds tracemalloc
+    peaks per stage and --cprofile-path dumps cProfile stats of the run.
+    --json-backend selects "orjson" (default if installed) or "json".
+    """
+    if json_backend is not None:
+        set_json_backend(json_backend)
+    if not profile:
+        return
+    if profile_path is None:
+        profile_path = Path(
+            "profile-{}.json".format(datetime.now().strftime("%Y-%m-%d-%H-%M-%S"))
+        )
+    start_profiler(Profiler(trace_memory=trace_memory, cprofile_path=cprofile_path))
+
+    def finish():
+        profiler = stop_profiler()
+        profiler.write(profile_path)
+        print_profile(profiler)
+        rich.print(f"wrote profile to {profile_path}")
+
+    ctx.call_on_close(finish)
+
+
+def get_completions_path(cache_path: Path) -> Path:
+    # prefer the append-only store, fall back to legacy single-file runs
+    jsonl_path = cache_path / "completions.jsonl"
+    if jsonl_path.exists():
+        return jsonl_path
+    return cache_path / "completions.json"
+
+
+def get_bfs_out_path(graph_path: Path) -> Path:
+    # write layouts in the same format as the input graph
+    from ztnd.formats import is_binary_path
+
+    if is_binary_path(graph_path):
+        return graph_path.parent / ("bfs_" + GRAPH_FILE_NAMES["ztnd"])
+    return graph_path.parent / ("bfs_" + GRAPH_FILE_NAMES["json"])
+
+
 @app.command()
 def generate_completions(
     prompt: str = DEFAULT_PROMPT,
@@ -49,15 +135,27 @@ def generate_completions(
     seed: int = 9237,
     temperature: float = 0.4,
     n_api_calls: int = 10,
+    max_concurrency: int = 1,
+    tokens_per_minute: Optional[int] = None,
+    base_url: Optional[str] = None,
+    resume_path: Optional[Path] = None,
+    response_cache_path: Optional[Path] = None,
+    response_cache_max_bytes: int = 1_000_000_000,
     log_level: LogLevel = LogLevel.info,
 ):
+    from ztnd.generations import ResponseCache
+    from ztnd.generations import check_store_params
+    from ztnd.generations import create_completions
+    from ztnd.generations import get_request_params
+    from ztnd.generations import get_store_appender
+    from ztnd.generations import read_store_calls
+    from ztnd.generations import truncate_partial_line
 
     logging.basicConfig(level=getattr(logging, log_level.upper()))
     rich.print(f"{prompt=}")
 
     messages = [{"role": "user", "content": prompt}]
-    completions = create_completions(
-        messages,
+    request_kwargs = dict(
         model=model,
         logprobs=logprobs,
         top_logprobs=top_logprobs,
@@ -65,49 +163,426 @@ def generate_completions(
         n_choices_per_call=n_choices_per_call,
         seed=seed,
         temperature=temperature,
-        n_api_calls=n_api_calls,
+        base_url=base_url,
     )
 
+    # each completion is appended to the store (with its call index) as
+    # soon as it arrives so a crashed run can be resumed by passing its
+    # cache dir as --resume-path, which makes only the missing calls. The
+    # request parameters are recorded next to the store and resuming with
+    # different ones is refused.
+    if resume_path is None:
+        cache_path = Path("cache") / datetime.now().strftime("%Y-%m-%d-%H-%M-%S")
+    else:
+        cache_path = resume_path
+    cache_path.mkdir(exist_ok=True, parents=True)
+    store_path = cache_path / "completions.jsonl"
+    try:
+        check_store_params(store_path, get_request_params(messages, **request_kwargs))
+    except ValueError as exc:
+        raise typer.BadParameter(str(exc), param_hint="--resume-path")
+    truncate_partial_line(store_path)
+    done_calls = read_store_calls(store_path)
+    if done_calls:
+        rich.print(f"resuming with {len(done_calls)} completions in {store_path}")
+
+    cache = None
+    if response_cache_path is not None:
+        cache = ResponseCache(response_cache_path, max_bytes=response_cache_max_bytes)
+
+    with stage("create_completions") as record:
+        completions = create_completions(
+            messages,
+            **request_kwargs,
+            max_concurrency=max_concurrency,
+            tokens_per_minute=tokens_per_minute,
+            on_completion=get_store_appender(store_path, done_calls),
+            cache=cache,
+            call_indices=[ii for ii in range(n_api_calls) if ii not in done_calls],
+        )
+        record.count = len(completions)
+
+    if cache is not None:
+        rich.print(cache.report())
+
+
+@app.command()
+def synthesize_completions(
+    corpus_path: Path,
+    prompt: str = DEFAULT_PROMPT,
+    model: str = "gpt-4o-mini",
+    encoding: Optional[str] = None,
+    order: int = 3,
+    backoff: float = 0.2,
+    logprobs: bool = True,
+    top_logprobs: int = 0,
+    max_completion_tokens: int = 64,
+    n_choices_per_call: int = 20,
+    seed: int = 9237,
+    temperature: float = 1.0,
+    n_api_calls: int = 10,
+    log_level: LogLevel = LogLevel.info,
+):
+    """
+    Write completions sampled offline from an n-gram model of CORPUS_PATH
+    (a completion store or a text file, tokenized with the tiktoken
+    encoding of --model unless --encoding is given) to a new cache dir.
+    No API key or network needed, e.g. to load test the graph pipeline.
+    """
+    from ztnd.generations import NgramModel
+    from ztnd.generations import get_encoding
+    from ztnd.generations import iter_corpus_texts
+    from ztnd.generations import save_completions
+    from ztnd.generations import synthesize_completions as synthesize
+
+    logging.basicConfig(level=getattr(logging, log_level.upper()))
+    with stage("fit_ngram_model"):
+        ngram_model = NgramModel(get_encoding(encoding or model), order=order, backoff=backoff)
+        ngram_model.fit(iter_corpus_texts(corpus_path))
+
+    messages = [{"role": "user", "content": prompt}]
+    with stage("synthesize_completions") as record:
+        completions = synthesize(
+            messages,
+            ngram_model,
+            model=model,
+            logprobs=logprobs,
+            top_logprobs=top_logprobs,
+            max_completion_tokens=max_completion_tokens,
+            n_choices_per_call=n_choices_per_call,
+            seed=seed,
+            temperature=temperature,
+            n_api_calls=n_api_calls,
+        )
+        record.count = sum(completion.usage.completion_tokens for completion in completions)
+
     cache_path = Path("cache") / datetime.now().strftime("%Y-%m-%d-%H-%M-%S")
     cache_path.mkdir(exist_ok=True, parents=True)
-    save_completions(completions, cache_path / "completions.json")
+    with stage("save_completions"):
+        save_completions(completions, cache_path / "completions.json")
+    rich.print(f"wrote {len(completions)} completions to {cache_path}")
+
+
+@app.command()
+def stream_graph(
+    prompt: str = DEFAULT_PROMPT,
+    model: str = "gpt-4o-mini",
+    top_logprobs: int = 0,
+    max_completion_tokens: int = 64,
+    n_choices_per_call: int = 20,
+    seed: int = 9237,
+    temperature: float = 0.4,
+    n_api_calls: int = 10,
+    max_concurrency: int = 1,
+    tokens_per_minute: Optional[int] = None,
+    base_url: Optional[str] = None,
+    graph_format: GraphFormat = GraphFormat.json,
+    add_alternatives: bool = False,
+    min_alt_prob: float = 0.01,
+    snapshot_seconds: float = 10.0,
+    log_level: LogLevel = LogLevel.info,
+):
+    """
+    Stream completions and build the token_pos_tree as tokens arrive,
+    without storing the completions. The partial tree is rewritten every
+    --snapshot-seconds (0 disables snapshots).
+    """
+    from ztnd.generations import stream_completions
+    from ztnd.streaming import SnapshotWriter
+    from ztnd.streaming import TokenStreamBuilder
+
+    logging.basicConfig(level=getattr(logging, log_level.upper()))
+    rich.print(f"{prompt=}")
+
+    cache_path = Path("cache") / datetime.now().strftime("%Y-%m-%d-%H-%M-%S")
+    out_path = cache_path / GraphType.token_pos_tree.value
+    out_path.mkdir(parents=True, exist_ok=True)
+    graph_path = out_path / GRAPH_FILE_NAMES[graph_format.value]
+
+    builder = TokenStreamBuilder(
+        add_alternatives=add_alternatives,
+        min_alt_prob=min_alt_prob,
+    )
+    writer = SnapshotWriter(builder, graph_path, interval=snapshot_seconds)
+    messages = [{"role": "user", "content": prompt}]
+    with stage("stream_completions") as record:
+        stream_completions(
+            messages,
+            on_chunk=writer,
+            model=model,
+            top_logprobs=top_logprobs,
+            max_completion_tokens=max_completion_tokens,
+            n_choices_per_call=n_choices_per_call,
+            seed=seed,
+            temperature=temperature,
+            n_api_calls=n_api_calls,
+            max_concurrency=max_concurrency,
+            tokens_per_minute=tokens_per_minute,
+            base_url=base_url,
+        )
+        record.count = builder.n_tokens
+    with stage("write_graph"):
+        builder.write(graph_path)
+    rich.print(f"wrote {len(builder.trie)} nodes from {builder.n_tokens} tokens to {graph_path}")
+
+
+@app.command()
+def sweep(
+    prompts_path: Path,
+    out_path: Path,
+    model: List[str] = ["gpt-4o-mini"],
+    temperature: List[float] = [0.4],
+    seed: List[int] = [9237],
+    logprobs: bool = True,
+    top_logprobs: int = 0,
+    max_completion_tokens: int = 64,
+    n_choices_per_call: int = 20,
+    n_api_calls: int = 10,
+    max_concurrent_runs: int = 4,
+    max_concurrency: int = 1,
+    tokens_per_minute: Optional[int] = None,
+    base_url: Optional[str] = None,
+    response_cache_path: Optional[Path] = None,
+    graph_type: List[GraphType] = [GraphType.token_pos_tree],
+    graph_format: GraphFormat = GraphFormat.json,
+    max_workers: Optional[int] = None,
+    log_level: LogLevel = LogLevel.info,
+):
+    """
+    Fetch completions for every prompt x model x temperature x seed and
+    build their graphs in a process pool. Results go to OUT_PATH/runs/ with
+    an index in OUT_PATH/index.jsonl. Re-running resumes unfinished runs.
+    """
+    from ztnd.generations import ResponseCache
+    from ztnd.sweeps import build_sweep_graphs
+    from ztnd.sweeps import fetch_sweep
+    from ztnd.sweeps import make_sweep_runs
+    from ztnd.sweeps import read_prompts
+
+    logging.basicConfig(level=getattr(logging, log_level.upper()))
+
+    runs = make_sweep_runs(read_prompts(prompts_path), model, temperature, seed)
+    rich.print(f"sweeping {len(runs)} runs into {out_path}")
+
+    cache = None
+    if response_cache_path is not None:
+        cache = ResponseCache(response_cache_path)
+
+    with stage("fetch_sweep") as record:
+        record.count = len(runs)
+        fetch_sweep(
+            runs,
+            out_path,
+            n_api_calls=n_api_calls,
+            max_concurrent_runs=max_concurrent_runs,
+            cache=cache,
+            logprobs=logprobs,
+            top_logprobs=top_logprobs,
+            max_completion_tokens=max_completion_tokens,
+            n_choices_per_call=n_choices_per_call,
+            max_concurrency=max_concurrency,
+            tokens_per_minute=tokens_per_minute,
+            base_url=base_url,
+        )
+    with stage("build_sweep_graphs") as record:
+        record.count = len(runs)
+        build_sweep_graphs(
+            runs,
+            out_path,
+            graph_types=[el.value for el in graph_type],
+            graph_format=graph_format.value,
+            max_workers=max_workers,
+        )
+
+    if cache is not None:
+        rich.print(cache.report())
 
 
 @app.command()
 def generate_graph(
     cache_path: Path,
     graph_type: GraphType,
+    graph_format: GraphFormat = GraphFormat.json,
+    add_alternatives: bool = False,
+    min_alt_prob: float = 0.01,
+    n_workers: int = 1,
     log_level: LogLevel = LogLevel.info,
 ):
+    """
+    Build a graph from CACHE_PATH and write it to CACHE_PATH/GRAPH_TYPE.
+    --n-workers builds on a process pool (0 for one worker per core) with
+    the same graph as the serial build (token and token_pos logprob stats
+    up to float rounding).
+    """
+    from ztnd.formats import write_graph
+    from ztnd.graphs import build_token_dag
+    from ztnd.graphs import build_token_graph
+    from ztnd.graphs import build_token_pos_tree
+    from ztnd.tokens import load_token_table
+
+    with stage("load_token_table") as record:
+        table = load_token_table(get_completions_path(cache_path))
+        record.count = len(table)
+    rich.print(table.get_choice_text(0))
+    with stage("build_graph") as record:
+        if graph_type in ("token", "token_pos"):
+            graph = build_token_graph(table, graph_type=graph_type, n_workers=n_workers)
+        elif graph_type == "token_pos_tree":
+            graph = build_token_pos_tree(
+                table,
+                add_alternatives=add_alternatives,
+                min_alt_prob=min_alt_prob,
+                n_workers=n_workers,
+            )
+        elif graph_type == "token_dag":
+            graph = build_token_dag(table, n_workers=n_workers)
+        else:
+            raise ValueError()
+        record.count = graph.number_of_nodes()
+
+    out_path = cache_path / graph_type.value
+    out_path.mkdir(parents=True, exist_ok=True)
+    with stage("write_graph"):
+        write_graph(graph, out_path / GRAPH_FILE_NAMES[graph_format.value])
+
 
-    completions = load_completions(cache_path / "completions.json")
-    rich.print(completions[0].choices[0].message)
-    if graph_type == "token":
-        graph = build_token_graph(completions)
-    elif graph_type == "token_pos":
-        graph = build_token_pos_graph(completions)
-    else:
-        raise ValueError()
 
-    data = nx.node_link_data(graph, edges="edges")
-    out_path = cache_path / graph_type
+@app.command()
+def export_graph(
+    cache_path: Path,
+    graph_type: GraphType,
+    export_format: ExportFormat = ExportFormat.gexf,
+    add_layout: bool = False,
+    add_alternatives: bool = False,
+    min_alt_prob: float = 0.01,
+    min_weight: float = 0.0,
+    top_k: Optional[int] = None,
+    max_depth: Optional[int] = None,
+    compact: bool = False,
+    n_workers: int = 1,
+    log_level: LogLevel = LogLevel.info,
+):
+    """
+    Build a graph straight into arrays and stream it to
+    CACHE_PATH/GRAPH_TYPE/graph.<format> as node-link JSON, GEXF, GraphML
+    or a Sankey (source, target, value) CSV, without an nx.DiGraph.
+    --add-layout adds xpos / ypos to token_pos_tree nodes.
+    --min-weight, --top-k and --max-depth prune a token_pos_tree (dropped
+    children are aggregated into "<n more>" nodes) and --compact merges
+    unbranched chains into multi-token nodes.
+    """
+    from ztnd.exports import export_graph as export_graph_file
+    from ztnd.graphs import build_graph_arrays
+    from ztnd.layout import set_tree_layout_arrays
+    from ztnd.pruning import summarize_tree
+    from ztnd.tokens import load_token_table
+
+    logging.basicConfig(level=getattr(logging, log_level.upper()))
+    summarize = min_weight > 0 or top_k is not None or max_depth is not None or compact
+    if (add_layout or summarize) and graph_type != GraphType.token_pos_tree:
+        raise typer.BadParameter("--add-layout and pruning options need a token_pos_tree")
+
+    with stage("load_token_table") as record:
+        table = load_token_table(get_completions_path(cache_path))
+        record.count = len(table)
+    with stage("build_graph"):
+        arrays = build_graph_arrays(
+            table,
+            graph_type.value,
+            add_alternatives=add_alternatives,
+            min_alt_prob=min_alt_prob,
+            n_workers=n_workers,
+        )
+    if summarize:
+        with stage("summarize_tree") as record:
+            arrays = summarize_tree(
+                arrays, min_weight=min_weight, top_k=top_k, max_depth=max_depth, compact=compact
+            )
+            record.count = arrays.n_nodes
+    if add_layout:
+        with stage("layout"):
+            set_tree_layout_arrays(arrays)
+
+    out_path = cache_path / graph_type.value
     out_path.mkdir(parents=True, exist_ok=True)
-    with (out_path / "node_link_data.json").open("w") as fp:
-        fp.write(json.dumps(data, indent=4))
+    graph_path = out_path / f"graph.{export_format.value}"
+    with stage("export_graph"):
+        export_graph_file(arrays, graph_path)
+    rich.print(f"wrote {arrays.n_nodes} nodes and {arrays.n_edges} edges to {graph_path}")
+
+
+@app.command()
+def export_bundle(
+    cache_path: Path,
+    graph_type: GraphType = GraphType.token_pos_tree,
+    min_weight: float = 0.0,
+    top_k: Optional[int] = None,
+    max_depth: Optional[int] = None,
+    compact: bool = False,
+    chunk_nodes: int = 20_000,
+    n_workers: int = 1,
+    log_level: LogLevel = LogLevel.info,
+):
+    """
+    Write a static viewer for a token_pos_tree or token_dag to
+    CACHE_PATH/GRAPH_TYPE/viewer: index.html plus binary chunks of about
+    --chunk-nodes nodes per band of levels that the page loads one after
+    the other, so the first levels show up immediately. Serve the
+    directory with e.g. `python -m http.server`. Pruning options are as
+    in export-graph (token_pos_tree only).
+    """
+    from ztnd.graphs import build_graph_arrays
+    from ztnd.pruning import summarize_tree
+    from ztnd.tokens import load_token_table
+    from ztnd.viewer import write_viewer_bundle
 
+    logging.basicConfig(level=getattr(logging, log_level.upper()))
+    if graph_type not in (GraphType.token_pos_tree, GraphType.token_dag):
+        raise typer.BadParameter("the viewer needs a token_pos_tree or token_dag")
+    summarize = min_weight > 0 or top_k is not None or max_depth is not None or compact
+    if summarize and graph_type != GraphType.token_pos_tree:
+        raise typer.BadParameter("pruning options need a token_pos_tree")
+
+    with stage("load_token_table") as record:
+        table = load_token_table(get_completions_path(cache_path))
+        record.count = len(table)
+    with stage("build_graph"):
+        arrays = build_graph_arrays(table, graph_type.value, n_workers=n_workers)
+    if summarize:
+        with stage("summarize_tree") as record:
+            arrays = summarize_tree(
+                arrays, min_weight=min_weight, top_k=top_k, max_depth=max_depth, compact=compact
+            )
+            record.count = arrays.n_nodes
+
+    out_path = cache_path / graph_type.value / "viewer"
+    with stage("write_viewer_bundle") as record:
+        manifest = write_viewer_bundle(
+            arrays, out_path, chunk_nodes=chunk_nodes, title=f"{cache_path.name} {graph_type.value}"
+        )
+        record.count = arrays.n_nodes
+    rich.print(
+        f"wrote {arrays.n_nodes} nodes in {len(manifest['chunks'])} chunks to {out_path}, "
+        f"view with `python -m http.server -d {out_path}`"
+    )
 
 
 @app.command()
 def make_bfs_layout(
     nld_path: Path,
-    start_node_id: str,
+    start_node_id: int = 0,
     log_level: LogLevel = LogLevel.info,
 ):
+    import networkx as nx
 
-    with open(nld_path) as fp:
-        nld = json.load(fp)
-    graph = nx.node_link_graph(nld, edges="edges")
-    pos = nx.bfs_layout(graph, start_node_id)
+    from ztnd.formats import read_graph
+    from ztnd.formats import write_graph
+
+    with stage("read_graph"):
+        graph = read_graph(nld_path)
+    with stage("nx_bfs_layout") as record:
+        pos = nx.bfs_layout(graph, start_node_id)
+        record.count = len(pos)
 
     xpos = {}
     ypos = {}
@@ -115,64 +590,34 @@ def make_bfs_layout(
         xpos[k] = float(v[0])
         ypos[k] = float(v[1])
 
-    nx.set_node_attributes(graph, xpos, "xpos")
-    nx.set_node_attributes(graph, ypos, "ypos")
+    with stage("set_node_attributes"):
+        nx.set_node_attributes(graph, xpos, "xpos")
+        nx.set_node_attributes(graph, ypos, "ypos")
 
-    data = nx.node_link_data(graph, edges="edges")
-    out_path = nld_path.parent / "bfs_node_link_data.json"
-    with out_path.open("w") as fp:
-        fp.write(json.dumps(data, indent=4))
+    with stage("write_graph"):
+        write_graph(graph, get_bfs_out_path(nld_path))
 
 
 
 @app.command()
 def make_bfs_layout_v2(
     nld_path: Path,
-    start_node_id: str,
+    start_node_id: int = 0,
+    level_attr: Optional[str] = "token_index",
     log_level: LogLevel = LogLevel.info,
 ):
-
-    with open(nld_path) as fp:
-        nld = json.load(fp)
-    graph = nx.node_link_graph(nld, edges="edges")
-    pos = nx.bfs_layout(graph, start_node_id)
-
-    # update the positions so that,
-    # xpos goes from 0 -> num_tokens-1
-    # ypos have unit distance and are centered on 0
-    xpos = {}
-    for k, v in pos.items():
-        xpos[k] = float(graph.nodes[k]["ipos"])
-
-    max_ipos = max([data["ipos"] for node, data in graph.nodes(data=True)])
-    min_ipos = min([data["ipos"] for node, data in graph.nodes(data=True)])
-
-    ypos = {}
-    for ipos in range(min_ipos, max_ipos + 1):
-        node_data = [
-            (node, data) for node, data in graph.nodes(data=True) if data["ipos"] == ipos
-        ]
-        node_yvals = sorted(
-            [(node, float(pos[node][1])) for node, data in node_data], key=lambda x: x[1]
-        )
-        nyvals = len(node_yvals)
-
-        if nyvals % 2 == 0:
-            new_yvals = np.linspace(-(nyvals // 2) + 0.5, (nyvals // 2) - 0.5, nyvals)
-        else:
-            new_yvals = np.linspace(-(nyvals // 2), nyvals // 2, nyvals)
-
-        for node_yval, new_yval in zip(node_yvals, new_yvals):
-            node_id, yval = node_yval
-            ypos[node_id] = float(new_yval)
-
-    nx.set_node_attributes(graph, xpos, "xpos")
-    nx.set_node_attributes(graph, ypos, "ypos")
-
-    data = nx.node_link_data(graph)
-    out_path = nld_path.parent / "bfs_node_link_data.json"
-    with out_path.open("w") as fp:
-        fp.write(json.dumps(data, indent=4))
+    from ztnd.formats import read_graph
+    from ztnd.formats import write_graph
+    from ztnd.layout import set_bfs_level_layout
+
+    # xpos goes from min level -> max level
+    # ypos have unit distance and are centered on 0 at each level
+    with stage("read_graph"):
+        graph = read_graph(nld_path)
+    with stage("layout"):
+        set_bfs_level_layout(graph, start_node_id, level_attr=level_attr)
+    with stage("write_graph"):
+        write_graph(graph, get_bfs_out_path(nld_path))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,264 @@
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+import json
+import random
+import threading
+import time
+
+import pytest
+
+
+VOCAB = ["Once", " upon", " a", " time", ",", " there", " was", " a", " cat", " dog", "."]
+
+
+def make_choice(index: int, rng: random.Random, max_tokens: int, top_logprobs: int) -> dict:
+    # shared prefix then random tokens, so choices branch into a tree
+    n_tokens = rng.randint(1, max_tokens)
+    content = []
+    for pos in range(n_tokens):
+        token = VOCAB[pos] if pos < 3 and rng.random() < 0.8 else rng.choice(VOCAB)
+        content.append({
+            "token": token,
+            "bytes": list(token.encode("utf-8")),
+            "logprob": -rng.random(),
+            "top_logprobs": [
+                {"token": alt, "bytes": list(alt.encode("utf-8")), "logprob": -3 * rng.random()}
+                for alt in rng.sample(VOCAB, top_logprobs)
+            ],
+        })
+    return {
+        "index": index,
+        "finish_reason": "length" if n_tokens == max_tokens else "stop",
+        "logprobs": {"content": content, "refusal": None},
+        "message": {"role": "assistant", "content": "".join(el["token"] for el in content)},
+    }
+
+
+def make_completion(icompletion: int, model: str, n: int, max_tokens: int, top_logprobs: int) -> dict:
+    rng = random.Random(icompletion)
+    return {
+        "id": f"chatcmpl-fake-{icompletion}",
+        "object": "chat.completion",
+        "created": 0,
+        "model": model,
+        "choices": [make_choice(index, rng, max_tokens, top_logprobs) for index in range(n)],
+    }
+
+
+def make_completions(n_completions: int, n: int = 5, max_tokens: int = 12, top_logprobs: int = 3) -> list:
+    """
+    The completions a fresh FakeOpenAIServer returns, as ChatCompletion
+    objects, without a server.
+    """
+    from openai.types.chat.chat_completion import ChatCompletion
+
+    return [
+        ChatCompletion.model_validate(make_completion(ii, "fake", n, max_tokens, top_logprobs))
+        for ii in range(n_completions)
+    ]
+
+
+def make_token_completion(completion_id: str, choices: list[tuple[list[str], list[float]]]):
+    """
+    A ChatCompletion with the given (tokens, logprobs) per choice.
+    """
+    from openai.types.chat.chat_completion import ChatCompletion
+
+    return ChatCompletion.model_validate({
+        "id": completion_id,
+        "object": "chat.completion",
+        "created": 0,
+        "model": "fake",
+        "choices": [
+            {
+                "index": index,
+                "finish_reason": "stop",
+                "message": {"role": "assistant", "content": "".join(tokens)},
+                "logprobs": {
+                    "content": [
+                        {"token": token, "bytes": list(token.encode("utf-8")), "logprob": logprob, "top_logprobs": []}
+                        for token, logprob in zip(tokens, logprobs)
+                    ],
+                    "refusal": None,
+                },
+            }
+            for index, (tokens, logprobs) in enumerate(choices)
+        ],
+    })
+
+
+class FakeOpenAIServer:
+    """
+    Local stand-in for the chat completions endpoint.
+
+    Request `ii` (counted from 0 in arrival order) gets `statuses[ii]` if
+    it is listed (e.g. 429 or 500) and otherwise a completion whose
+    choices are seeded by the number of successful requests before it, so
+    a fresh server returns the same completions in the same order whether
+    they are streamed or not. Streams interleave the chunks of all
+    choices. Successful responses are delayed by `delays[ii]` seconds.
+    """
+
+    def __init__(self):
+        self.statuses = {}
+        self.delays = {}
+        self.requests = []
+        self.n_completions = 0
+        self.n_active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), self.get_handler())
+        self.thread = threading.Thread(
+            target=self.httpd.serve_forever, kwargs={"poll_interval": 0.01}, daemon=True
+        )
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.httpd.server_address[1]}/v1"
+
+    def get_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                with server.lock:
+                    irequest = len(server.requests)
+                    server.requests.append(body)
+                    status = server.statuses.get(irequest, 200)
+                    if status == 200:
+                        icompletion = server.n_completions
+                        server.n_completions += 1
+                    server.n_active += 1
+                    server.max_active = max(server.max_active, server.n_active)
+                try:
+                    if status != 200:
+                        self.send_json(status, {"error": {"message": f"status {status}"}})
+                        return
+                    time.sleep(server.delays.get(irequest, 0.0))
+                    completion = server.make_completion(icompletion, body)
+                    if body.get("stream"):
+                        self.send_stream(completion)
+                    else:
+                        self.send_json(200, completion)
+                finally:
+                    with server.lock:
+                        server.n_active -= 1
+
+            def send_json(self, status: int, data: dict) -> None:
+                blob = json.dumps(data).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(blob)))
+                self.end_headers()
+                self.wfile.write(blob)
+
+            def send_stream(self, completion: dict) -> None:
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.end_headers()
+                for chunk in server.make_chunks(completion):
+                    self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+                self.wfile.write(b"data: [DONE]\n\n")
+
+        return Handler
+
+    def make_completion(self, icompletion: int, body: dict) -> dict:
+        return make_completion(
+            icompletion,
+            body["model"],
+            body.get("n", 1),
+            body.get("max_completion_tokens") or 16,
+            body.get("top_logprobs") or 0,
+        )
+
+    def make_chunks(self, completion: dict) -> list[dict]:
+        # one or two tokens per chunk, choices shuffled in every round
+        rng = random.Random(completion["id"])
+        pending = {choice["index"]: list(choice["logprobs"]["content"]) for choice in completion["choices"]}
+        finish = {choice["index"]: choice["finish_reason"] for choice in completion["choices"]}
+        chunks = []
+        while pending:
+            indices = list(pending)
+            rng.shuffle(indices)
+            for index in indices:
+                tokens = pending[index][:rng.randint(1, 2)]
+                del pending[index][:len(tokens)]
+                choice = {
+                    "index": index,
+                    "delta": {"content": "".join(el["token"] for el in tokens)},
+                    "logprobs": {"content": tokens, "refusal": None},
+                    "finish_reason": None,
+                }
+                chunks.append(self.make_chunk(completion, choice))
+                if not pending[index]:
+                    del pending[index]
+                    choice = {"index": index, "delta": {}, "finish_reason": finish[index]}
+                    chunks.append(self.make_chunk(completion, choice))
+        return chunks
+
+    def make_chunk(self, completion: dict, choice: dict) -> dict:
+        return {
+            "id": completion["id"],
+            "object": "chat.completion.chunk",
+            "created": 0,
+            "model": completion["model"],
+            "choices": [choice],
+        }
+
+    def __enter__(self) -> "FakeOpenAIServer":
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class FakeClock:
+    """
+    Replaces the time module of ztnd.generations so that backoff and token
+    budget waits are recorded instead of slept.
+    """
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def time(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def completions():
+    return make_completions(40)
+
+
+@pytest.fixture
+def fake_server():
+    with FakeOpenAIServer() as server:
+        yield server
+
+
+@pytest.fixture
+def fake_clock(monkeypatch):
+    from ztnd import generations
+
+    clock = FakeClock()
+    monkeypatch.setattr(generations, "time", clock)
+    return clock
+
+
+@pytest.fixture(autouse=True)
+def api_key(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
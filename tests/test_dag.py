@@ -0,0 +1,100 @@
+import networkx as nx
+import numpy as np
+import pytest
+
+from conftest import make_token_completion
+from ztnd.dag import minimize_trie
+from ztnd.graphs import build_token_dag
+from ztnd.graphs import build_trie
+from ztnd.tokens import build_token_table
+
+
+def get_paths(graph: nx.DiGraph, node=0) -> dict[tuple[str, ...], int]:
+    """
+    Number of choices ending after every token path from `node`, i.e. the
+    weight into the end node that does not flow on.
+    """
+    paths = {}
+    stack = [(node, ())]
+    while stack:
+        node, path = stack.pop()
+        in_weight = sum(weight for _, _, weight in graph.in_edges(node, data="weight"))
+        out_weight = sum(weight for _, _, weight in graph.out_edges(node, data="weight"))
+        if in_weight > out_weight:
+            paths[path] = in_weight - out_weight
+        stack.extend((child, path + (graph.nodes[child]["label"],)) for child in graph.successors(node))
+    return paths
+
+
+def test_minimized_dag_keeps_paths(completions):
+    table = build_token_table(completions)
+    trie = build_trie(table)
+    tree = trie.to_digraph()
+    arrays = minimize_trie(trie)
+    dag = arrays.to_digraph()
+    assert nx.is_directed_acyclic_graph(dag)
+    assert dag.number_of_nodes() < tree.number_of_nodes()
+    assert arrays.node_attrs["n_merged"].sum() == tree.number_of_nodes()
+
+    # the same token sequences, and as many choices end after each
+    tree_paths = get_paths(tree)
+    assert sum(tree_paths.values()) == table.n_choices
+    # a merged end node is reached by several paths, so compare the
+    # choices ending per end node with the trie nodes merged into it
+    dag_ends = {}
+    for path, count in tree_paths.items():
+        node = 0
+        for label in path:
+            node = next(child for child in dag.successors(node) if dag.nodes[child]["label"] == label)
+        dag_ends[node] = dag_ends.get(node, 0) + count
+    assert set(get_paths(dag)) == set(tree_paths)
+    for node, count in dag_ends.items():
+        in_weight = sum(weight for _, _, weight in dag.in_edges(node, data="weight"))
+        out_weight = sum(weight for _, _, weight in dag.out_edges(node, data="weight"))
+        assert in_weight - out_weight == count
+    assert sum(weight for _, _, weight in dag.edges(data="weight")) == sum(
+        weight for _, _, weight in tree.edges(data="weight")
+    )
+    for lo, hi in dag.edges:
+        assert dag.nodes[lo]["token_index"] < dag.nodes[hi]["token_index"]
+        assert dag.nodes[hi]["min_token_index"] <= dag.nodes[hi]["token_index"]
+
+
+def test_minimized_dag_merges_tails():
+    # "x y" follows both "A" and "B A", "B" alone ends a choice
+    completion = make_token_completion("chatcmpl-0", [
+        (["A", "x", "y"], [-0.1, -0.2, -0.3]),
+        (["B", "A", "x", "y"], [-0.4, -0.5, -0.6, -0.7]),
+        (["A", "x", "y"], [-0.1, -0.4, -0.5]),
+        (["B"], [-0.2]),
+    ])
+    dag = build_token_dag([completion])
+    labels = {node: data["label"] for node, data in dag.nodes(data=True)}
+    edges = {(labels[lo], labels[hi]): weight for lo, hi, weight in dag.edges(data="weight")}
+    # the A after B and the tail after it are merged with the first A
+    assert sorted(labels.values()) == ["A", "B", "ROOT", "x", "y"]
+    assert edges == {("ROOT", "A"): 2, ("ROOT", "B"): 2, ("B", "A"): 1, ("A", "x"): 3, ("x", "y"): 3}
+
+    (a_node,) = [node for node, label in labels.items() if label == "A"]
+    data = dag.nodes[a_node]
+    assert (data["n_merged"], data["min_token_index"], data["token_index"]) == (2, 0, 1)
+    assert data["mean_logprob"] == pytest.approx((-0.1 - 0.5 - 0.1) / 3)
+    assert data["min_logprob"] == -0.5
+    (x_node,) = [node for node, label in labels.items() if label == "x"]
+    assert dag.nodes[x_node]["mean_logprob"] == pytest.approx((-0.2 - 0.6 - 0.4) / 3)
+    assert dag.edges[a_node, x_node]["mean_logprob"] == pytest.approx((-0.2 - 0.6 - 0.4) / 3)
+    # the root splits its four choices evenly
+    assert dag.nodes[0]["entropy"] == pytest.approx(np.log(2))
+
+
+def test_minimize_rejects_alternatives(completions):
+    trie = build_trie(build_token_table(completions), add_alternatives=True)
+    with pytest.raises(ValueError, match="alternatives"):
+        minimize_trie(trie)
+
+
+def test_parallel_dag_matches_serial(completions):
+    serial = build_token_dag(completions)
+    parallel = build_token_dag(completions, n_workers=2)
+    assert list(parallel.nodes(data=True)) == list(serial.nodes(data=True))
+    assert list(parallel.edges(data=True)) == list(serial.edges(data=True))
@@ -0,0 +1,131 @@
+import csv
+import json
+
+import networkx as nx
+import pytest
+
+from ztnd.exports import export_graph
+from ztnd.exports import write_gexf
+from ztnd.exports import write_graphml
+from ztnd.exports import write_node_link_json
+from ztnd.exports import write_sankey_table
+from ztnd.graphs import build_graph_arrays
+from ztnd.graphs import build_token_graph
+from ztnd.graphs import build_token_pos_tree
+from ztnd.layout import set_bfs_level_layout
+from ztnd.layout import set_tree_layout_arrays
+from ztnd.tokens import build_token_table
+
+
+GRAPH_TYPES = [
+    ("token", {}),
+    ("token_pos", {}),
+    ("token_pos_tree", {}),
+    ("token_pos_tree", {"add_alternatives": True}),
+]
+
+
+@pytest.fixture
+def table(completions):
+    table = build_token_table(completions)
+    # a token with characters that need escaping and one XML cannot hold
+    table.vocab[3] = "a<b>&\"\x01'"
+    return table
+
+
+def build_graphs(table, graph_type: str, kwargs: dict):
+    arrays = build_graph_arrays(table, graph_type, **kwargs)
+    if graph_type == "token_pos_tree":
+        graph = build_token_pos_tree(table, **kwargs)
+        set_bfs_level_layout(graph, 0, "token_index")
+        set_tree_layout_arrays(arrays)
+    else:
+        graph = build_token_graph(table, graph_type=graph_type)
+    return arrays, graph
+
+
+def get_xml_safe(graph: nx.DiGraph) -> nx.DiGraph:
+    # what the exporters write for characters XML cannot hold
+    graph = graph.copy()
+    for _, data in graph.nodes(data=True):
+        for name in ("id", "label"):
+            data[name] = data[name].replace("\x01", "\ufffd")
+    return graph
+
+
+def normalize(graph: nx.DiGraph) -> tuple[list, list]:
+    def items(data: dict) -> list:
+        return sorted((name, round(value, 9) if isinstance(value, float) else value) for name, value in data.items())
+
+    return (
+        sorted((str(node), items(data)) for node, data in graph.nodes(data=True)),
+        sorted((str(lo), str(hi), items(data)) for lo, hi, data in graph.edges(data=True)),
+    )
+
+
+@pytest.mark.parametrize("graph_type, kwargs", GRAPH_TYPES)
+def test_node_link_json_matches_networkx(table, tmp_path, graph_type, kwargs):
+    arrays, graph = build_graphs(table, graph_type, kwargs)
+    write_node_link_json(arrays, tmp_path / "graph.json")
+    with (tmp_path / "graph.json").open() as fp:
+        data = json.load(fp)
+    assert data == json.loads(json.dumps(nx.node_link_data(graph, edges="edges")))
+
+
+@pytest.mark.parametrize("graph_type, kwargs", GRAPH_TYPES)
+@pytest.mark.parametrize("suffix, write, read", [
+    ("gexf", nx.write_gexf, nx.read_gexf),
+    ("graphml", nx.write_graphml, nx.read_graphml),
+])
+def test_xml_matches_networkx(table, tmp_path, graph_type, kwargs, suffix, write, read):
+    arrays, graph = build_graphs(table, graph_type, kwargs)
+    export_graph(arrays, tmp_path / f"graph.{suffix}")
+    write(get_xml_safe(graph), tmp_path / f"expected.{suffix}")
+    exported = read(tmp_path / f"graph.{suffix}")
+    assert exported.number_of_nodes() == graph.number_of_nodes()
+    assert normalize(exported) == normalize(read(tmp_path / f"expected.{suffix}"))
+
+
+def test_gexf_ids_and_labels(table, tmp_path):
+    arrays, graph = build_graphs(table, "token_pos_tree", {})
+    write_gexf(arrays, tmp_path / "graph.gexf")
+    exported = nx.read_gexf(tmp_path / "graph.gexf")
+    # nodes are keyed by their "id" attribute and keep their label
+    graph = get_xml_safe(graph)
+    assert any(data["label"] == "a<b>&\"\ufffd'" for _, data in graph.nodes(data=True))
+    assert sorted(exported.nodes) == sorted(data["id"] for _, data in graph.nodes(data=True))
+    for _, data in graph.nodes(data=True):
+        assert exported.nodes[data["id"]]["label"] == data["label"]
+    lo, hi, weight = next(iter(graph.edges(data="weight")))
+    assert exported.edges[graph.nodes[lo]["id"], graph.nodes[hi]["id"]]["weight"] == weight
+
+
+def test_graphml_keeps_types(table, tmp_path):
+    arrays, graph = build_graphs(table, "token", {})
+    write_graphml(arrays, tmp_path / "graph.graphml")
+    exported = nx.read_graphml(tmp_path / "graph.graphml", node_type=int)
+    for node, data in graph.nodes(data=True):
+        assert exported.nodes[node]["label"] == data["label"].replace("\x01", "\ufffd")
+        assert exported.nodes[node]["mean_logprob"] == data["mean_logprob"]
+    for lo, hi, weight in graph.edges(data="weight"):
+        assert exported.edges[lo, hi]["weight"] == weight
+        assert isinstance(exported.edges[lo, hi]["weight"], int)
+
+
+def test_sankey_table(table, tmp_path):
+    arrays, graph = build_graphs(table, "token_pos", {})
+    write_sankey_table(arrays, tmp_path / "graph.csv")
+    with (tmp_path / "graph.csv").open(newline="", encoding="utf-8") as fp:
+        rows = list(csv.reader(fp))
+    assert rows[0] == ["source", "target", "value", "source_label", "target_label"]
+    assert len(rows) == graph.number_of_edges() + 1
+    for source, target, value, source_label, target_label in rows[1:]:
+        lo, hi = int(source), int(target)
+        assert int(value) == graph.edges[lo, hi]["weight"]
+        assert (source_label, target_label) == (graph.nodes[lo]["label"], graph.nodes[hi]["label"])
+
+
+def test_export_graph_checks_suffix(table, tmp_path):
+    arrays, _ = build_graphs(table, "token", {})
+    with pytest.raises(ValueError, match="no exporter"):
+        export_graph(arrays, tmp_path / "graph.dot")
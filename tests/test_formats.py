@@ -0,0 +1,110 @@
+import json
+import logging
+
+import networkx as nx
+import numpy as np
+import pytest
+
+from ztnd.formats import GraphArrays
+from ztnd.formats import read_graph
+from ztnd.formats import write_graph
+from ztnd.graphs import build_token_dag
+from ztnd.graphs import build_token_graph
+from ztnd.graphs import build_token_pos_tree
+
+
+GRAPH_BUILDERS = {
+    "token": lambda completions: build_token_graph(completions, graph_type="token"),
+    "token_pos_tree": lambda completions: build_token_pos_tree(completions, add_alternatives=True),
+    "token_dag": build_token_dag,
+}
+
+
+def assert_graphs_equal(graph: nx.DiGraph, expected: nx.DiGraph, drop_ids: bool = False) -> None:
+    # same nodes, edges (in adjacency order) and attributes
+    if drop_ids:
+        expected = expected.copy()
+        for _, data in expected.nodes(data=True):
+            del data["id"]
+    assert graph.graph == expected.graph
+    assert list(graph.nodes(data=True)) == list(expected.nodes(data=True))
+    assert list(graph.edges(data=True)) == list(expected.edges(data=True))
+
+
+@pytest.fixture(params=list(GRAPH_BUILDERS))
+def graph(request, completions):
+    graph = GRAPH_BUILDERS[request.param](completions)
+    graph.graph["graph_type"] = request.param
+    # a label that is not ascii and one that is not in the token vocab
+    graph.nodes[1]["label"] = "caf\u00e9 \U0001f600"
+    return graph
+
+
+def test_digraph_round_trip(graph):
+    arrays = GraphArrays.from_digraph(graph)
+    assert (arrays.n_nodes, arrays.n_edges) == (graph.number_of_nodes(), graph.number_of_edges())
+    assert "label" in arrays.node_str_attrs and "weight" in arrays.edge_attrs
+    assert_graphs_equal(arrays.to_digraph(), graph)
+
+
+@pytest.mark.parametrize("mmap", [True, False])
+def test_save_load_round_trip(graph, tmp_path, mmap):
+    arrays = GraphArrays.from_digraph(graph)
+    arrays.save(tmp_path / "graph.ztnd")
+    loaded = GraphArrays.load(tmp_path / "graph.ztnd", mmap=mmap)
+
+    assert loaded.strings == arrays.strings
+    assert loaded.graph_attrs == arrays.graph_attrs
+    for name in ["indptr", "indices"]:
+        assert np.array_equal(getattr(loaded, name), getattr(arrays, name))
+    for kind in ["node_attrs", "node_str_attrs", "edge_attrs", "edge_str_attrs"]:
+        loaded_attrs = getattr(loaded, kind)
+        assert list(loaded_attrs) == list(getattr(arrays, kind))
+        for name, arr in getattr(arrays, kind).items():
+            assert loaded_attrs[name].dtype == arr.dtype
+            assert np.array_equal(loaded_attrs[name], arr)
+    # memory mapped arrays are read-only views of the files
+    assert isinstance(loaded.indices, np.memmap) == mmap
+    if mmap:
+        with pytest.raises(ValueError):
+            loaded.node_attrs["mean_logprob"][0] = 1.0
+    assert_graphs_equal(loaded.to_digraph(), graph)
+
+
+@pytest.mark.parametrize("suffix", [".ztnd", ".json"])
+def test_write_read_graph(graph, tmp_path, suffix):
+    write_graph(graph, tmp_path / f"graph{suffix}")
+    # node-link data keeps the node key under "id", which replaces the
+    # "id" attribute
+    assert_graphs_equal(read_graph(tmp_path / f"graph{suffix}"), graph, drop_ids=suffix == ".json")
+
+
+def test_load_checks_format(completions, tmp_path):
+    GraphArrays.from_digraph(build_token_pos_tree(completions)).save(tmp_path)
+    meta = json.loads((tmp_path / "meta.json").read_text())
+    (tmp_path / "meta.json").write_text(json.dumps(meta | {"version": meta["version"] + 1}))
+    with pytest.raises(ValueError, match="unsupported"):
+        GraphArrays.load(tmp_path)
+    (tmp_path / "meta.json").write_text(json.dumps(meta | {"format": "other"}))
+    with pytest.raises(ValueError, match="is not a"):
+        GraphArrays.load(tmp_path)
+
+
+def test_from_digraph_needs_integer_nodes():
+    graph = nx.DiGraph([("a", "b")])
+    with pytest.raises(ValueError):
+        GraphArrays.from_digraph(graph)
+    with pytest.raises(ValueError):
+        GraphArrays.from_digraph(nx.DiGraph([(1, 0)]))
+
+
+def test_from_digraph_drops_mixed_attributes(caplog):
+    graph = nx.DiGraph()
+    graph.add_nodes_from([(0, {"score": 1, "name": "a"}), (1, {"score": 0.5, "name": 2})])
+    graph.add_edge(0, 1, tags=[1])
+    with caplog.at_level(logging.WARNING):
+        arrays = GraphArrays.from_digraph(graph)
+    # ints and floats mix into a float column
+    assert arrays.node_attrs["score"].tolist() == [1.0, 0.5]
+    assert "name" not in arrays.node_str_attrs and "tags" not in arrays.edge_attrs
+    assert len(caplog.records) == 2
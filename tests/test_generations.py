@@ -0,0 +1,337 @@
+import json
+import logging
+import tracemalloc
+
+import networkx as nx
+import openai
+import pytest
+import tiktoken
+
+from conftest import FakeOpenAIServer
+from conftest import make_completions
+from ztnd.generations import END_TOKEN
+from ztnd.generations import NgramModel
+from ztnd.generations import ResponseCache
+from ztnd.generations import append_completion
+from ztnd.generations import check_store_params
+from ztnd.generations import count_completions
+from ztnd.generations import create_completions
+from ztnd.generations import get_request_params
+from ztnd.generations import get_store_appender
+from ztnd.generations import get_store_params_path
+from ztnd.generations import iter_completions
+from ztnd.generations import read_store_calls
+from ztnd.generations import synthesize_completions
+from ztnd.generations import truncate_partial_line
+from ztnd.graphs import build_token_dag
+from ztnd.graphs import build_token_graph
+from ztnd.graphs import build_token_pos_tree
+from ztnd.tokens import load_token_table
+
+
+MESSAGES = [{"role": "user", "content": ""}]
+
+
+def fetch(server, **kwargs):
+    kwargs = {"max_completion_tokens": 8, "base_url": server.base_url} | kwargs
+    return create_completions(MESSAGES, **kwargs)
+
+
+def test_concurrent_results_in_call_order(fake_server):
+    # earlier requests answer later, so completions arrive out of order
+    fake_server.delays = {0: 0.3, 1: 0.2, 2: 0.1}
+    delivered = []
+    completions = fetch(
+        fake_server,
+        n_api_calls=8,
+        max_concurrency=4,
+        on_completion=lambda completion, call_index: delivered.append((call_index, completion.id)),
+    )
+    assert len(completions) == 8
+    assert [completion.id for completion in completions] == [cid for _, cid in sorted(delivered)]
+    assert [call_index for call_index, _ in delivered] != list(range(8))
+    assert 1 < fake_server.max_active <= 4
+
+
+def test_retries_rate_limit_and_server_errors(fake_server, fake_clock):
+    fake_server.statuses = {0: 429, 1: 500, 2: 429}
+    completions = fetch(fake_server, n_api_calls=2, max_retries=5, backoff_base=1.0)
+    assert len(completions) == 2
+    assert len(fake_server.requests) == 5
+    # exponential backoff with jitter in [delay / 2, delay]
+    assert len(fake_clock.sleeps) == 3
+    for attempt, delay in enumerate(fake_clock.sleeps):
+        assert 2**attempt / 2 <= delay <= 2**attempt
+
+
+def test_backoff_is_capped(fake_server, fake_clock):
+    fake_server.statuses = {0: 429, 1: 429, 2: 429}
+    fetch(fake_server, max_retries=3, backoff_base=10.0, backoff_max=15.0)
+    assert max(fake_clock.sleeps) <= 15.0
+
+
+def test_retries_exhausted(fake_server, fake_clock):
+    fake_server.statuses = {0: 429, 1: 429, 2: 429}
+    with pytest.raises(openai.RateLimitError):
+        fetch(fake_server, max_retries=2)
+    assert len(fake_server.requests) == 3
+
+
+def test_client_errors_are_not_retried(fake_server, fake_clock):
+    fake_server.statuses = {0: 400}
+    with pytest.raises(openai.BadRequestError):
+        fetch(fake_server, max_retries=5)
+    assert len(fake_server.requests) == 1
+    assert fake_clock.sleeps == []
+
+
+def test_token_budget_stops_calls(fake_server, fake_clock):
+    # each call reserves 1 + 8 tokens, the budget holds two calls and
+    # refills one every 30 seconds
+    completions = fetch(fake_server, n_api_calls=4, tokens_per_minute=18)
+    assert len(completions) == 4
+    assert fake_clock.sleeps == pytest.approx([30.0, 30.0])
+
+
+def test_token_budget_lets_large_calls_through(fake_server, fake_clock):
+    # a call larger than the budget waits for a full bucket instead of
+    # blocking forever
+    completions = fetch(fake_server, n_api_calls=2, tokens_per_minute=5)
+    assert len(completions) == 2
+    assert fake_clock.sleeps == pytest.approx([60.0])
+
+
+def test_store_skips_truncated_last_line(tmp_path):
+    store_path = tmp_path / "completions.jsonl"
+    completions = make_completions(4)
+    for call_index, completion in enumerate(completions[:3]):
+        append_completion(completion, store_path, call_index=call_index)
+    # a crash in the middle of writing the fourth record
+    with store_path.open("a") as fp:
+        fp.write(completions[3].model_dump_json()[:100])
+
+    assert [completion.id for completion in iter_completions(store_path)] == [el.id for el in completions[:3]]
+    assert count_completions(store_path) == 3
+    assert read_store_calls(store_path) == {0, 1, 2}
+
+    truncate_partial_line(store_path)
+    append_completion(completions[3], store_path, call_index=3)
+    assert [completion.id for completion in iter_completions(store_path)] == [el.id for el in completions]
+
+
+def resume_store(server, store_path, n_api_calls, **kwargs):
+    kwargs = {"max_completion_tokens": 8, "base_url": server.base_url} | kwargs
+    check_store_params(store_path, get_request_params(MESSAGES, **kwargs))
+    truncate_partial_line(store_path)
+    done_calls = read_store_calls(store_path)
+    return create_completions(
+        MESSAGES,
+        **kwargs,
+        on_completion=get_store_appender(store_path, done_calls),
+        call_indices=[ii for ii in range(n_api_calls) if ii not in done_calls],
+    )
+
+
+def test_resume_makes_only_missing_calls(fake_server, tmp_path):
+    store_path = tmp_path / "completions.jsonl"
+    resume_store(fake_server, store_path, 3)
+    with store_path.open("a") as fp:
+        fp.write('{"id": "chatcmpl-partial"')
+    assert len(fake_server.requests) == 3
+
+    resumed = resume_store(fake_server, store_path, 7, max_concurrency=3)
+    assert len(resumed) == 4
+    assert len(fake_server.requests) == 7
+    assert sorted(read_store_calls(store_path)) == list(range(7))
+    assert count_completions(store_path) == 7
+    # nothing is left to fetch
+    assert resume_store(fake_server, store_path, 7) == []
+    assert len(fake_server.requests) == 7
+
+
+def test_resume_refuses_other_request_params(fake_server, tmp_path):
+    store_path = tmp_path / "completions.jsonl"
+    resume_store(fake_server, store_path, 2, temperature=0.4)
+    params = json.loads(get_store_params_path(store_path).read_text())
+    assert params["temperature"] == 0.4
+    assert params["max_completion_tokens"] == 8
+
+    with pytest.raises(ValueError, match="temperature"):
+        resume_store(fake_server, store_path, 4, temperature=0.7)
+    with pytest.raises(ValueError, match="n, seed"):
+        resume_store(fake_server, store_path, 4, temperature=0.4, n_choices_per_call=2, seed=1)
+    assert len(fake_server.requests) == 2
+    assert count_completions(store_path) == 2
+    # settings that do not change the completions may differ
+    resume_store(fake_server, store_path, 4, temperature=0.4, max_concurrency=2)
+    assert count_completions(store_path) == 4
+
+
+def test_iter_completions_streams(tmp_path):
+    store_path = tmp_path / "completions.jsonl"
+    with store_path.open("w") as fp:
+        for completion in make_completions(300, n=10, max_tokens=16):
+            fp.write(completion.model_dump_json() + "\n")
+
+    tracemalloc.start()
+    try:
+        n_completions = sum(1 for _ in iter_completions(store_path))
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert n_completions == 300
+    # one completion at a time, not the parsed store
+    assert peak < store_path.stat().st_size / 4
+
+
+REQUEST = get_request_params(MESSAGES) | {"call_index": 0}
+
+
+def test_cache_hit_and_miss(tmp_path):
+    cache = ResponseCache(tmp_path)
+    completion = make_completions(1)[0]
+    assert cache.get(REQUEST) is None
+    cache.put(REQUEST, completion)
+    assert cache.get(REQUEST) == completion
+    # entries are found again by a new cache on the same directory
+    assert ResponseCache(tmp_path).get(REQUEST) == completion
+    assert cache.report() | {"bytes": 0} == {
+        "hits": 1, "misses": 1, "hit_rate": 0.5, "evictions": 0, "entries": 1, "bytes": 0,
+    }
+
+
+@pytest.mark.parametrize("key, value", [
+    ("messages", [{"role": "user", "content": "other"}]),
+    ("model", "other"),
+    ("top_logprobs", 5),
+    ("n", 2),
+    ("seed", 1),
+    ("temperature", 0.5),
+    ("base_url", "http://localhost:1/v1"),
+    ("call_index", 1),
+])
+def test_cache_key_covers_request(tmp_path, key, value):
+    cache = ResponseCache(tmp_path)
+    cache.put(REQUEST, make_completions(1)[0])
+    assert cache.get(REQUEST | {key: value}) is None
+    assert cache.get(REQUEST) is not None
+
+
+def test_cache_serves_calls_by_index_and_base_url(fake_server, tmp_path):
+    cache = ResponseCache(tmp_path)
+    first = fetch(fake_server, n_api_calls=3, cache=cache)
+    # calls 1 and 2 are cached, call 3 is not
+    again = fetch(fake_server, n_api_calls=3, first_call_index=1, cache=cache)
+    assert [el.id for el in again[:2]] == [el.id for el in first[1:]]
+    assert len(fake_server.requests) == 4
+    # the same calls to another endpoint are not served from the cache
+    with FakeOpenAIServer() as other_server:
+        fetch(other_server, n_api_calls=3, cache=cache)
+        assert len(other_server.requests) == 3
+    assert cache.hits == 2
+
+
+def test_cache_evicts_least_recently_used(tmp_path, fake_clock):
+    completion = make_completions(1)[0]
+    requests = [REQUEST | {"call_index": ii} for ii in range(4)]
+    cache = ResponseCache(tmp_path)
+    cache.put(requests[0], completion)
+    entry_bytes = cache.total_bytes
+    cache.max_bytes = 3 * entry_bytes
+
+    for request in requests[1:3]:
+        fake_clock.sleep(1.0)
+        cache.put(request, completion)
+    fake_clock.sleep(1.0)
+    # refresh call 0, so call 1 is now the least recently used
+    assert cache.get(requests[0]) is not None
+    fake_clock.sleep(1.0)
+    cache.put(requests[3], completion)
+
+    assert cache.evictions == 1
+    assert cache.total_bytes == 3 * entry_bytes
+    assert cache.get(requests[1]) is None
+    assert not cache.get_path(cache.get_key(requests[1])).exists()
+    for ii in [0, 2, 3]:
+        assert cache.get(requests[ii]) is not None
+
+
+def test_cache_entry_removed_on_disk_is_a_miss(tmp_path):
+    cache = ResponseCache(tmp_path)
+    cache.put(REQUEST, make_completions(1)[0])
+    cache.get_path(cache.get_key(REQUEST)).unlink()
+    assert cache.get(REQUEST) is None
+    assert cache.report()["entries"] == 0
+    assert cache.total_bytes == 0
+
+
+CORPUS = ["the cat sat on the mat.", "the cat sat on a hat.", "a dog sat on the mat!", "the café is open."]
+
+
+@pytest.fixture
+def ngram_model():
+    # a byte level encoding with a few merges, BPE files are not downloaded
+    # in tests
+    ranks = {bytes([byte]): byte for byte in range(256)}
+    for merge in [b" t", b"he", b" the", b" a", b" cat", b" sat", b" on", b" mat", b"caf"]:
+        ranks[merge] = len(ranks)
+    encoding = tiktoken.Encoding(
+        "test",
+        pat_str=r"""'s|'t|'re|'ve|'m|'ll|'d| ?\p{L}+| ?\p{N}+| ?[^\s\p{L}\p{N}]+|\s+(?!\S)|\s+""",
+        mergeable_ranks=ranks,
+        special_tokens={},
+    )
+    return NgramModel(encoding, order=3).fit(CORPUS * 3)
+
+
+def test_ngram_top_keeps_n_without_end(ngram_model):
+    # a sentence end is always followed by the end of the document
+    levels = ngram_model.get_levels(tuple(ngram_model.encoding.encode_ordinary("the mat.")))
+    top = ngram_model.get_top(levels, 2, with_end=True)
+    assert top[0][0] == END_TOKEN
+    assert len(ngram_model.get_top(levels, 2)) == 2
+    assert END_TOKEN not in [tid for tid, _ in ngram_model.get_top(levels, 2)]
+
+    # END_TOKEN is the most frequent unigram, the next n are still found
+    unigram_model = NgramModel(ngram_model.encoding, order=1).fit(["a", "a", "ab", "b"])
+    top = unigram_model.get_top(unigram_model.get_levels(()), 2)
+    assert [unigram_model.get_token(tid)[0] for tid, _ in top] == ["a", "b"]
+
+
+def test_synthesize_logs_call_index(ngram_model, caplog):
+    with caplog.at_level(logging.INFO, logger="ztnd.generations"):
+        synthesize_completions(MESSAGES, ngram_model, n_api_calls=2, first_call_index=5)
+    assert [record.message.split()[0] for record in caplog.records] == ["n_api_call=5", "n_api_call=6"]
+
+
+def test_synthesized_completions_build_graphs(ngram_model, tmp_path):
+    store_path = tmp_path / "completions.jsonl"
+    completions = synthesize_completions(
+        [{"role": "user", "content": "the cat"}],
+        ngram_model,
+        top_logprobs=2,
+        max_completion_tokens=10,
+        n_choices_per_call=8,
+        n_api_calls=5,
+        on_completion=lambda completion, call_index: append_completion(completion, store_path, call_index),
+    )
+    for completion in completions:
+        for choice in completion.choices:
+            content = choice.logprobs.content
+            # byte level tokens can split a character, like the API's
+            data = bytes(byte for token in content for byte in token.bytes)
+            assert data.decode("utf-8", errors="replace") == choice.message.content
+            assert all(len(token.top_logprobs) == 2 for token in content)
+            assert len(content) == 10 or choice.finish_reason == "stop"
+
+    table = load_token_table(store_path)
+    assert table.n_choices == 40
+    assert len(table) == sum(completion.usage.completion_tokens for completion in completions)
+    graphs = [
+        (build_token_graph(table, graph_type="token"), build_token_graph(completions, graph_type="token")),
+        (build_token_pos_tree(table), build_token_pos_tree(completions)),
+        (build_token_dag(table), build_token_dag(completions)),
+    ]
+    for graph, expected in graphs:
+        assert graph.number_of_nodes() > 1
+        assert nx.utils.graphs_equal(graph, expected)
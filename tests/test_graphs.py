@@ -0,0 +1,70 @@
+import pytest
+
+from conftest import make_completions
+from ztnd.graphs import TokenGraphIndex
+from ztnd.graphs import build_token_graph
+from ztnd.graphs import build_token_pos_tree
+from ztnd.graphs import update_token_graph
+from ztnd.graphs import update_token_pos_tree
+from ztnd.tokens import build_token_table
+from ztnd.trie import TokenTrie
+
+
+def rounded(data: dict) -> dict:
+    # incremental stats sum in a different order than a full build
+    return {key: round(value, 9) if isinstance(value, float) else value for key, value in data.items()}
+
+
+def canonical(graph) -> tuple[list, dict]:
+    nodes = [(node, rounded(data)) for node, data in graph.nodes(data=True)]
+    edges = {(lo, hi): rounded(data) for lo, hi, data in graph.edges(data=True)}
+    return nodes, edges
+
+
+def get_batches(completions: list) -> list[list]:
+    # one large batch and then single completions, which touch few of the
+    # existing nodes and edges
+    return [completions[:30]] + [[completion] for completion in completions[30:]]
+
+
+@pytest.fixture
+def single_choice_completions():
+    return make_completions(50, n=1)
+
+
+@pytest.mark.parametrize("graph_type", ["token", "token_pos"])
+def test_updated_token_graph_matches_full_build(single_choice_completions, graph_type):
+    completions = single_choice_completions
+    expected = build_token_graph(completions, graph_type=graph_type)
+
+    batches = get_batches(completions)
+    index = TokenGraphIndex(graph_type)
+    index.add_table(build_token_table(batches[0]))
+    graph = index.to_digraph()
+    for batch in batches[1:]:
+        update_token_graph(graph, index, batch)
+    assert canonical(graph) == canonical(expected)
+    assert canonical(index.to_digraph()) == canonical(expected)
+
+
+def test_updated_tree_matches_full_build(single_choice_completions):
+    completions = single_choice_completions
+    expected = build_token_pos_tree(completions)
+
+    batches = get_batches(completions)
+    trie = TokenTrie()
+    trie.add_table(build_token_table(batches[0]))
+    graph = trie.to_digraph()
+    for batch in batches[1:]:
+        update_token_pos_tree(graph, trie, batch)
+    assert canonical(graph) == canonical(expected)
+    assert canonical(trie.to_digraph()) == canonical(expected)
+
+
+@pytest.mark.parametrize("graph_type", ["token", "token_pos"])
+@pytest.mark.parametrize("n_workers", [2, 3])
+def test_parallel_token_graph_matches_serial(completions, graph_type, n_workers):
+    expected = build_token_graph(completions, graph_type=graph_type, add_token_ids=True)
+    graph = build_token_graph(completions, graph_type=graph_type, add_token_ids=True, n_workers=n_workers)
+    assert canonical(graph) == canonical(expected)
+    assert list(graph.edges) == list(expected.edges)
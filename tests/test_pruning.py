@@ -0,0 +1,118 @@
+import networkx as nx
+import numpy as np
+import pytest
+
+from ztnd.graphs import build_graph_arrays
+from ztnd.pruning import compact_chains
+from ztnd.pruning import prune_tree
+from ztnd.tokens import build_token_table
+
+
+@pytest.fixture
+def tree(completions):
+    return build_graph_arrays(build_token_table(completions), "token_pos_tree")
+
+
+def get_out_weight(graph: nx.DiGraph, node) -> float:
+    return sum(data["weight"] for _, _, data in graph.out_edges(node, data=True))
+
+
+def get_paths(graph: nx.DiGraph) -> list[tuple[str, int]]:
+    # concatenated label and weight of every root to leaf path
+    paths = []
+    for leaf in graph:
+        if graph.out_degree(leaf) == 0:
+            path = nx.shortest_path(graph, 0, leaf)
+            label = "".join(graph.nodes[node]["label"] for node in path[1:])
+            paths.append((label, graph.edges[path[-2], path[-1]]["weight"]))
+    return sorted(paths)
+
+
+@pytest.mark.parametrize("min_weight, top_k", [(3, None), (0, 2), (2, 1)])
+def test_prune_conserves_weight(tree, min_weight, top_k):
+    graph = tree.to_digraph()
+    pruned = prune_tree(tree, min_weight=min_weight, top_k=top_k).to_digraph()
+    assert nx.is_arborescence(pruned)
+    assert 1 < pruned.number_of_nodes() < graph.number_of_nodes()
+    old_ids = {data["id"]: node for node, data in graph.nodes(data=True)}
+    for node, data in pruned.nodes(data=True):
+        if data["aggregated"] == 0:
+            # a kept node has all its weight below it, in kept children
+            # and one aggregate
+            assert get_out_weight(pruned, node) == get_out_weight(graph, old_ids[data["id"]])
+        for _, child in pruned.out_edges(node):
+            weight = pruned.edges[node, child]["weight"]
+            assert weight >= min_weight or pruned.nodes[child]["aggregated"] > 0
+
+
+def test_prune_aggregates_dropped_children(tree):
+    graph = tree.to_digraph()
+    pruned = prune_tree(tree, top_k=1).to_digraph()
+    old_ids = {data["id"]: node for node, data in graph.nodes(data=True)}
+    n_aggregates = 0
+    for node, data in pruned.nodes(data=True):
+        if data["aggregated"] == 0:
+            continue
+        n_aggregates += 1
+        parent = old_ids[data["id"].removesuffix("|more")]
+        kept = {pruned.nodes[child]["id"] for child in pruned.successors(next(pruned.predecessors(node)))}
+        dropped = [child for child in graph.successors(parent) if graph.nodes[child]["id"] not in kept]
+        weights = np.array([graph.edges[parent, child]["weight"] for child in dropped])
+        mean_logprobs = np.array([graph.nodes[child]["mean_logprob"] for child in dropped])
+
+        assert data["aggregated"] == len(dropped) == graph.out_degree(parent) - 1
+        assert data["label"] == f"<{len(dropped)} more>"
+        assert data["token_index"] == graph.nodes[parent]["token_index"] + 1
+        assert pruned.out_degree(node) == 0
+        edge = pruned.edges[next(pruned.predecessors(node)), node]
+        assert edge["weight"] == weights.sum()
+        assert edge["aggregated"] == len(dropped)
+        assert data["prob_mass"] == pytest.approx(sum(graph.nodes[child]["prob_mass"] for child in dropped))
+        assert data["min_logprob"] == min(graph.nodes[child]["min_logprob"] for child in dropped)
+        assert data["mean_logprob"] == pytest.approx((weights * mean_logprobs).sum() / weights.sum())
+    assert n_aggregates > 0
+
+
+def test_prune_max_depth(tree):
+    graph = tree.to_digraph()
+    depth = nx.shortest_path_length(graph, 0)
+    for aggregate in [True, False]:
+        pruned = prune_tree(tree, max_depth=3, aggregate=aggregate).to_digraph()
+        # cutting by depth alone drops whole levels without aggregates
+        assert sorted(data["id"] for _, data in pruned.nodes(data=True)) == sorted(
+            graph.nodes[node]["id"] for node in graph if depth[node] <= 3
+        )
+        assert max(nx.shortest_path_length(pruned, 0).values()) == 3
+
+    pruned = prune_tree(tree, top_k=1, max_depth=2).to_digraph()
+    # aggregates stand in for dropped siblings, never for cut levels
+    assert max(nx.shortest_path_length(pruned, 0).values()) == 2
+    for node, data in pruned.nodes(data=True):
+        if data["aggregated"] > 0:
+            assert data["token_index"] <= 1
+
+
+def test_compact_chains(tree):
+    graph = tree.to_digraph()
+    arrays = compact_chains(tree)
+    compacted = arrays.to_digraph()
+    assert nx.is_arborescence(compacted)
+    assert compacted.number_of_nodes() < graph.number_of_nodes()
+    assert arrays.node_attrs["n_tokens"].sum() == graph.number_of_nodes()
+    assert get_paths(compacted) == get_paths(graph)
+
+    old_ids = {data["id"]: node for node, data in graph.nodes(data=True)}
+    n_chains = 0
+    for node, data in compacted.nodes(data=True):
+        head = old_ids[data["id"]]
+        chain = [head]
+        for _ in range(data["n_tokens"] - 1):
+            chain.extend(graph.successors(chain[-1]))
+        assert "".join(graph.nodes[el]["label"] for el in chain) == data["label"]
+        mean_logprobs = [graph.nodes[el]["mean_logprob"] for el in chain]
+        assert data["chain_logprob"] == pytest.approx(sum(mean_logprobs))
+        assert data["mean_logprob"] == pytest.approx(np.mean(mean_logprobs))
+        assert data["min_logprob"] == min(graph.nodes[el]["min_logprob"] for el in chain)
+        assert data["entropy"] == graph.nodes[chain[-1]]["entropy"]
+        n_chains += data["n_tokens"] > 1
+    assert n_chains > 0
@@ -0,0 +1,101 @@
+import pytest
+
+from conftest import make_token_completion
+from ztnd.graphs import build_token_pos_tree
+from ztnd.queries import build_token_tree_index
+
+
+# (tokens, logprobs) of every choice of two completions, "The cat" comes
+# in two tokenizations
+CHOICES = [
+    [
+        (["The", " cat", " sat"], [-0.1, -0.5, -1.0]),
+        (["The", " cat", " ran"], [-0.3, -0.7, -2.0]),
+        (["The", " dog"], [-0.2, -1.5]),
+    ],
+    [
+        (["Th", "e", " cat", " sat"], [-3.0, -0.1, -0.4, -0.9]),
+        ([], []),
+    ],
+]
+
+
+@pytest.fixture(params=[1, 2])
+def index(request):
+    completions = [make_token_completion(f"chatcmpl-{ii}", choices) for ii, choices in enumerate(CHOICES)]
+    return build_token_tree_index(completions, n_workers=request.param)
+
+
+def test_prefix_counts(index):
+    assert len(index) == 10
+    assert index.count([]) == 4
+    assert index.count(["The"]) == 3
+    assert index.count(["The", " cat"]) == 2
+    assert index.count(["Th", "e", " cat", " sat"]) == 1
+    assert index.count(["The", " sat"]) == 0
+    assert index.find(["The", " bird"]) is None
+    assert index.find(["bird"]) is None
+
+
+def test_text_prefix_counts(index):
+    # every tokenization counts, also when the text ends inside a token
+    assert sorted(index.find_text("The cat")) == sorted([index.find(["The", " cat"]), index.find(["Th", "e", " cat"])])
+    assert index.count_text("The") == 4
+    assert index.count_text("The c") == 3
+    assert index.count_text("T") == 4
+    assert index.count_text("The cat s") == 2
+    assert index.count_text("A") == 0
+    assert index.find_text("The ca") == []
+
+
+def test_path_logprob(index):
+    # mean logprob of "The" is -0.2 and of " cat" after it -0.6
+    assert index.get_path_logprob(["The"]) == pytest.approx(-0.2)
+    assert index.get_path_logprob(["The", " cat", " sat"]) == pytest.approx(-0.2 - 0.6 - 1.0)
+    assert index.get_path_logprob(["Th", "e", " cat", " sat"]) == pytest.approx(-3.0 - 0.1 - 0.4 - 0.9)
+    assert index.get_path_logprob(["The", " sat"]) is None
+
+
+def test_top_children(index):
+    cat, dog = index.top_children(["The"])
+    assert (cat.token, cat.count, cat.nodes) == (" cat", 2, [index.find(["The", " cat"])])
+    assert cat.prob == pytest.approx(2 / 3) and cat.mean_logprob == pytest.approx(-0.6)
+    assert (dog.token, dog.count, dog.mean_logprob) == (" dog", 1, pytest.approx(-1.5))
+    assert [el.token for el in index.top_children(["The"], n=1)] == [" cat"]
+    assert [el.token for el in index.top_children([], n=5)] == ["The", "Th"]
+    assert index.top_children(["The", " dog"]) == []
+    assert index.top_children(["bird"]) == []
+
+
+def test_top_continuations(index):
+    sat, ran = index.top_continuations("The cat")
+    # summed over both tokenizations of "The cat"
+    assert (sat.token, sat.count, sat.prob) == (" sat", 2, pytest.approx(2 / 3))
+    assert sat.mean_logprob == pytest.approx((-1.0 - 0.9) / 2)
+    assert sorted(sat.nodes) == sorted([index.find(["The", " cat", " sat"]), index.find(["Th", "e", " cat", " sat"])])
+    assert (ran.token, ran.count, ran.prob) == (" ran", 1, pytest.approx(1 / 3))
+    assert len(index.top_continuations("The cat", n=1)) == 1
+    assert index.top_continuations("The ca") == []
+
+
+def test_choice_paths(index):
+    for icompletion, choices in enumerate(CHOICES):
+        for choice_index, (tokens, _) in enumerate(choices):
+            if not tokens:
+                with pytest.raises(KeyError):
+                    index.get_choice_leaf(f"chatcmpl-{icompletion}", choice_index)
+                continue
+            path = index.get_choice_path(f"chatcmpl-{icompletion}", choice_index)
+            assert path[-1] == index.find(tokens)
+            assert index.get_path_tokens(path[-1]) == tokens
+
+
+def test_nodes_match_graph(index):
+    completions = [make_token_completion(f"chatcmpl-{ii}", choices) for ii, choices in enumerate(CHOICES)]
+    graph = build_token_pos_tree(completions)
+    assert graph.number_of_nodes() == len(index)
+    node = index.find(["Th", "e", " cat"])
+    assert graph.nodes[node]["label"] == "\u2423cat"
+    assert graph.nodes[node]["token_index"] == 2
+    assert graph.nodes[node]["mean_logprob"] == pytest.approx(-0.4)
+    assert [lo for lo, _ in graph.in_edges(node)] == [index.find(["Th", "e"])]
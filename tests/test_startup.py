@@ -0,0 +1,52 @@
+import os
+from pathlib import Path
+import subprocess
+import sys
+
+import pytest
+
+
+ROOT_PATH = Path(__file__).parent.parent
+MAIN_PATH = ROOT_PATH / "scripts" / "main.py"
+HEAVY_MODULES = {"openai", "networkx", "tiktoken"}
+COMMANDS = [
+    "generate-completions",
+    "synthesize-completions",
+    "stream-graph",
+    "sweep",
+    "generate-graph",
+    "export-graph",
+    "export-bundle",
+    "make-bfs-layout",
+    "make-bfs-layout-v2",
+]
+
+
+def get_imported_modules(args: list[str]) -> set[str]:
+    # top level packages in the output of python -X importtime
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join([str(ROOT_PATH)] + [el for el in [env.get("PYTHONPATH")] if el])
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", *args],
+        capture_output=True, text=True, env=env, cwd=ROOT_PATH, check=True,
+    )
+    modules = set()
+    for line in proc.stderr.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            modules.add(line.rsplit("|", 1)[1].strip().split(".")[0])
+    return modules
+
+
+@pytest.mark.parametrize("command", [[]] + [[command] for command in COMMANDS])
+def test_help_skips_heavy_imports(command):
+    modules = get_imported_modules([str(MAIN_PATH), *command, "--help"])
+    assert "ztnd" in modules
+    assert not modules & HEAVY_MODULES
+
+
+@pytest.mark.parametrize("module", ["ztnd.formats", "ztnd.layout", "ztnd.tokens", "ztnd.trie", "ztnd.graphs"])
+def test_library_skips_heavy_imports(module):
+    # the table, trie, layout and format paths load openai, pydantic,
+    # tiktoken and networkx only once a function needs them
+    modules = get_imported_modules(["-c", f"import {module}"])
+    assert not modules & (HEAVY_MODULES | {"pydantic"})
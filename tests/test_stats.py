@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+
+from ztnd.stats import LogprobStats
+
+
+def get_expected(index: list[int], logprob: list[float], size: int) -> dict[str, list]:
+    count = [0] * size
+    logprob_sum = [0.0] * size
+    logprob_min = [0.0] * size
+    for ii, lp in zip(index, logprob):
+        logprob_min[ii] = lp if count[ii] == 0 else min(logprob_min[ii], lp)
+        count[ii] += 1
+        logprob_sum[ii] += lp
+    return {"count": count, "logprob_sum": logprob_sum, "logprob_min": logprob_min}
+
+
+@pytest.mark.parametrize("n_items", [
+    20,  # batches cover most items, reduced over the whole range
+    5000,  # batches touch a few items, reduced over np.unique
+])
+def test_batches_match_single_add(n_items):
+    rng = np.random.default_rng(0)
+    batches = [
+        (rng.integers(0, n_items, 30), -rng.exponential(1.0, 30))
+        for _ in range(6)
+    ]
+    stats = LogprobStats()
+    for index, logprob in batches:
+        stats.add(index, logprob)
+    index = np.concatenate([index for index, _ in batches])
+    logprob = np.concatenate([logprob for _, logprob in batches])
+
+    expected = get_expected(index.tolist(), logprob.tolist(), int(index.max()) + 1)
+    assert len(stats) == int(index.max()) + 1
+    assert stats.count.tolist() == expected["count"]
+    assert stats.logprob_sum == pytest.approx(expected["logprob_sum"])
+    assert stats.logprob_min.tolist() == expected["logprob_min"]
+    assert stats.prob_mass == pytest.approx(np.bincount(index, weights=np.exp(logprob)))
+
+
+@pytest.mark.parametrize("first_index", [[0, 1, 2], [0, 1000]])
+def test_min_of_items_first_seen_later(first_index):
+    # item 1 exists (via grow) but is first observed in the second batch,
+    # its min must not be merged with the 0.0 it was initialized with
+    stats = LogprobStats()
+    stats.add(np.array(first_index), np.full(len(first_index), -1.0))
+    stats.grow(2000)
+    stats.add(np.array([3, 3, 1500]), np.array([-2.0, -0.5, -3.0]))
+    assert stats.logprob_min[3] == -2.0
+    assert stats.logprob_min[1500] == -3.0
+    assert stats.logprob_min[first_index].tolist() == [-1.0] * len(first_index)
+    stats.add(np.array([3]), np.array([-4.0]))
+    assert stats.logprob_min[3] == -4.0
+    assert stats.count[[3, 1500, 1999]].tolist() == [3, 1, 0]
+    assert stats.logprob_mean[1999] == 0.0
+
+
+def test_grow_keeps_values():
+    stats = LogprobStats(2)
+    stats.add(np.array([0, 1, 1]), np.array([-1.0, -2.0, -3.0]))
+    for size in [3, 5, 100, 1000]:
+        stats.grow(size)
+        assert len(stats) == size
+        assert stats.count[:2].tolist() == [1, 2]
+        assert stats.logprob_sum[:2].tolist() == [-1.0, -5.0]
+        assert not stats.count[2:].any()
@@ -0,0 +1,84 @@
+import pytest
+
+from ztnd.generations import create_completions
+from ztnd.generations import stream_completions
+from ztnd.streaming import TokenStreamBuilder
+from ztnd.tokens import build_token_table
+from ztnd.trie import TokenTrie
+
+
+MESSAGES = [{"role": "user", "content": "Once upon a time"}]
+
+
+def get_paths(trie: TokenTrie) -> list[tuple[str, ...]]:
+    paths = [()]
+    for node in range(1, len(trie)):
+        paths.append(paths[trie.parent[node]] + (trie.vocab[trie.token_id[node]],))
+    return paths
+
+
+def canonical(trie: TokenTrie) -> tuple[dict, dict]:
+    """
+    Node and alternative stats keyed by token path, independent of node
+    numbering (streamed nodes are numbered in arrival order).
+    """
+    paths = get_paths(trie)
+    stats = trie.stats
+    stats.grow(len(trie))
+    nodes = {
+        path: (
+            trie.weight[node],
+            int(stats.count[node]),
+            round(float(stats.logprob_sum[node]), 9),
+            round(float(stats.logprob_min[node]), 9),
+            round(float(stats.prob_mass[node]), 9),
+        )
+        for node, path in enumerate(paths)
+    }
+    alts = {
+        (paths[parent], trie.vocab[tid]): (
+            int(trie.alt_stats.count[ii]),
+            round(float(trie.alt_stats.logprob_sum[ii]), 9),
+        )
+        for ii, (parent, tid) in enumerate(trie.alt_keys)
+    }
+    return nodes, alts
+
+
+@pytest.mark.parametrize("add_alternatives", [False, True])
+def test_streamed_tree_matches_batch(fake_server, add_alternatives):
+    kwargs = {
+        "top_logprobs": 3,
+        "max_completion_tokens": 12,
+        "n_choices_per_call": 5,
+        "n_api_calls": 4,
+        "base_url": fake_server.base_url,
+    }
+    builder = TokenStreamBuilder(add_alternatives=add_alternatives, min_alt_prob=0.1)
+    chunks = []
+
+    def on_chunk(chunk):
+        chunks.append(chunk)
+        builder.add_chunk(chunk)
+
+    stream_completions(MESSAGES, on_chunk=on_chunk, max_concurrency=2, **kwargs)
+    builder.flush()
+
+    # the fake server numbers completions per server, so the batch run
+    # on a fresh count gets the same completions
+    fake_server.n_completions = 0
+    completions = create_completions(MESSAGES, **kwargs)
+    trie = TokenTrie(add_alternatives=add_alternatives, min_alt_prob=0.1)
+    leaves = trie.add_table(build_token_table(completions))
+
+    # chunks of different choices really were interleaved
+    indices = [chunk.choices[0].index for chunk in chunks if chunk.choices]
+    assert any(lo != hi for lo, hi in zip(indices, indices[1:]))
+    assert builder.n_tokens == sum(len(choice.logprobs.content) for c in completions for choice in c.choices)
+    assert len(builder.trie) == len(trie)
+    assert canonical(builder.trie) == canonical(trie)
+    streamed_paths = get_paths(builder.trie)
+    paths = get_paths(trie)
+    assert sorted(streamed_paths[leaf] for leaf in builder.leaves) == sorted(paths[leaf] for leaf in leaves)
+    if add_alternatives:
+        assert trie.alt_keys
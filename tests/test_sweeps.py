@@ -0,0 +1,95 @@
+import json
+
+import pytest
+
+from ztnd.generations import count_completions
+from ztnd.generations import read_store_calls
+from ztnd.generations import truncate_partial_line
+from ztnd.sweeps import build_sweep_graphs
+from ztnd.sweeps import fetch_sweep
+from ztnd.sweeps import make_sweep_runs
+from ztnd.sweeps import read_prompts
+
+
+def test_grid_expansion(tmp_path):
+    prompts_path = tmp_path / "prompts.jsonl"
+    prompts_path.write_text('{"prompt": "a"}\n\n{"prompt": "b"}\n')
+    prompts = read_prompts(prompts_path)
+    assert prompts == ["a", "b"]
+
+    runs = make_sweep_runs(prompts, ["m1", "m2"], [0.0, 1.0], [1, 2, 3])
+    assert len(runs) == 2 * 2 * 2 * 3
+    assert len({run.run_id for run in runs}) == len(runs)
+    assert {(run.prompt, run.model, run.temperature, run.seed) for run in runs} == {
+        (prompt, model, temperature, seed)
+        for prompt in "ab" for model in ["m1", "m2"] for temperature in [0.0, 1.0] for seed in [1, 2, 3]
+    }
+    assert all(prompts[run.prompt_index] == run.prompt for run in runs)
+
+
+def fetch(server, runs, out_path, n_api_calls=3):
+    fetch_sweep(
+        runs,
+        out_path,
+        n_api_calls=n_api_calls,
+        max_concurrent_runs=2,
+        max_completion_tokens=6,
+        n_choices_per_call=2,
+        top_logprobs=2,
+        base_url=server.base_url,
+    )
+
+
+def test_sweep_resumes_each_run(fake_server, tmp_path):
+    runs = make_sweep_runs(["a", "b"], ["fake"], [0.0, 1.0], [1])
+    fetch(fake_server, runs, tmp_path)
+    assert len(fake_server.requests) == 4 * 3
+    for run in runs:
+        assert json.loads((run.get_path(tmp_path) / "run.json").read_text()) == run.model_dump()
+    assert {
+        (body["messages"][0]["content"], body["temperature"]) for body in fake_server.requests
+    } == {(run.prompt, run.temperature) for run in runs}
+
+    # one run crashed mid-write after its first call, another lost a call
+    store_path = runs[0].get_path(tmp_path) / "completions.jsonl"
+    lines = store_path.read_bytes().splitlines(keepends=True)
+    store_path.write_bytes(lines[0] + lines[1][:50])
+    store_path = runs[3].get_path(tmp_path) / "completions.jsonl"
+    store_path.write_bytes(b"".join(store_path.read_bytes().splitlines(keepends=True)[:2]))
+
+    fetch(fake_server, runs, tmp_path, n_api_calls=4)
+    # calls 1-3 of the first run, 2-3 of the last and 3 of the other two
+    assert len(fake_server.requests) == 12 + 3 + 2 + 2
+    for run in runs:
+        store_path = run.get_path(tmp_path) / "completions.jsonl"
+        assert read_store_calls(store_path) == {0, 1, 2, 3}
+        assert count_completions(store_path) == 4
+
+
+def test_sweep_refuses_other_request_params(fake_server, tmp_path):
+    runs = make_sweep_runs(["a"], ["fake"], [0.0], [1])
+    fetch(fake_server, runs, tmp_path, n_api_calls=1)
+    with pytest.raises(ValueError, match="max_completion_tokens"):
+        fetch_sweep(runs, tmp_path, n_api_calls=2, max_completion_tokens=7, base_url=fake_server.base_url)
+    assert len(fake_server.requests) == 1
+
+
+def test_sweep_index(fake_server, tmp_path):
+    runs = make_sweep_runs(["a", "b"], ["fake"], [0.5], [1, 2])
+    fetch(fake_server, runs, tmp_path)
+    graph_types = ["token", "token_pos_tree"]
+    index = build_sweep_graphs(runs, tmp_path, graph_types, graph_format="ztnd", max_workers=2)
+
+    with (tmp_path / "index.jsonl").open() as fp:
+        records = [json.loads(line) for line in fp]
+    assert records == index
+    assert [record["run_id"] for record in records] == [run.run_id for run in runs]
+    for run, record in zip(runs, records):
+        assert record["prompt"] == run.prompt and record["seed"] == run.seed
+        assert record["path"] == f"runs/{run.run_id}"
+        assert set(record["graphs"]) == set(graph_types)
+        for graph in record["graphs"].values():
+            assert (tmp_path / record["path"] / graph["path"]).exists()
+            assert graph["n_nodes"] > 1
+        tree = record["graphs"]["token_pos_tree"]
+        assert tree["n_edges"] == tree["n_nodes"] - 1
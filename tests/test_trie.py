@@ -0,0 +1,104 @@
+from collections import Counter
+
+import networkx as nx
+import pytest
+
+from ztnd.choices import iter_choice
+from ztnd.choices import iter_token
+from ztnd.graphs import build_token_pos_tree
+from ztnd.graphs import build_trie
+from ztnd.tokens import add_visual_space
+from ztnd.tokens import build_token_table
+
+
+def build_token_pos_tree_strings(completions) -> nx.DiGraph:
+    """
+    The original string matching tree builder, kept as the reference the
+    trie has to reproduce (including its "tok|pos|jj" counters).
+    """
+
+    def get_token_pos(zt) -> str:
+        return "{}|{}".format(add_visual_space(zt.cctl.token), zt.token_index)
+
+    graph = nx.DiGraph()
+    root_node_id = "ROOT|-1|0"
+    graph.add_nodes_from([(root_node_id, {"id": root_node_id, "label": root_node_id})])
+
+    prefix_jj_counter = Counter()
+    for completion in completions:
+        for zc in iter_choice(completion):
+            diverged = False
+            zts = list(iter_token(zc))
+
+            node_id_lo = "{}|0".format(get_token_pos(zts[0]))
+            if graph.has_edge(root_node_id, node_id_lo):
+                graph[root_node_id][node_id_lo]["weight"] += 1
+            else:
+                diverged = True
+                graph.add_edge(root_node_id, node_id_lo, weight=1)
+
+            for zt_hi in zts[1:]:
+                node_id_prefix_hi = get_token_pos(zt_hi)
+                if diverged:
+                    prefix_jj_counter[node_id_prefix_hi] += 1
+                    node_id_hi = "{}|{}".format(node_id_prefix_hi, prefix_jj_counter[node_id_prefix_hi])
+                    graph.add_edge(node_id_lo, node_id_hi, weight=1)
+                else:
+                    mtch_nbrs = [nbr for nbr in graph[node_id_lo] if nbr.startswith(node_id_prefix_hi)]
+                    if len(mtch_nbrs) == 0:
+                        diverged = True
+                        prefix_jj_counter[node_id_prefix_hi] += 1
+                        node_id_hi = "{}|{}".format(node_id_prefix_hi, prefix_jj_counter[node_id_prefix_hi])
+                        graph.add_edge(node_id_lo, node_id_hi, weight=1)
+                        prefix_jj_counter[node_id_prefix_hi] += 1
+                    elif len(mtch_nbrs) == 1:
+                        node_id_hi = mtch_nbrs[0]
+                        graph[node_id_lo][node_id_hi]["weight"] += 1
+                    else:
+                        raise ValueError()
+                node_id_lo = node_id_hi
+
+    graph = nx.convert_node_labels_to_integers(graph, label_attribute="id")
+    for _, node_meta in graph.nodes(data=True):
+        node_meta["label"] = node_meta["id"].split("|")[0]
+        node_meta["token_index"] = int(node_meta["id"].split("|")[1])
+    return graph
+
+
+def get_edge_weights(graph: nx.DiGraph) -> dict[tuple[int, int], int]:
+    return {(lo, hi): data["weight"] for lo, hi, data in graph.edges(data=True)}
+
+
+def test_trie_matches_string_tree(completions):
+    expected = build_token_pos_tree_strings(completions)
+    graph = build_token_pos_tree(completions, add_stats=False)
+    # a tree with shared prefixes and repeated "tok|pos" nodes
+    assert graph.number_of_nodes() < sum(len(choice.logprobs.content) for c in completions for choice in c.choices)
+    assert max(int(data["id"].rsplit("|", 1)[1]) for _, data in graph.nodes(data=True)) > 1
+
+    assert list(graph.nodes) == list(expected.nodes)
+    for node, data in expected.nodes(data=True):
+        assert graph.nodes[node] == data
+    assert get_edge_weights(graph) == get_edge_weights(expected)
+
+
+def test_trie_batches_match_string_tree(completions):
+    # adding completions in several batches keeps the jj counters
+    expected = build_token_pos_tree_strings(completions)
+    trie = build_trie(build_token_table(completions[:7]))
+    for lo in range(7, len(completions), 11):
+        trie.add_completions(completions[lo:lo + 11])
+    graph = trie.to_digraph(add_stats=False)
+    assert [data["id"] for _, data in graph.nodes(data=True)] == [data["id"] for _, data in expected.nodes(data=True)]
+    assert get_edge_weights(graph) == get_edge_weights(expected)
+
+
+@pytest.mark.parametrize("n_workers", [2, 3])
+def test_parallel_trie_matches_serial(completions, n_workers):
+    table = build_token_table(completions)
+    serial = build_trie(table, add_alternatives=True)
+    parallel = build_trie(table, add_alternatives=True, n_workers=n_workers)
+    graph = serial.to_digraph()
+    parallel_graph = parallel.to_digraph()
+    assert list(parallel_graph.nodes(data=True)) == list(graph.nodes(data=True))
+    assert list(parallel_graph.edges(data=True)) == list(graph.edges(data=True))
@@ -0,0 +1,88 @@
+import html
+import json
+
+import numpy as np
+import pytest
+
+from ztnd.graphs import build_graph_arrays
+from ztnd.layout import set_tree_layout_arrays
+from ztnd.tokens import build_token_table
+from ztnd.viewer import write_viewer_bundle
+
+
+def read_chunks(path, manifest) -> tuple[dict, dict]:
+    """
+    Node and edge columns of all chunks, decoded with the manifest
+    offsets alone, the way the page reads them.
+    """
+    node_cols = {}
+    edge_cols = {}
+    for chunk in manifest["chunks"]:
+        data = (path / chunk["path"]).read_bytes()
+        assert len(data) == chunk["n_bytes"]
+        for name, column in chunk["columns"].items():
+            assert column["offset"] % 4 == 0
+            if name.endswith(".offsets"):
+                continue
+            if column["dtype"] == "str":
+                offsets_column = chunk["columns"][name + ".offsets"]
+                offsets = np.frombuffer(data, "<u4", offsets_column["length"], offsets_column["offset"])
+                blob = data[column["offset"]:column["offset"] + column["length"]]
+                values = [blob[lo:hi].decode("utf-8") for lo, hi in zip(offsets[:-1], offsets[1:])]
+            else:
+                values = np.frombuffer(data, "<" + column["dtype"], column["length"], column["offset"]).tolist()
+            cols = edge_cols if name.startswith("edge.") else node_cols
+            cols.setdefault(name.removeprefix("edge."), []).extend(values)
+    return node_cols, edge_cols
+
+
+@pytest.mark.parametrize("graph_type", ["token_pos_tree", "token_dag"])
+def test_bundle_chunks_match_manifest(completions, tmp_path, graph_type):
+    arrays = build_graph_arrays(build_token_table(completions), graph_type)
+    node_attrs = dict(arrays.node_attrs)
+    manifest = write_viewer_bundle(arrays, tmp_path, chunk_nodes=50)
+    # the layout is not added to the caller's arrays
+    assert arrays.node_attrs == node_attrs
+    assert json.loads((tmp_path / "manifest.json").read_text()) == manifest
+    assert len(manifest["chunks"]) > 2
+
+    node_cols, edge_cols = read_chunks(tmp_path, manifest)
+    assert set(node_cols) == set(manifest["node_columns"])
+    assert set(edge_cols) == set(manifest["edge_columns"])
+    node = np.array(node_cols["node"])
+    assert sorted(node.tolist()) == list(range(arrays.n_nodes))
+
+    node_lo = edge_lo = 0
+    for chunk in manifest["chunks"]:
+        # chunks are contiguous node / edge ranges whose sources are loaded
+        assert chunk["nodes"][0] == node_lo and chunk["edges"][0] == edge_lo
+        node_lo, edge_lo = chunk["nodes"][1], chunk["edges"][1]
+        assert max(edge_cols["source"][chunk["edges"][0]:edge_lo], default=0) < node_lo
+        lo_level, hi_level = chunk["levels"]
+        assert set(node_cols["xpos"][chunk["nodes"][0]:node_lo]) == set(np.arange(lo_level, hi_level + 1))
+    assert (node_lo, edge_lo) == (arrays.n_nodes, arrays.n_edges)
+
+    laid_out = set_tree_layout_arrays(build_graph_arrays(build_token_table(completions), graph_type))
+    for name, values in node_cols.items():
+        if manifest["node_columns"][name] == "str":
+            strs = arrays.get_node_strs(name)
+            assert values == [strs[ii] for ii in node.tolist()]
+        elif name != "node":
+            expected = laid_out.node_attrs[name][node].astype(np.float32)
+            assert np.array(values, dtype=np.float32) == pytest.approx(expected), name
+    edges = sorted(zip(
+        node[edge_cols["source"]].tolist(), node[edge_cols["target"]].tolist(), edge_cols["weight"]
+    ))
+    assert edges == sorted(zip(
+        arrays.sources.tolist(), arrays.indices.tolist(), arrays.edge_attrs["weight"].tolist()
+    ))
+
+
+def test_bundle_escapes_title(completions, tmp_path):
+    arrays = build_graph_arrays(build_token_table(completions), "token_pos_tree")
+    title = '<script>alert("x")</script> & co'
+    manifest = write_viewer_bundle(arrays, tmp_path, title=title)
+    page = (tmp_path / "index.html").read_text(encoding="utf-8")
+    assert "<script>alert" not in page
+    assert page.count(html.escape(title)) == 2
+    assert manifest["title"] == title
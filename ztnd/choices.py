@@ -0,0 +1,49 @@
+from typing import Iterable
+
+from openai.types.chat.chat_completion import Choice
+from openai.types.chat.chat_completion import ChatCompletion
+from openai.types.chat.chat_completion import ChatCompletionTokenLogprob
+from pydantic import BaseModel
+
+
+class ZtndChoice(BaseModel):
+    completion_id: str
+    choice_index: int
+    choice: Choice
+
+
+    def get_id(self):
+        return f"{self.completion_id}-{self.choice_index}"
+
+
+def iter_choice(completion: ChatCompletion) -> Iterable[ZtndChoice]:
+    for choice in completion.choices:
+        yield ZtndChoice(
+            completion_id = completion.id,
+            choice_index = choice.index,
+            choice = choice,
+        )
+
+
+class ZtndToken(BaseModel):
+    completion_id: str
+    choice_index: int
+    token_index: int
+    cctl: ChatCompletionTokenLogprob
+
+    def get_id(self):
+        return f"{self.completion_id}-{self.choice_index}-{self.token_index}"
+
+
+def iter_token(zchoice: ZtndChoice) -> Iterable[ZtndToken]:
+    if zchoice.choice.logprobs is None:
+        raise ValueError("choice.logprobs is None")
+    if zchoice.choice.logprobs.content is None:
+        raise ValueError("choice.logprobs.content is None")
+    for ii, cctl in enumerate(zchoice.choice.logprobs.content):
+        yield ZtndToken(
+            completion_id = zchoice.completion_id,
+            choice_index = zchoice.choice_index,
+            token_index = ii,
+            cctl = cctl,
+        )
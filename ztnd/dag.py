@@ -0,0 +1,149 @@
+import logging
+
+import numpy as np
+
+from ztnd.formats import GraphArrays
+from ztnd.stats import get_branching_entropy
+from ztnd.tokens import add_visual_space
+from ztnd.trie import TokenTrie
+
+
+logger = logging.getLogger(__name__)
+
+
+def get_suffix_classes(trie: TokenTrie) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Label every trie node with the class of its suffix subtree, as in DAWG
+    minimization. Two nodes are equivalent if they have the same token,
+    both or neither end a choice, and their children per token are
+    equivalent. Classes are found bottom up in one pass over the nodes
+    (children are created after their parents) by hashing each node's
+    canonical signature, so the cost is linear in the number of nodes.
+
+    Returns the class of every node and the first trie node of every
+    class. Classes are numbered in order of their first node, so the root
+    is class 0.
+    """
+    n_nodes = len(trie)
+    token_id = trie.token_id
+    children = trie.children
+    weight = np.array(trie.weight, dtype=np.int64)
+    out_weight = np.bincount(trie.parent[1:], weights=weight[1:], minlength=n_nodes)
+    ends = (weight > out_weight).tolist()
+    node_class = [0] * n_nodes
+    first_node = []
+    signatures = {}
+    for node in range(n_nodes - 1, 0, -1):
+        node_children = children[node]
+        # (token, child class) pairs, as a frozenset when there are several
+        # since equal subtrees may have created their children in other orders
+        if len(node_children) > 1:
+            child_classes = frozenset((tid, node_class[child]) for tid, child in node_children.items())
+        else:
+            child_classes = tuple((tid, node_class[child]) for tid, child in node_children.items())
+        signature = (token_id[node], ends[node], child_classes)
+        iclass = signatures.get(signature)
+        if iclass is None:
+            iclass = len(first_node)
+            signatures[signature] = iclass
+            first_node.append(node)
+        else:
+            first_node[iclass] = node
+        node_class[node] = iclass
+    # nodes were visited in reverse, so the last node seen per class is its first
+    first_node = np.array([0] + first_node, dtype=np.int64)
+    order = np.argsort(first_node, kind="stable")
+    new_class = np.empty(len(order), dtype=np.int64)
+    new_class[order] = np.arange(len(order))
+    node_class = np.array(node_class, dtype=np.int64) + 1
+    node_class[0] = 0
+    return new_class[node_class], first_node[order]
+
+
+def minimize_trie(trie: TokenTrie, add_stats: bool = True) -> GraphArrays:
+    """
+    Collapse a token trie into a minimized DAG by merging identical
+    suffix subtrees (see get_suffix_classes), so branches that diverge
+    and rejoin share their common tail.
+
+    The DAG represents the same set of token sequences as the trie and
+    keeps its path counts: the weight of an edge is the summed weight of
+    the trie edges merged into it, i.e. the number of choices that pass
+    through it. Every node carries the "id" of its first trie node, its
+    "label", the largest ("token_index") and smallest
+    ("min_token_index") position it was reached at, and "n_merged", the
+    number of trie nodes it replaces. The token_index of a node is always
+    larger than that of its parents, so it can be used for level layouts.
+    With `add_stats` nodes and edges carry the pooled logprob statistics
+    of the merged tokens and nodes the entropy of their out-edges.
+    """
+    if trie.add_alternatives:
+        raise ValueError("minimize_trie does not support virtual alternatives")
+    node_class, first_node = get_suffix_classes(trie)
+    n_classes = len(first_node)
+
+    token_index = np.array(trie.token_index, dtype=np.int64)
+    max_index = np.full(n_classes, -1, dtype=np.int64)
+    np.maximum.at(max_index, node_class, token_index)
+    min_index = np.full(n_classes, np.iinfo(np.int64).max, dtype=np.int64)
+    np.minimum.at(min_index, node_class, token_index)
+
+    # merged edges ordered by source and then by their first trie edge
+    parent = np.array(trie.parent[1:], dtype=np.int64)
+    edge_lo = node_class[parent]
+    edge_hi = node_class[1:]
+    edge_keys, edge_first, edge_inverse = np.unique(
+        edge_lo * n_classes + edge_hi, return_index=True, return_inverse=True
+    )
+    order = np.lexsort((edge_first, edge_keys // n_classes))
+    new_edge = np.empty(len(order), dtype=np.int64)
+    new_edge[order] = np.arange(len(order))
+    edge_inverse = new_edge[edge_inverse]
+    edge_keys = edge_keys[order]
+    n_edges = len(edge_keys)
+    indptr = np.zeros(n_classes + 1, dtype=np.int64)
+    np.cumsum(np.bincount(edge_keys // n_classes, minlength=n_classes), out=indptr[1:])
+
+    weight = np.array(trie.weight[1:], dtype=np.int64)
+    edge_weight = np.bincount(edge_inverse, weights=weight, minlength=n_edges).astype(np.int64)
+
+    strings = ["ROOT"] + [add_visual_space(token) for token in trie.vocab]
+    strings += [trie.get_id(node) for node in first_node.tolist()]
+    label = np.array(trie.token_id, dtype=np.int32)[first_node] + 1
+    id_index = np.arange(n_classes, dtype=np.int32) + len(strings) - n_classes
+
+    node_attrs = {
+        "token_index": max_index,
+        "min_token_index": min_index,
+        "n_merged": np.bincount(node_class, minlength=n_classes),
+    }
+    edge_attrs = {"weight": edge_weight}
+    if add_stats:
+        stats = trie.stats
+        stats.grow(len(trie))
+        for attrs, group, size, rows in [
+            (node_attrs, node_class, n_classes, slice(None)),
+            (edge_attrs, edge_inverse, n_edges, slice(1, None)),
+        ]:
+            count = np.bincount(group, weights=stats.count[rows], minlength=size)
+            logprob_sum = np.bincount(group, weights=stats.logprob_sum[rows], minlength=size)
+            logprob_min = np.full(size, np.inf)
+            np.minimum.at(logprob_min, group, stats.logprob_min[rows])
+            attrs["prob_mass"] = np.bincount(group, weights=stats.prob_mass[rows], minlength=size)
+            attrs["mean_logprob"] = np.divide(
+                logprob_sum, count, out=np.zeros(size), where=count > 0
+            )
+            attrs["min_logprob"] = np.where(count > 0, logprob_min, 0.0)
+        node_attrs["entropy"] = get_branching_entropy(
+            edge_keys // n_classes, edge_weight, n_classes
+        )
+
+    logger.info(f"minimized {len(trie)} trie nodes into {n_classes} DAG nodes and {n_edges} edges")
+    return GraphArrays(
+        indptr=indptr,
+        indices=edge_keys % n_classes,
+        strings=strings,
+        node_attrs=node_attrs,
+        node_str_attrs={"id": id_index, "label": label},
+        edge_attrs=edge_attrs,
+    )
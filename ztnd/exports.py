@@ -0,0 +1,287 @@
+import csv
+from datetime import date
+import logging
+from pathlib import Path
+import re
+from typing import Iterable, TextIO
+from xml.sax.saxutils import escape
+from xml.sax.saxutils import quoteattr
+
+import numpy as np
+
+from ztnd.formats import GraphArrays
+from ztnd.serialization import write_json
+
+
+logger = logging.getLogger(__name__)
+
+
+# characters that are not allowed anywhere in an XML 1.0 document
+INVALID_XML_CHARS = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]")
+
+GEXF_TYPES = {"int": "long", "float": "double", "str": "string"}
+GRAPHML_TYPES = {"int": "long", "float": "double", "str": "string"}
+
+
+def get_columns(
+    attrs: dict[str, np.ndarray],
+    str_attrs: dict[str, np.ndarray],
+    strings: list[str],
+) -> list[tuple[str, str, list]]:
+    """
+    (name, kind, values) of every attribute column, numeric columns first,
+    with kind one of "int", "float" or "str".
+    """
+    columns = []
+    for name, arr in attrs.items():
+        kind = "int" if np.issubdtype(arr.dtype, np.integer) else "float"
+        columns.append((name, kind, arr.tolist()))
+    for name, arr in str_attrs.items():
+        columns.append((name, "str", [strings[ii] for ii in arr.tolist()]))
+    return columns
+
+
+def xml_attr(value) -> str:
+    return quoteattr(INVALID_XML_CHARS.sub("\ufffd", str(value)))
+
+
+def xml_text(value) -> str:
+    return escape(INVALID_XML_CHARS.sub("\ufffd", str(value)))
+
+
+def encode_xml_columns(columns: list[tuple], quote: bool) -> list[tuple[str, str, list[str]]]:
+    """
+    Render column values once as XML attribute values (with `quote`) or
+    element text. Only string columns need escaping.
+    """
+    encoded = []
+    for name, kind, values in columns:
+        if kind == "str":
+            values = [xml_attr(value) if quote else xml_text(value) for value in values]
+        elif quote:
+            values = [f'"{value}"' for value in values]
+        else:
+            values = [str(value) for value in values]
+        encoded.append((name, kind, values))
+    return encoded
+
+
+def write_lines(fp: TextIO, lines: Iterable[str], batch_size: int = 10_000) -> None:
+    batch = []
+    for line in lines:
+        batch.append(line)
+        if len(batch) >= batch_size:
+            fp.write("".join(batch))
+            batch = []
+    fp.write("".join(batch))
+
+
+def iter_node_link_nodes(arrays: GraphArrays) -> Iterable[dict]:
+    columns = get_columns(arrays.node_attrs, arrays.node_str_attrs, arrays.strings)
+    for node in range(arrays.n_nodes):
+        node_meta = {name: values[node] for name, _, values in columns}
+        yield {**node_meta, "id": node}
+
+
+def iter_node_link_edges(arrays: GraphArrays) -> Iterable[dict]:
+    columns = get_columns(arrays.edge_attrs, arrays.edge_str_attrs, arrays.strings)
+    sources = arrays.sources.tolist()
+    targets = arrays.indices.tolist()
+    for iedge in range(arrays.n_edges):
+        edge_meta = {name: values[iedge] for name, _, values in columns}
+        yield {**edge_meta, "source": sources[iedge], "target": targets[iedge]}
+
+
+def write_node_link_json(arrays: GraphArrays, path: str | Path) -> None:
+    """
+    Write the same document as nx.node_link_data(graph, edges="edges"),
+    including its replacement of an "id" node attribute by the node
+    number, one node / edge per line.
+    """
+    data = {
+        "directed": True,
+        "multigraph": False,
+        "graph": arrays.graph_attrs,
+        "nodes": iter_node_link_nodes(arrays),
+        "edges": iter_node_link_edges(arrays),
+    }
+    with Path(path).open("wb") as fp:
+        write_json(data, fp)
+
+
+def iter_gexf_attvalues(columns: list[tuple], keys: dict[str, int], ii: int) -> Iterable[str]:
+    yield "        <attvalues>\n"
+    for name, _, values in columns:
+        yield f'          <attvalue for="{keys[name]}" value={values[ii]} />\n'
+    yield "        </attvalues>\n"
+
+
+def write_gexf(arrays: GraphArrays, path: str | Path) -> None:
+    """
+    Write GEXF 1.2 in the layout of nx.write_gexf: the "id" and "label"
+    node attributes become the node id and label, the "weight" edge
+    attribute the edge weight, and everything else an attvalue.
+    """
+    node_columns = encode_xml_columns(
+        get_columns(arrays.node_attrs, arrays.node_str_attrs, arrays.strings), quote=True
+    )
+    edge_columns = encode_xml_columns(
+        get_columns(arrays.edge_attrs, arrays.edge_str_attrs, arrays.strings), quote=True
+    )
+    node_ids = [f'"{node}"' for node in range(arrays.n_nodes)]
+    node_labels = node_ids
+    weights = None
+    for name, _, values in node_columns:
+        if name == "id":
+            node_ids = values
+        elif name == "label":
+            node_labels = values
+    node_columns = [col for col in node_columns if col[0] not in ("id", "label")]
+    for name, _, values in edge_columns:
+        if name == "weight":
+            weights = values
+    edge_columns = [col for col in edge_columns if col[0] != "weight"]
+
+    node_keys = {name: ii for ii, (name, _, _) in enumerate(node_columns)}
+    edge_keys = {name: ii + len(node_columns) for ii, (name, _, _) in enumerate(edge_columns)}
+
+    def iter_lines() -> Iterable[str]:
+        yield "<?xml version='1.0' encoding='utf-8'?>\n"
+        yield (
+            '<gexf xmlns="http://www.gexf.net/1.2draft" '
+            'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
+            'xsi:schemaLocation="http://www.gexf.net/1.2draft '
+            'http://www.gexf.net/1.2draft/gexf.xsd" version="1.2">\n'
+        )
+        yield f'  <meta lastmodifieddate="{date.today().isoformat()}">\n'
+        yield "    <creator>ztnd</creator>\n"
+        yield "  </meta>\n"
+        yield '  <graph defaultedgetype="directed" mode="static" name="">\n'
+        for cls, columns, keys in [("node", node_columns, node_keys), ("edge", edge_columns, edge_keys)]:
+            if not columns:
+                continue
+            yield f'    <attributes mode="static" class="{cls}">\n'
+            for name, kind, _ in columns:
+                yield (
+                    f'      <attribute id="{keys[name]}" title={xml_attr(name)} '
+                    f'type="{GEXF_TYPES[kind]}" />\n'
+                )
+            yield "    </attributes>\n"
+
+        yield "    <nodes>\n"
+        for node in range(arrays.n_nodes):
+            yield f"      <node id={node_ids[node]} label={node_labels[node]}>\n"
+            if node_columns:
+                yield from iter_gexf_attvalues(node_columns, node_keys, node)
+            yield "      </node>\n"
+        yield "    </nodes>\n"
+
+        yield "    <edges>\n"
+        sources = arrays.sources.tolist()
+        targets = arrays.indices.tolist()
+        for iedge in range(arrays.n_edges):
+            weight = "" if weights is None else f" weight={weights[iedge]}"
+            yield (
+                f"      <edge source={node_ids[sources[iedge]]} "
+                f"target={node_ids[targets[iedge]]} id=\"{iedge}\"{weight}>\n"
+            )
+            if edge_columns:
+                yield from iter_gexf_attvalues(edge_columns, edge_keys, iedge)
+            yield "      </edge>\n"
+        yield "    </edges>\n"
+        yield "  </graph>\n"
+        yield "</gexf>\n"
+
+    with Path(path).open("w", encoding="utf-8") as fp:
+        write_lines(fp, iter_lines())
+
+
+def write_graphml(arrays: GraphArrays, path: str | Path) -> None:
+    """
+    Write GraphML with every node and edge attribute as a typed data key.
+    Nodes are identified by their number.
+    """
+    node_columns = encode_xml_columns(
+        get_columns(arrays.node_attrs, arrays.node_str_attrs, arrays.strings), quote=False
+    )
+    edge_columns = encode_xml_columns(
+        get_columns(arrays.edge_attrs, arrays.edge_str_attrs, arrays.strings), quote=False
+    )
+    node_keys = {name: f"d{ii}" for ii, (name, _, _) in enumerate(node_columns)}
+    edge_keys = {name: f"d{ii + len(node_columns)}" for ii, (name, _, _) in enumerate(edge_columns)}
+
+    def iter_data(columns: list[tuple], keys: dict[str, str], ii: int) -> Iterable[str]:
+        for name, _, values in columns:
+            yield f'      <data key="{keys[name]}">{values[ii]}</data>\n'
+
+    def iter_lines() -> Iterable[str]:
+        yield "<?xml version='1.0' encoding='utf-8'?>\n"
+        yield (
+            '<graphml xmlns="http://graphml.graphdrawing.org/xmlns" '
+            'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
+            'xsi:schemaLocation="http://graphml.graphdrawing.org/xmlns '
+            'http://graphml.graphdrawing.org/xmlns/1.0/graphml.xsd">\n'
+        )
+        for cls, columns, keys in [("node", node_columns, node_keys), ("edge", edge_columns, edge_keys)]:
+            for name, kind, _ in columns:
+                yield (
+                    f'  <key id="{keys[name]}" for="{cls}" attr.name={xml_attr(name)} '
+                    f'attr.type="{GRAPHML_TYPES[kind]}" />\n'
+                )
+        yield '  <graph edgedefault="directed">\n'
+        for node in range(arrays.n_nodes):
+            yield f'    <node id="{node}">\n'
+            yield from iter_data(node_columns, node_keys, node)
+            yield "    </node>\n"
+        sources = arrays.sources.tolist()
+        targets = arrays.indices.tolist()
+        for iedge in range(arrays.n_edges):
+            yield f'    <edge source="{sources[iedge]}" target="{targets[iedge]}">\n'
+            yield from iter_data(edge_columns, edge_keys, iedge)
+            yield "    </edge>\n"
+        yield "  </graph>\n"
+        yield "</graphml>\n"
+
+    with Path(path).open("w", encoding="utf-8") as fp:
+        write_lines(fp, iter_lines())
+
+
+def write_sankey_table(arrays: GraphArrays, path: str | Path, value_attr: str = "weight") -> None:
+    """
+    Write one CSV row (source, target, value, source_label, target_label)
+    per edge, ready for Sankey diagram tools. Sources and targets are node
+    numbers.
+    """
+    sources = arrays.sources.tolist()
+    targets = arrays.indices.tolist()
+    values = arrays.edge_attrs[value_attr].tolist()
+    if "label" in arrays.node_str_attrs:
+        labels = arrays.get_node_strs("label")
+    else:
+        labels = [str(node) for node in range(arrays.n_nodes)]
+    with Path(path).open("w", encoding="utf-8", newline="") as fp:
+        writer = csv.writer(fp)
+        writer.writerow(["source", "target", "value", "source_label", "target_label"])
+        writer.writerows(
+            (lo, hi, value, labels[lo], labels[hi])
+            for lo, hi, value in zip(sources, targets, values)
+        )
+
+
+EXPORT_WRITERS = {
+    "json": write_node_link_json,
+    "gexf": write_gexf,
+    "graphml": write_graphml,
+    "csv": write_sankey_table,
+}
+
+
+def export_graph(arrays: GraphArrays, path: str | Path) -> None:
+    """
+    Write `arrays` in the export format given by the suffix of `path`
+    (.json, .gexf, .graphml or .csv for a Sankey table).
+    """
+    suffix = Path(path).suffix.lstrip(".")
+    if suffix not in EXPORT_WRITERS:
+        raise ValueError(f"no exporter for {path}, use one of {list(EXPORT_WRITERS)}")
+    EXPORT_WRITERS[suffix](arrays, path)
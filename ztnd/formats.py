@@ -0,0 +1,305 @@
+from dataclasses import dataclass
+from dataclasses import field
+import json
+import logging
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+from ztnd.profiling import stage
+from ztnd.serialization import gc_paused
+from ztnd.serialization import read_json
+from ztnd.serialization import write_json
+
+if TYPE_CHECKING:
+    import networkx as nx
+
+logger = logging.getLogger(__name__)
+
+
+BINARY_FORMAT = "ztnd-csr"
+BINARY_VERSION = 1
+BINARY_SUFFIX = ".ztnd"
+
+
+@dataclass
+class GraphArrays:
+    """
+    Compact CSR representation of a directed graph with integer nodes 0..n-1.
+
+    The out-edges of node n are indices[indptr[n]:indptr[n+1]] in adjacency
+    order. Numeric node and edge attributes are stored as arrays aligned with
+    nodes / edges. String attributes are stored as int32 indexes into the
+    interned `strings` table.
+    """
+
+    indptr: np.ndarray
+    indices: np.ndarray
+    strings: list[str] = field(default_factory=list)
+    node_attrs: dict[str, np.ndarray] = field(default_factory=dict)
+    node_str_attrs: dict[str, np.ndarray] = field(default_factory=dict)
+    edge_attrs: dict[str, np.ndarray] = field(default_factory=dict)
+    edge_str_attrs: dict[str, np.ndarray] = field(default_factory=dict)
+    graph_attrs: dict = field(default_factory=dict)
+
+    @property
+    def n_nodes(self) -> int:
+        return len(self.indptr) - 1
+
+    @property
+    def n_edges(self) -> int:
+        return len(self.indices)
+
+    @property
+    def sources(self) -> np.ndarray:
+        return np.repeat(np.arange(self.n_nodes), np.diff(self.indptr))
+
+    def get_node_strs(self, name: str) -> list[str]:
+        return [self.strings[ii] for ii in self.node_str_attrs[name].tolist()]
+
+    @classmethod
+    def from_digraph(cls, graph: "nx.DiGraph") -> "GraphArrays":
+        n_nodes = graph.number_of_nodes()
+        if list(graph.nodes) != list(range(n_nodes)):
+            raise ValueError("nodes must be the integers 0..n-1 in order")
+
+        degrees = np.fromiter(
+            (len(graph._adj[node]) for node in range(n_nodes)), dtype=np.int64, count=n_nodes
+        )
+        indptr = np.zeros(n_nodes + 1, dtype=np.int64)
+        np.cumsum(degrees, out=indptr[1:])
+        indices = np.fromiter(
+            (nbr for node in range(n_nodes) for nbr in graph._adj[node]),
+            dtype=np.int64,
+            count=int(indptr[-1]),
+        )
+
+        strings = []
+        string_index = {}
+
+        def intern(value: str) -> int:
+            ii = string_index.get(value)
+            if ii is None:
+                ii = len(strings)
+                string_index[value] = ii
+                strings.append(value)
+            return ii
+
+        node_attrs, node_str_attrs = split_attrs(
+            [data for _, data in graph.nodes(data=True)], intern, "node"
+        )
+        edge_attrs, edge_str_attrs = split_attrs(
+            [data for _, _, data in graph.edges(data=True)], intern, "edge"
+        )
+
+        return cls(
+            indptr=indptr,
+            indices=indices,
+            strings=strings,
+            node_attrs=node_attrs,
+            node_str_attrs=node_str_attrs,
+            edge_attrs=edge_attrs,
+            edge_str_attrs=edge_str_attrs,
+            graph_attrs=dict(graph.graph),
+        )
+
+    def to_digraph(self) -> "nx.DiGraph":
+        import networkx as nx
+
+        graph = nx.DiGraph(**self.graph_attrs)
+
+        node_cols = [(name, arr.tolist()) for name, arr in self.node_attrs.items()]
+        node_cols += [(name, self.get_node_strs(name)) for name in self.node_str_attrs]
+        graph.add_nodes_from(
+            (node, {name: col[node] for name, col in node_cols})
+            for node in range(self.n_nodes)
+        )
+
+        edge_cols = [(name, arr.tolist()) for name, arr in self.edge_attrs.items()]
+        edge_cols += [
+            (name, [self.strings[ii] for ii in arr.tolist()])
+            for name, arr in self.edge_str_attrs.items()
+        ]
+        graph.add_edges_from(
+            (lo, hi, {name: col[iedge] for name, col in edge_cols})
+            for iedge, (lo, hi) in enumerate(
+                zip(self.sources.tolist(), self.indices.tolist())
+            )
+        )
+        return graph
+
+    def save(self, path: str | Path) -> None:
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+
+        encoded = [el.encode("utf-8") for el in self.strings]
+        string_offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(el) for el in encoded], out=string_offsets[1:])
+        with (path / "strings.bin").open("wb") as fp:
+            fp.write(b"".join(encoded))
+
+        arrays = {
+            "indptr": self.indptr,
+            "indices": self.indices,
+            "string_offsets": string_offsets,
+        }
+        for prefix, attrs in [
+            ("node", self.node_attrs),
+            ("node_str", self.node_str_attrs),
+            ("edge", self.edge_attrs),
+            ("edge_str", self.edge_str_attrs),
+        ]:
+            for name, arr in attrs.items():
+                arrays[f"{prefix}.{name}"] = arr
+        for name, arr in arrays.items():
+            np.save(path / f"{name}.npy", np.ascontiguousarray(arr))
+
+        meta = {
+            "format": BINARY_FORMAT,
+            "version": BINARY_VERSION,
+            "n_nodes": self.n_nodes,
+            "n_edges": self.n_edges,
+            "node_attrs": list(self.node_attrs),
+            "node_str_attrs": list(self.node_str_attrs),
+            "edge_attrs": list(self.edge_attrs),
+            "edge_str_attrs": list(self.edge_str_attrs),
+            "graph_attrs": self.graph_attrs,
+        }
+        with (path / "meta.json").open("w") as fp:
+            fp.write(json.dumps(meta, indent=4))
+
+    @classmethod
+    def load(cls, path: str | Path, mmap: bool = True) -> "GraphArrays":
+        """
+        Load a graph written by `save`. With `mmap` the arrays are memory
+        mapped read-only instead of being read into memory.
+        """
+        path = Path(path)
+        with (path / "meta.json").open("r") as fp:
+            meta = json.load(fp)
+        if meta.get("format") != BINARY_FORMAT:
+            raise ValueError(f"{path} is not a {BINARY_FORMAT} graph")
+        if meta["version"] > BINARY_VERSION:
+            raise ValueError(f"unsupported {BINARY_FORMAT} version {meta['version']}")
+
+        mmap_mode = "r" if mmap else None
+
+        def load_array(name: str) -> np.ndarray:
+            return np.load(path / f"{name}.npy", mmap_mode=mmap_mode)
+
+        string_offsets = load_array("string_offsets").tolist()
+        with (path / "strings.bin").open("rb") as fp:
+            string_data = fp.read()
+        strings = [
+            string_data[lo:hi].decode("utf-8")
+            for lo, hi in zip(string_offsets[:-1], string_offsets[1:])
+        ]
+
+        return cls(
+            indptr=load_array("indptr"),
+            indices=load_array("indices"),
+            strings=strings,
+            node_attrs={name: load_array(f"node.{name}") for name in meta["node_attrs"]},
+            node_str_attrs={
+                name: load_array(f"node_str.{name}") for name in meta["node_str_attrs"]
+            },
+            edge_attrs={name: load_array(f"edge.{name}") for name in meta["edge_attrs"]},
+            edge_str_attrs={
+                name: load_array(f"edge_str.{name}") for name in meta["edge_str_attrs"]
+            },
+            graph_attrs=meta["graph_attrs"],
+        )
+
+
+def get_scalar_kind(value) -> str | None:
+    if isinstance(value, (bool, np.bool_)):
+        return None
+    if isinstance(value, (int, np.integer)):
+        return "int"
+    if isinstance(value, (float, np.floating)):
+        return "float"
+    if isinstance(value, str):
+        return "str"
+    return None
+
+
+def split_attrs(
+    records: list[dict], intern, kind: str
+) -> tuple[dict[str, np.ndarray], dict[str, np.ndarray]]:
+    """
+    Turn per node / edge attribute dicts into numeric and string columns.
+
+    Only attributes present on every record with a single scalar type are
+    kept, others are dropped with a warning.
+    """
+    names = {}
+    for record in records:
+        for name in record:
+            names.setdefault(name, None)
+
+    num_attrs = {}
+    str_attrs = {}
+    for name in names:
+        values = [record.get(name) for record in records]
+        kinds = {get_scalar_kind(value) for value in values}
+        if kinds == {"int"}:
+            num_attrs[name] = np.array(values, dtype=np.int64)
+        elif kinds <= {"int", "float"}:
+            num_attrs[name] = np.array(values, dtype=np.float64)
+        elif kinds == {"str"}:
+            str_attrs[name] = np.array([intern(value) for value in values], dtype=np.int32)
+        else:
+            logger.warning(f"dropping {kind} attribute {name!r}, not a scalar on every {kind}")
+    return num_attrs, str_attrs
+
+
+def write_node_link_json(graph: "nx.DiGraph", path: str | Path) -> None:
+    import networkx as nx
+
+    with stage("node_link_data") as record:
+        data = nx.node_link_data(graph, edges="edges")
+        record.count = graph.number_of_nodes()
+    with stage("json_dump"):
+        with Path(path).open("wb") as fp:
+            write_json(data, fp)
+
+
+def read_node_link_json(path: str | Path) -> "nx.DiGraph":
+    import networkx as nx
+
+    with stage("json_load"):
+        nld = read_json(path)
+    with stage("node_link_graph") as record, gc_paused():
+        graph = nx.node_link_graph(nld, edges="edges")
+        record.count = graph.number_of_nodes()
+    return graph
+
+
+def is_binary_path(path: str | Path) -> bool:
+    return Path(path).suffix == BINARY_SUFFIX
+
+
+def write_graph(graph: "nx.DiGraph", path: str | Path) -> None:
+    """
+    Write `graph` as node-link JSON or, for a `.ztnd` path, as a binary
+    CSR directory.
+    """
+    if is_binary_path(path):
+        with stage("to_graph_arrays") as record:
+            arrays = GraphArrays.from_digraph(graph)
+            record.count = arrays.n_nodes
+        with stage("save_graph_arrays"):
+            arrays.save(path)
+    else:
+        write_node_link_json(graph, path)
+
+
+def read_graph(path: str | Path) -> "nx.DiGraph":
+    if is_binary_path(path):
+        with stage("load_graph_arrays") as record:
+            arrays = GraphArrays.load(path)
+            record.count = arrays.n_nodes
+        with stage("from_graph_arrays"), gc_paused():
+            return arrays.to_digraph()
+    return read_node_link_json(path)
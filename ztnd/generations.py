@@ -1,17 +1,206 @@
+from bisect import bisect
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import inspect
+from itertools import accumulate
 import json
 import logging
+import math
 import os
 from pathlib import Path
+import random
+import threading
+import time
+from typing import TYPE_CHECKING, Callable, Iterable
 
-from openai import OpenAI
-from openai.types.chat.chat_completion import Choice
-from openai.types.chat.chat_completion import ChatCompletion
-from pydantic import BaseModel
+from ztnd.profiling import stage
+from ztnd.serialization import gc_paused
+from ztnd.serialization import read_json
 
+# openai (with pydantic) and tiktoken take most of a second to import, so
+# they are imported by the functions that use them
+if TYPE_CHECKING:
+    from openai.types.chat.chat_completion import ChatCompletion
+    from openai.types.chat.chat_completion_chunk import ChatCompletionChunk
+    import tiktoken
 
 logger = logging.getLogger(__name__)
 
 
+class TokenBudget:
+    """
+    Token bucket that limits the number of tokens requested per minute.
+
+    Each call reserves an estimate of the tokens it will use (prompt plus
+    n * max_completion_tokens) and blocks until the budget allows it.
+    """
+
+    def __init__(self, tokens_per_minute: int):
+        self.tokens_per_minute = tokens_per_minute
+        self.available = float(tokens_per_minute)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, n_tokens: int) -> None:
+        # a single request larger than the whole budget is allowed through
+        # once the bucket is full instead of blocking forever
+        n_tokens = min(n_tokens, self.tokens_per_minute)
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                refill = (now - self.updated) * self.tokens_per_minute / 60.0
+                self.available = min(self.tokens_per_minute, self.available + refill)
+                self.updated = now
+                if self.available >= n_tokens:
+                    self.available -= n_tokens
+                    return
+                wait = (n_tokens - self.available) * 60.0 / self.tokens_per_minute
+            time.sleep(wait)
+
+
+class ResponseCache:
+    """
+    Content addressed on-disk cache of chat completions.
+
+    Entries are keyed by a sha256 of the full request (messages, model,
+    sampling and logprob settings, base_url and the call index) and stored
+    as <root>/<key[:2]>/<key>.json. Hits refresh the entry's mtime and the
+    least recently used entries are evicted once the cache grows past
+    `max_bytes`.
+    """
+
+    def __init__(self, root: str | Path, max_bytes: int = 1_000_000_000):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+        self.entries = {}
+        for entry_path in self.root.glob("*/*.json"):
+            stat = entry_path.stat()
+            self.entries[entry_path] = (stat.st_mtime, stat.st_size)
+        self.total_bytes = sum(size for _, size in self.entries.values())
+        self.evict()
+
+    @staticmethod
+    def get_key(request: dict) -> str:
+        blob = json.dumps(request, sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+    def get_path(self, key: str) -> Path:
+        return self.root / key[:2] / f"{key}.json"
+
+    def get(self, request: dict) -> "ChatCompletion | None":
+        from openai.types.chat.chat_completion import ChatCompletion
+
+        path = self.get_path(self.get_key(request))
+        # read under the lock so that a concurrent put cannot evict the
+        # entry in between
+        with self.lock:
+            data = None
+            if path in self.entries:
+                try:
+                    data = path.read_bytes()
+                    os.utime(path)
+                except FileNotFoundError:
+                    # removed by another process sharing the cache
+                    self.total_bytes -= self.entries.pop(path)[1]
+            if data is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries[path] = (time.time(), self.entries[path][1])
+        return ChatCompletion.model_validate_json(data)
+
+    def put(self, request: dict, completion: "ChatCompletion") -> None:
+        path = self.get_path(self.get_key(request))
+        path.parent.mkdir(exist_ok=True)
+        data = completion.model_dump_json()
+        # write then rename so readers never see a partial entry
+        tmp_path = path.with_suffix(f".{threading.get_ident()}.tmp")
+        tmp_path.write_text(data)
+        os.replace(tmp_path, path)
+        size = path.stat().st_size
+        with self.lock:
+            _, old_size = self.entries.pop(path, (None, 0))
+            self.entries[path] = (time.time(), size)
+            self.total_bytes += size - old_size
+            self.evict()
+
+    def evict(self) -> None:
+        if self.total_bytes <= self.max_bytes:
+            return
+        for path, (_, size) in sorted(self.entries.items(), key=lambda item: item[1][0]):
+            if self.total_bytes <= self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            del self.entries[path]
+            self.total_bytes -= size
+            self.evictions += 1
+
+    def report(self) -> dict:
+        n_requests = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / n_requests if n_requests else 0.0,
+            "evictions": self.evictions,
+            "entries": len(self.entries),
+            "bytes": self.total_bytes,
+        }
+
+
+def is_retryable(exc: Exception) -> bool:
+    from openai import APIConnectionError
+    from openai import APIStatusError
+
+    if isinstance(exc, APIConnectionError):
+        return True
+    if isinstance(exc, APIStatusError):
+        return exc.status_code == 429 or exc.status_code >= 500
+    return False
+
+
+def estimate_request_tokens(
+    messages: list[dict[str, str]],
+    max_completion_tokens: int,
+    n_choices_per_call: int,
+) -> int:
+    # rough estimate of ~4 characters per prompt token
+    n_prompt_chars = sum(len(msg.get("content", "")) for msg in messages)
+    return n_prompt_chars // 4 + 1 + max_completion_tokens * n_choices_per_call
+
+
+def call_with_retries(
+    call: Callable,
+    ii: int,
+    max_retries: int = 5,
+    backoff_base: float = 1.0,
+    backoff_max: float = 60.0,
+    budget: TokenBudget | None = None,
+    request_tokens: int = 0,
+):
+    """
+    Make API call `ii`, retrying retryable errors with exponential backoff
+    and jitter. Each attempt first waits on `budget` if one is given.
+    """
+    for attempt in range(max_retries + 1):
+        if budget is not None:
+            budget.acquire(request_tokens)
+        logger.info(f"n_api_call={ii} attempt={attempt}")
+        try:
+            return call()
+        except Exception as exc:
+            if not is_retryable(exc) or attempt == max_retries:
+                raise
+            delay = min(backoff_max, backoff_base * 2**attempt)
+            delay = delay * (0.5 + random.random() / 2)
+            logger.warning(f"n_api_call={ii} failed with {exc!r}, retrying in {delay:.2f}s")
+            time.sleep(delay)
+
+
 def create_completions(
     messages: list[dict[str, str]],
     model: str = "gpt-4o-mini",
@@ -22,37 +211,648 @@ def create_completions(
     seed: int = 9237,
     temperature: float = 0.0,
     n_api_calls: int = 1,
-) -> list[ChatCompletion]:
+    max_concurrency: int = 1,
+    max_retries: int = 5,
+    backoff_base: float = 1.0,
+    backoff_max: float = 60.0,
+    tokens_per_minute: int | None = None,
+    base_url: str | None = None,
+    on_completion: Callable[["ChatCompletion", int], None] | None = None,
+    cache: ResponseCache | None = None,
+    first_call_index: int = 0,
+    call_indices: Iterable[int] | None = None,
+) -> list["ChatCompletion"]:
+    """
+    Request `n_api_calls` chat completions and return them in call order.
+    Calls are numbered from `first_call_index`, or `call_indices` lists
+    the calls to make (e.g. the ones missing from a store being resumed).
+
+    With `max_concurrency` > 1 the calls are issued from a thread pool.
+    Rate limit (429), server (5xx) and connection errors are retried with
+    exponential backoff and jitter. If `tokens_per_minute` is set, calls
+    wait on a shared token budget before being sent. `base_url` overrides
+    the API endpoint (e.g. to point at a local fake server).
+    `on_completion` is called with each completion and its call index as
+    soon as it arrives (serialized across threads), e.g. to append it to a
+    completion store. With a `cache`, calls are looked up by their full
+    request parameters and call index before hitting the API.
+    """
+    from openai import OpenAI
+
+    client = OpenAI(
+        api_key=os.environ.get("OPENAI_API_KEY"),
+        base_url=base_url,
+        max_retries=0,
+    )
+
+    budget = None
+    if tokens_per_minute is not None:
+        budget = TokenBudget(tokens_per_minute)
+    request_tokens = estimate_request_tokens(
+        messages, max_completion_tokens, n_choices_per_call
+    )
+    callback_lock = threading.Lock()
+
+    if call_indices is None:
+        call_indices = range(first_call_index, first_call_index + n_api_calls)
+    call_indices = list(call_indices)
+
+    params = {
+        "messages": messages,
+        "model": model,
+        "logprobs": logprobs,
+        "top_logprobs": top_logprobs,
+        "max_completion_tokens": max_completion_tokens,
+        "n": n_choices_per_call,
+        "seed": seed,
+        "temperature": temperature,
+        "base_url": base_url,
+    }
+
+    def create_completion(ii: int) -> "ChatCompletion":
+        if cache is not None:
+            request = params | {"call_index": ii}
+            completion = cache.get(request)
+            if completion is not None:
+                logger.info(f"n_api_call={ii} served from cache")
+                if on_completion is not None:
+                    with callback_lock:
+                        on_completion(completion, ii)
+                return completion
+
+        completion = call_with_retries(
+            lambda: client.chat.completions.create(
+                messages=messages,
+                model=model,
+                logprobs=logprobs,
+                top_logprobs=top_logprobs,
+                max_completion_tokens=max_completion_tokens,
+                n=n_choices_per_call,
+                seed=seed,
+                temperature=temperature,
+            ),
+            ii,
+            max_retries=max_retries,
+            backoff_base=backoff_base,
+            backoff_max=backoff_max,
+            budget=budget,
+            request_tokens=request_tokens,
+        )
+        if cache is not None:
+            cache.put(request, completion)
+        if on_completion is not None:
+            with callback_lock:
+                on_completion(completion, ii)
+        return completion
+
+    if max_concurrency <= 1:
+        return [create_completion(ii) for ii in call_indices]
+
+    with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        completions = list(executor.map(create_completion, call_indices))
+
+    return completions
+
+
+def get_request_params(messages: list[dict[str, str]], **kwargs) -> dict:
+    """
+    The request parameters (defaults filled in) that
+    create_completions(messages, **kwargs) sends with every call and that
+    determine its completions, i.e. the cache key without the call index.
+    """
+    bound = inspect.signature(create_completions).bind(messages, **kwargs)
+    bound.apply_defaults()
+    args = bound.arguments
+    return {
+        "messages": args["messages"],
+        "model": args["model"],
+        "logprobs": args["logprobs"],
+        "top_logprobs": args["top_logprobs"],
+        "max_completion_tokens": args["max_completion_tokens"],
+        "n": args["n_choices_per_call"],
+        "seed": args["seed"],
+        "temperature": args["temperature"],
+        "base_url": args["base_url"],
+    }
+
+
+def stream_completions(
+    messages: list[dict[str, str]],
+    on_chunk: Callable[["ChatCompletionChunk"], None],
+    model: str = "gpt-4o-mini",
+    logprobs: bool = True,
+    top_logprobs: int = 1,
+    max_completion_tokens: int = 64,
+    n_choices_per_call: int = 1,
+    seed: int = 9237,
+    temperature: float = 0.0,
+    n_api_calls: int = 1,
+    max_concurrency: int = 1,
+    max_retries: int = 5,
+    backoff_base: float = 1.0,
+    backoff_max: float = 60.0,
+    tokens_per_minute: int | None = None,
+    base_url: str | None = None,
+) -> None:
+    """
+    Like create_completions but with stream=True. Every chunk is passed to
+    `on_chunk` as it arrives (serialized across threads) and nothing is
+    kept, so completions are never materialized.
+
+    Only opening a stream is retried. An error after chunks were delivered
+    is raised, since replaying the call would deliver its tokens twice.
+    Responses are not cached.
+    """
+    from openai import OpenAI
+
+    client = OpenAI(
+        api_key=os.environ.get("OPENAI_API_KEY"),
+        base_url=base_url,
+        max_retries=0,
+    )
+
+    budget = None
+    if tokens_per_minute is not None:
+        budget = TokenBudget(tokens_per_minute)
+    request_tokens = estimate_request_tokens(
+        messages, max_completion_tokens, n_choices_per_call
+    )
+    chunk_lock = threading.Lock()
+
+    def stream_completion(ii: int) -> None:
+        stream = call_with_retries(
+            lambda: client.chat.completions.create(
+                messages=messages,
+                model=model,
+                logprobs=logprobs,
+                top_logprobs=top_logprobs,
+                max_completion_tokens=max_completion_tokens,
+                n=n_choices_per_call,
+                seed=seed,
+                temperature=temperature,
+                stream=True,
+            ),
+            ii,
+            max_retries=max_retries,
+            backoff_base=backoff_base,
+            backoff_max=backoff_max,
+            budget=budget,
+            request_tokens=request_tokens,
+        )
+        with stream:
+            for chunk in stream:
+                with chunk_lock:
+                    on_chunk(chunk)
+
+    if max_concurrency <= 1:
+        for ii in range(n_api_calls):
+            stream_completion(ii)
+        return
+
+    with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        list(executor.map(stream_completion, range(n_api_calls)))
+
+
+# token id that ends a corpus document (and a synthesized choice)
+END_TOKEN = -1
+
 
-    client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+def get_encoding(name: str) -> "tiktoken.Encoding":
+    """
+    tiktoken encoding of a model (e.g. "gpt-4o-mini") or by encoding name
+    (e.g. "o200k_base").
+    """
+    import tiktoken
+
+    try:
+        return tiktoken.encoding_for_model(name)
+    except KeyError:
+        return tiktoken.get_encoding(name)
+
+
+def get_token_dist(counts: dict[int, int]) -> tuple[dict[int, int], list[int], list[int]]:
+    # counts, tokens by decreasing count and their cumulative counts
+    tokens = sorted(counts, key=counts.get, reverse=True)
+    return counts, tokens, list(accumulate(counts[tid] for tid in tokens))
+
+
+class NgramModel:
+    """
+    Token n-gram model fit on a corpus tokenized with tiktoken.
+
+    The probability of a token after a context interpolates its relative
+    counts after the last order - 1, ..., 1, 0 context tokens that were
+    seen in the corpus: the longest gets weight (1 - backoff), the next
+    backoff * (1 - backoff) and so on, and the shortest takes the rest.
+    Sampling picks a context length with these weights and then a token
+    from its counts, which draws from the mixture exactly without ever
+    building it. Every document ends with END_TOKEN, which ends a choice.
+    """
+
+    def __init__(self, encoding: "tiktoken.Encoding", order: int = 3, backoff: float = 0.2):
+        if order < 1:
+            raise ValueError(f"order must be at least 1, got {order}")
+        self.encoding = encoding
+        self.order = order
+        self.backoff = backoff
+        # counts[k][context of k tokens][token]
+        self.counts = [{} for _ in range(order)]
+        self.dists = [{} for _ in range(order)]
+        self.tokens = {}
+
+    def fit(self, texts: Iterable[str]) -> "NgramModel":
+        counts = self.counts
+        order = self.order
+        n_tokens = 0
+        for ids in self.encoding.encode_ordinary_batch(list(texts)):
+            ids.append(END_TOKEN)
+            n_tokens += len(ids)
+            for ii, tid in enumerate(ids):
+                for kk in range(min(order, ii + 1)):
+                    level = counts[kk].setdefault(tuple(ids[ii - kk:ii]), {})
+                    level[tid] = level.get(tid, 0) + 1
+        self.dists = [
+            {context: get_token_dist(level) for context, level in level_counts.items()}
+            for level_counts in counts
+        ]
+        logger.info(f"fit {self.order}-gram model on {n_tokens} tokens with {sum(map(len, counts))} contexts")
+        return self
+
+    def get_levels(self, context: tuple[int, ...]) -> list[list]:
+        """
+        [weight, dist] of every seen suffix of `context`, longest first.
+        """
+        levels = []
+        remaining = 1.0
+        for kk in range(min(self.order - 1, len(context)), -1, -1):
+            dist = self.dists[kk].get(context[len(context) - kk:])
+            if dist is None:
+                continue
+            levels.append([remaining * (1 - self.backoff), dist])
+            remaining *= self.backoff
+        if not levels:
+            raise ValueError("the n-gram model has not been fit on any tokens")
+        levels[-1][0] += remaining
+        return levels
+
+    def get_prob(self, levels: list[list], tid: int) -> float:
+        return sum(weight * counts.get(tid, 0) / cum[-1] for weight, (counts, _, cum) in levels)
+
+    def get_top(self, levels: list[list], n: int, with_end: bool = False) -> list[tuple[int, float]]:
+        """
+        The `n` most likely tokens (with their probability) among the
+        `n` + 1 most frequent ones of every level. The extra one is there so
+        that `n` remain when END_TOKEN is dropped (without `with_end`).
+        """
+        candidates = {tid for _, (_, tokens, _) in levels for tid in tokens[:n + 1]}
+        if not with_end:
+            candidates.discard(END_TOKEN)
+        probs = [(tid, self.get_prob(levels, tid)) for tid in candidates]
+        return sorted(probs, key=lambda item: (-item[1], item[0]))[:n]
+
+    def sample(self, levels: list[list], rng: random.Random) -> int:
+        uu = rng.random()
+        for weight, dist in levels:
+            if uu < weight:
+                break
+            uu -= weight
+        _, tokens, cum = dist
+        return tokens[min(bisect(cum, rng.random() * cum[-1]), len(tokens) - 1)]
+
+    def get_token(self, tid: int) -> tuple[str, list[int]]:
+        """
+        Token string and bytes as the API reports them. Tokens that are not
+        valid utf-8 on their own are written as "bytes:\\xNN...".
+        """
+        if tid not in self.tokens:
+            data = self.encoding.decode_single_token_bytes(tid)
+            try:
+                token = data.decode("utf-8")
+            except UnicodeDecodeError:
+                token = "bytes:" + "".join(f"\\x{byte:02x}" for byte in data)
+            self.tokens[tid] = (token, list(data))
+        return self.tokens[tid]
+
+    def generate(
+        self,
+        context: tuple[int, ...],
+        max_tokens: int,
+        rng: random.Random,
+        temperature: float = 1.0,
+        top_logprobs: int = 0,
+        n_candidates: int = 20,
+    ) -> tuple[list[tuple[int, float, list[tuple[int, float]]]], str]:
+        """
+        Sample up to `max_tokens` tokens after `context`. Returns
+        (token, logprob, top (token, logprob) pairs) for every token and the
+        finish reason ("stop" at END_TOKEN, "length" otherwise).
+
+        temperature 1 samples the model, 0 is greedy and other values
+        sample its `n_candidates` most likely tokens with probabilities
+        raised to 1 / temperature. Reported logprobs are always the
+        model's own.
+        """
+        context = context[max(len(context) - self.order + 1, 0):] if self.order > 1 else ()
+        sampled = []
+        for _ in range(max_tokens):
+            levels = self.get_levels(context)
+            if temperature == 1.0:
+                tid = self.sample(levels, rng)
+            else:
+                candidates = self.get_top(levels, n_candidates, with_end=True)
+                if temperature <= 0:
+                    tid = candidates[0][0]
+                else:
+                    weights = [prob ** (1.0 / temperature) for _, prob in candidates]
+                    tid = rng.choices(candidates, weights)[0][0]
+            if tid == END_TOKEN:
+                return sampled, "stop"
+            tops = [
+                (top_tid, math.log(prob)) for top_tid, prob in self.get_top(levels, top_logprobs)
+            ] if top_logprobs > 0 else []
+            sampled.append((tid, math.log(self.get_prob(levels, tid)), tops))
+            if self.order > 1:
+                context = (context + (tid,))[-(self.order - 1):]
+        return sampled, "length"
+
+
+def iter_corpus_texts(path: str | Path) -> Iterable[str]:
+    """
+    Documents to fit an NgramModel on: the choice texts of a completion
+    store (.json / .jsonl) or the blank line separated paragraphs of any
+    other text file.
+    """
+    path = Path(path)
+    if path.suffix in (".json", ".jsonl"):
+        for completion in load_completions(path):
+            for choice in completion.choices:
+                if choice.message.content:
+                    yield choice.message.content
+        return
+    paragraph = []
+    with path.open("r", encoding="utf-8") as fp:
+        for line in fp:
+            if line.strip():
+                paragraph.append(line)
+            elif paragraph:
+                yield "".join(paragraph)
+                paragraph = []
+    if paragraph:
+        yield "".join(paragraph)
+
+
+def synthesize_completions(
+    messages: list[dict[str, str]],
+    ngram_model: NgramModel,
+    model: str = "gpt-4o-mini",
+    logprobs: bool = True,
+    top_logprobs: int = 1,
+    max_completion_tokens: int = 64,
+    n_choices_per_call: int = 1,
+    seed: int = 9237,
+    temperature: float = 1.0,
+    n_api_calls: int = 1,
+    on_completion: Callable[["ChatCompletion", int], None] | None = None,
+    first_call_index: int = 0,
+) -> list["ChatCompletion"]:
+    """
+    Offline stand-in for create_completions that samples every choice from
+    `ngram_model` after the tokens of `messages`, with the same response
+    shape (message content, logprobs with top_logprobs, finish reason and
+    usage). Needs no API key or network, e.g. to build graphs from many
+    times more tokens than a real run.
+
+    Each call is seeded from (`seed`, call index), so results do not
+    depend on how the calls are batched.
+    """
+    from openai.types.chat.chat_completion import ChatCompletion
+
+    encoding = ngram_model.encoding
+    prompt_ids = []
+    for message in messages:
+        prompt_ids += encoding.encode_ordinary(message.get("content", ""))
+    # chat formatting adds about 3 tokens per message and 3 for the reply
+    n_prompt_tokens = len(prompt_ids) + 3 * len(messages) + 3
+    context = tuple(prompt_ids)
+    created = int(time.time())
 
     completions = []
     for ii in range(n_api_calls):
-        logger.info(f"n_api_call={ii}")
-        completion = client.chat.completions.create(
-            messages=messages,
-            model=model,
-            logprobs=logprobs,
-            top_logprobs=top_logprobs,
-            max_completion_tokens=max_completion_tokens,
-            n=n_choices_per_call,
-            seed=seed,
-            temperature=temperature,
-        )
+        call_index = first_call_index + ii
+        rng = random.Random(f"{seed}-{call_index}")
+        choices = []
+        n_completion_tokens = 0
+        for index in range(n_choices_per_call):
+            sampled, finish_reason = ngram_model.generate(
+                context,
+                max_completion_tokens,
+                rng,
+                temperature=temperature,
+                top_logprobs=top_logprobs if logprobs else 0,
+            )
+            n_completion_tokens += len(sampled)
+            content = []
+            for tid, logprob, tops in sampled:
+                token, token_bytes = ngram_model.get_token(tid)
+                top_dicts = []
+                for top_tid, top_logprob in tops:
+                    top_token, top_bytes = ngram_model.get_token(top_tid)
+                    top_dicts.append({"token": top_token, "bytes": top_bytes, "logprob": top_logprob})
+                content.append({
+                    "token": token,
+                    "bytes": token_bytes,
+                    "logprob": logprob,
+                    "top_logprobs": top_dicts,
+                })
+            choices.append({
+                "index": index,
+                "finish_reason": finish_reason,
+                "logprobs": {"content": content, "refusal": None} if logprobs else None,
+                "message": {
+                    "role": "assistant",
+                    "content": encoding.decode([tid for tid, _, _ in sampled]),
+                    "refusal": None,
+                    "annotations": [],
+                },
+            })
+        completion_id = hashlib.sha256(f"{seed}-{call_index}".encode("utf-8")).hexdigest()[:29]
+        completion = ChatCompletion.model_validate({
+            "id": f"chatcmpl-{completion_id}",
+            "choices": choices,
+            "created": created,
+            "model": model,
+            "object": "chat.completion",
+            "service_tier": "default",
+            "system_fingerprint": "fp_ngram",
+            "usage": {
+                "prompt_tokens": n_prompt_tokens,
+                "completion_tokens": n_completion_tokens,
+                "total_tokens": n_prompt_tokens + n_completion_tokens,
+            },
+        })
+        logger.info(f"n_api_call={call_index} synthesized {n_completion_tokens} tokens")
+        if on_completion is not None:
+            on_completion(completion, call_index)
         completions.append(completion)
+    return completions
+
+
+def save_completions(completions: list["ChatCompletion"], path: str | Path) -> None:
+    """
+    Write completions as a JSON list, one completion per line, encoding
+    them one at a time.
+    """
+    path = Path(path)
+    with path.open("wb") as fp:
+        fp.write(b"[\n")
+        for ii, completion in enumerate(completions):
+            if ii > 0:
+                fp.write(b",\n")
+            fp.write(completion.model_dump_json().encode("utf-8"))
+        fp.write(b"\n]\n")
+
+
+def load_completions(path: str | Path) -> list["ChatCompletion"]:
+    """
+    Load a JSON list or JSONL store of completions. The garbage collector
+    is paused while the models are built (see gc_paused).
+    """
+    from openai.types.chat.chat_completion import ChatCompletion
 
+    path = Path(path)
+    if path.suffix == ".jsonl":
+        with stage("load_completions_jsonl") as record, gc_paused():
+            completions = list(iter_completions(path))
+            record.count = len(completions)
+        return completions
+    with stage("read_json"):
+        dat = read_json(path)
+    with stage("parse_completions") as record, gc_paused():
+        completions = [ChatCompletion.model_validate(el) for el in dat]
+        record.count = len(completions)
     return completions
 
 
-def save_completions(completions: list[ChatCompletion], path: str | Path) -> None:
+def append_completion(
+    completion: "ChatCompletion",
+    path: str | Path,
+    call_index: int | None = None,
+) -> None:
+    """
+    Append one completion as a single JSON line and flush it to disk.
+    With a `call_index` it is stored in the record (as an extra
+    "call_index" field) so that resumed runs know which calls finished.
+    """
     path = Path(path)
-    dat = [el.model_dump() for el in completions]
-    with path.open("w") as fp:
-        fp.write(json.dumps(dat, indent=4))
+    if call_index is not None:
+        completion = completion.model_copy(update={"call_index": call_index})
+    with path.open("a") as fp:
+        fp.write(completion.model_dump_json() + "\n")
+        fp.flush()
+        os.fsync(fp.fileno())
+
 
+def iter_completions(path: str | Path) -> Iterable["ChatCompletion"]:
+    """
+    Yield completions one at a time from a JSONL store.
+
+    A truncated final line (e.g. from a crash mid-write) is skipped.
+    """
+    from openai.types.chat.chat_completion import ChatCompletion
 
-def load_completions(path: str | Path) -> list[ChatCompletion]:
     path = Path(path)
+    with path.open("rb") as fp:
+        for line in fp:
+            if not line.endswith(b"\n"):
+                logger.warning(f"skipping truncated final line in {path}")
+                break
+            if line.strip():
+                yield ChatCompletion.model_validate_json(line)
+
+
+def count_completions(path: str | Path) -> int:
+    path = Path(path)
+    if not path.exists():
+        return 0
     with path.open("r") as fp:
-        dat = json.load(fp)
-    return [ChatCompletion(**el) for el in dat]
+        return sum(1 for line in fp if line.endswith("\n") and line.strip())
+
+
+def read_store_calls(path: str | Path) -> set[int]:
+    """
+    Call indices of the completions already in a JSONL store. Records
+    without a call index (from stores written before it was recorded)
+    are taken to be calls 0, 1, ... in file order.
+    """
+    path = Path(path)
+    call_indices = set()
+    if not path.exists():
+        return call_indices
+    with path.open("rb") as fp:
+        lines = (line for line in fp if line.endswith(b"\n") and line.strip())
+        for irecord, line in enumerate(lines):
+            call_indices.add(json.loads(line).get("call_index", irecord))
+    return call_indices
+
+
+def get_store_appender(
+    path: str | Path,
+    call_indices: set[int],
+) -> Callable[["ChatCompletion", int], None]:
+    """
+    on_completion callback for create_completions that appends to the
+    store at `path` with the call index. Calls already in `call_indices`
+    are skipped (and new ones added to it), so a call is stored at most
+    once however often it is delivered.
+    """
+
+    def append(completion: "ChatCompletion", call_index: int) -> None:
+        if call_index in call_indices:
+            logger.warning(f"skipping call {call_index}, already in {path}")
+            return
+        call_indices.add(call_index)
+        append_completion(completion, path, call_index=call_index)
+
+    return append
+
+
+def get_store_params_path(path: str | Path) -> Path:
+    return Path(path).with_suffix(".params.json")
+
+
+def check_store_params(path: str | Path, params: dict) -> None:
+    """
+    Record the request parameters (see get_request_params) of the store at
+    `path` in a <store>.params.json sidecar, or check them against the
+    recorded ones and raise a ValueError if they differ, so that a resumed
+    run never mixes completions of different requests.
+    """
+    path = Path(path)
+    params_path = get_store_params_path(path)
+    # compare as JSON, e.g. tuples and lists are the same
+    params = json.loads(json.dumps(params))
+    if params_path.exists():
+        stored = json.loads(params_path.read_text())
+        changed = sorted(key for key in stored.keys() | params.keys() if stored.get(key) != params.get(key))
+        if changed:
+            raise ValueError(
+                f"cannot resume {path}, it was written with different {', '.join(changed)} "
+                f"(see {params_path})"
+            )
+        return
+    if count_completions(path) > 0:
+        logger.warning(f"{path} has no {params_path.name}, recording the current request parameters")
+    params_path.write_text(json.dumps(params, indent=4))
+
+
+def truncate_partial_line(path: str | Path) -> None:
+    """
+    Drop a truncated final line so that appends start on a fresh line.
+    """
+    path = Path(path)
+    if not path.exists():
+        return
+    with path.open("rb+") as fp:
+        data = fp.read()
+        if data and not data.endswith(b"\n"):
+            fp.truncate(data.rfind(b"\n") + 1)
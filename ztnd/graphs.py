@@ -1,271 +1,557 @@
-from collections import defaultdict
-from collections import Counter
-from typing import Iterable
-
-import networkx as nx
-from openai.types.chat.chat_completion import Choice
-from openai.types.chat.chat_completion import ChatCompletion
-from openai.types.chat.chat_completion import ChatCompletionTokenLogprob
-from pydantic import BaseModel
-import rich
-
-
-class ZtndChoice(BaseModel):
-    completion_id: str
-    choice_index: int
-    choice: Choice
-
-
-    def get_id(self):
-        return f"{self.completion_id}-{self.choice_index}"
+from array import array
+from concurrent.futures import Executor
+from concurrent.futures import ProcessPoolExecutor
+from typing import TYPE_CHECKING, Iterable
+
+import numpy as np
+
+from ztnd.dag import minimize_trie
+from ztnd.formats import GraphArrays
+from ztnd.parallel import build_trie_sharded
+from ztnd.parallel import count_graph_shard
+from ztnd.parallel import get_n_workers
+from ztnd.parallel import get_shard_bounds
+from ztnd.parallel import merge_partials
+from ztnd.profiling import stage
+from ztnd.serialization import gc_paused
+from ztnd.stats import LogprobStats
+from ztnd.stats import get_branching_entropy
+from ztnd.tokens import TokenTable
+from ztnd.tokens import add_visual_space
+from ztnd.tokens import build_token_table
+from ztnd.trie import TokenTrie
+
+# networkx and openai are only needed for nx.DiGraph output and type hints
+if TYPE_CHECKING:
+    import networkx as nx
+    from openai.types.chat.chat_completion import ChatCompletion
+
+
+def as_token_table(completions: "Iterable[ChatCompletion] | TokenTable") -> TokenTable:
+    if isinstance(completions, TokenTable):
+        return completions
+    with stage("build_token_table") as record:
+        table = build_token_table(completions)
+        record.count = len(table)
+    return table
+
+
+class TokenGraphIndex:
+    """
+    Incremental state behind build_token_graph.
+
+    Nodes are kept as integers in order of first appearance (ROOT = 0) and
+    edges as integers indexed by (lo, hi) node. Token logprobs are
+    accumulated per node and per edge (the logprob of the edge's target
+    token), and the edge observation count is its weight. New batches of
+    tokens can be absorbed with add_table, and an nx.DiGraph produced by
+    to_digraph can be brought up to date with update_digraph without a
+    rebuild.
+    """
 
+    root_node_id = "ROOT"
 
-def iter_choice(completion: ChatCompletion) -> Iterable[ZtndChoice]:
-    for choice in completion.choices:
-        yield ZtndChoice(
-            completion_id = completion.id,
-            choice_index = choice.index,
-            choice = choice,
+    def __init__(self, graph_type: str, add_token_ids: bool = False):
+        if graph_type not in ("token", "token_pos"):
+            raise ValueError()
+        self.graph_type = graph_type
+        self.add_token_ids = add_token_ids
+        self.node_ids = [self.root_node_id]
+        self.node_index = {self.root_node_id: 0}
+        # with add_token_ids, token_rows[node] holds the global row numbers
+        # of its tokens and their uids are rendered on output
+        self.token_rows = [array("q")]
+        self.completion_ids = []
+        self.row_completion = array("i")
+        self.row_choice_index = array("i")
+        self.row_token_index = array("i")
+        self.node_stats = LogprobStats(1)
+        self.edges = []
+        self.edge_index = {}
+        self.edge_stats = LogprobStats()
+
+    def __len__(self) -> int:
+        return len(self.node_ids)
+
+    def get_nodes(self, node_ids: list[str]) -> np.ndarray:
+        """
+        Nodes of the distinct `node_ids`, creating the unseen ones in order.
+        """
+        get = self.node_index.get
+        nodes = np.array([get(node_id, -1) for node_id in node_ids], dtype=np.int64)
+        new = np.flatnonzero(nodes < 0)
+        nodes[new] = np.arange(len(self.node_ids), len(self.node_ids) + len(new))
+        new_ids = [node_ids[ii] for ii in new.tolist()]
+        self.node_index.update(zip(new_ids, nodes[new].tolist()))
+        self.node_ids.extend(new_ids)
+        if self.add_token_ids:
+            self.token_rows.extend(array("q") for _ in new_ids)
+        return nodes
+
+    def get_edges(self, edges: list[tuple[int, int]]) -> np.ndarray:
+        """
+        Edge numbers of the distinct `edges`, creating the unseen ones in
+        order.
+        """
+        get = self.edge_index.get
+        iedges = np.array([get(edge, -1) for edge in edges], dtype=np.int64)
+        new = np.flatnonzero(iedges < 0)
+        iedges[new] = np.arange(len(self.edges), len(self.edges) + len(new))
+        new_edges = [edges[ii] for ii in new.tolist()]
+        self.edge_index.update(zip(new_edges, iedges[new].tolist()))
+        self.edges.extend(new_edges)
+        return iedges
+
+    def add_table(
+        self,
+        table: TokenTable,
+        executor: Executor | None = None,
+        n_shards: int = 1,
+    ) -> list[tuple[int, int]]:
+        """
+        Absorb all choices in `table` and return the edges that changed.
+        With an `executor` the choices are split into `n_shards` contiguous
+        ranges (balanced by token count) whose partial node and edge counts
+        are built in parallel (see count_graph_shard) and merged here.
+        """
+
+        labels = np.array(table.labels + [""], dtype=object)
+
+        # integer key per row identifying its node within this batch
+        #---------------------------------------------------
+        if self.graph_type == "token":
+            row_key = table.token_id.astype(np.int64)
+            def get_node_ids(keys):
+                return labels[keys].tolist()
+        else:
+            n_pos = int(table.token_index.max()) + 1 if len(table) else 1
+            row_key = table.token_id.astype(np.int64) * n_pos + table.token_index
+            def get_node_ids(keys):
+                return [
+                    "{}|{}".format(label, pos)
+                    for label, pos in zip(labels[keys // n_pos].tolist(), (keys % n_pos).tolist())
+                ]
+
+        # partial node and edge counts per shard of choices
+        #---------------------------------------------------
+        offsets = table.choice_offsets
+        if executor is None or n_shards <= 1:
+            shards = [count_graph_shard(row_key, table.logprob, offsets)]
+        else:
+            bounds = get_shard_bounds(np.diff(offsets), n_shards)
+            row_bounds = offsets[bounds].tolist()
+            shards = list(executor.map(
+                count_graph_shard,
+                [row_key[lo:hi] for lo, hi in zip(row_bounds[:-1], row_bounds[1:])],
+                [table.logprob[lo:hi] for lo, hi in zip(row_bounds[:-1], row_bounds[1:])],
+                [offsets[lo:hi + 1] - offsets[lo] for lo, hi in zip(bounds[:-1], bounds[1:])],
+                row_bounds[:-1],
+            ))
+
+        # map batch nodes to global nodes in order of first appearance
+        #---------------------------------------------------
+        if len(shards) == 1:
+            node_keys, node_first, node_stats = shards[0]["node_keys"], shards[0]["node_first"], shards[0]["node_stats"]
+        else:
+            node_keys, node_first, node_stats = merge_partials(
+                [shard["node_keys"] for shard in shards],
+                [shard["node_first"] for shard in shards],
+                [shard["node_stats"] for shard in shards],
+            )
+        order = np.argsort(node_first, kind="stable")
+        batch_nodes = np.zeros(len(node_keys), dtype=np.int64)
+        batch_nodes[order] = self.get_nodes(get_node_ids(node_keys[order]))
+
+        if self.add_token_ids:
+            self.add_token_rows(table, batch_nodes[np.searchsorted(node_keys, row_key)])
+        self.node_stats.grow(len(self.node_ids))
+        self.node_stats.add_reduced(batch_nodes, *node_stats)
+
+        # map batch edges to global edges in order of first appearance
+        #---------------------------------------------------
+        n_nodes = len(self.node_ids)
+        edge_keys = []
+        for shard in shards:
+            lo = batch_nodes[np.searchsorted(node_keys, shard["edge_lo"])]
+            lo[shard["edge_lo"] < 0] = 0
+            edge_keys.append(lo * n_nodes + batch_nodes[np.searchsorted(node_keys, shard["edge_hi"])])
+        if len(shards) == 1:
+            edge_keys, edge_first, edge_stats = edge_keys[0], shards[0]["edge_first"], shards[0]["edge_stats"]
+        else:
+            edge_keys, edge_first, edge_stats = merge_partials(
+                edge_keys, [shard["edge_first"] for shard in shards], [shard["edge_stats"] for shard in shards]
+            )
+
+        order = np.argsort(edge_first, kind="stable")
+        edge_lo, edge_hi = np.divmod(edge_keys[order], n_nodes)
+        edges = list(zip(edge_lo.tolist(), edge_hi.tolist()))
+        batch_edges = np.zeros(len(edge_keys), dtype=np.int64)
+        batch_edges[order] = self.get_edges(edges)
+        self.edge_stats.grow(len(self.edges))
+        self.edge_stats.add_reduced(batch_edges, *edge_stats)
+
+        return edges
+
+    def add_token_rows(self, table: TokenTable, row_node: np.ndarray) -> None:
+        first_row = len(self.row_completion)
+        self.row_completion.extend(
+            (table.completion + len(self.completion_ids)).astype(np.int32).tolist()
         )
-
-
-class ZtndToken(BaseModel):
-    completion_id: str
-    choice_index: int
-    token_index: int
-    cctl: ChatCompletionTokenLogprob
-
-    def get_id(self):
-        return f"{self.completion_id}-{self.choice_index}-{self.token_index}"
-
-
-def iter_token(zchoice: ZtndChoice) -> Iterable[ZtndToken]:
-    if zchoice.choice.logprobs is None:
-        raise ValueError("choice.logprobs is None")
-    if zchoice.choice.logprobs.content is None:
-        raise ValueError("choice.logprobs.content is None")
-    for ii, cctl in enumerate(zchoice.choice.logprobs.content):
-        yield ZtndToken(
-            completion_id = zchoice.completion_id,
-            choice_index = zchoice.choice_index,
-            token_index = ii,
-            cctl = cctl,
+        self.completion_ids.extend(table.completion_ids)
+        self.row_choice_index.extend(table.choice_index.tolist())
+        self.row_token_index.extend(table.token_index.tolist())
+        for row, node in enumerate(row_node.tolist(), start=first_row):
+            self.token_rows[node].append(row)
+
+    def get_token_ids(self, node: int) -> list[str]:
+        return [
+            "{}-{}-{}".format(
+                self.completion_ids[self.row_completion[row]],
+                self.row_choice_index[row],
+                self.row_token_index[row],
+            )
+            for row in self.token_rows[node]
+        ]
+
+    def add_completions(self, completions: Iterable["ChatCompletion"]) -> list[tuple[int, int]]:
+        return self.add_table(build_token_table(completions))
+
+    def get_node_meta(self, node: int) -> dict:
+        node_id = self.node_ids[node]
+        node_meta = {
+            "id": node_id,
+            "label": node_id,
+        }
+        if self.add_token_ids and (node != 0 or self.token_rows[0]):
+            node_meta["token_ids"] = self.get_token_ids(node)
+        return node_meta
+
+    @property
+    def edge_weight(self) -> dict[tuple[int, int], int]:
+        return dict(zip(self.edges, self.edge_stats.count.tolist()))
+
+    def to_digraph(self, add_stats: bool = True) -> "nx.DiGraph":
+        """
+        With `add_stats` nodes and edges also carry the probability mass,
+        mean and min logprob of their tokens, and nodes carry the entropy
+        of their out-edge distribution.
+        """
+        import networkx as nx
+
+        nodes = [(node, self.get_node_meta(node)) for node in range(len(self.node_ids))]
+        weights = self.edge_stats.count.tolist()
+        edges = [(lo, hi, {"weight": weight}) for (lo, hi), weight in zip(self.edges, weights)]
+
+        if add_stats:
+            self.node_stats.grow(len(self.node_ids))
+            for name, col in self.node_stats.get_attrs().items():
+                for node, node_meta in nodes:
+                    node_meta[name] = col[node]
+            for name, col in self.edge_stats.get_attrs().items():
+                for iedge, (_, _, edge_meta) in enumerate(edges):
+                    edge_meta[name] = col[iedge]
+            edge_lo = np.array([lo for lo, _ in self.edges], dtype=np.int64)
+            entropy = get_branching_entropy(edge_lo, weights, len(self.node_ids)).tolist()
+            for node, node_meta in nodes:
+                node_meta["entropy"] = entropy[node]
+
+        graph = nx.DiGraph()
+        graph.add_nodes_from(nodes)
+        graph.add_edges_from(edges)
+        return graph
+
+    def to_arrays(self, add_stats: bool = True) -> GraphArrays:
+        """
+        Convert straight to CSR GraphArrays with the same attributes as
+        to_digraph (except token_ids), without building an nx.DiGraph.
+        """
+        n_nodes = len(self.node_ids)
+        edges = np.array(self.edges, dtype=np.int64).reshape(-1, 2)
+        # adjacency order is edge creation order within each source
+        perm = np.argsort(edges[:, 0], kind="stable")
+        indptr = np.zeros(n_nodes + 1, dtype=np.int64)
+        np.cumsum(np.bincount(edges[:, 0], minlength=n_nodes), out=indptr[1:])
+
+        weights = self.edge_stats.count
+        node_attrs = {}
+        edge_attrs = {"weight": weights[perm]}
+        if add_stats:
+            self.node_stats.grow(n_nodes)
+            for name, col in self.node_stats.get_attrs().items():
+                node_attrs[name] = np.array(col)
+            for name, col in self.edge_stats.get_attrs().items():
+                edge_attrs[name] = np.array(col)[perm]
+            node_attrs["entropy"] = get_branching_entropy(edges[:, 0], weights, n_nodes)
+
+        node_str = np.arange(n_nodes, dtype=np.int32)
+        return GraphArrays(
+            indptr=indptr,
+            indices=edges[perm, 1],
+            strings=list(self.node_ids),
+            node_attrs=node_attrs,
+            node_str_attrs={"id": node_str, "label": node_str},
+            edge_attrs=edge_attrs,
         )
 
-
-def add_visual_space(text: str) -> str:
-#    return text.replace(" ", "\u2420") # SP symbol for space
-    return text.replace(" ", "\u2423") # open box
+    def get_stats_meta(self, stats: LogprobStats, ii: int) -> dict:
+        count = int(stats.count[ii])
+        return {
+            "prob_mass": float(stats.prob_mass[ii]),
+            "mean_logprob": float(stats.logprob_sum[ii]) / count if count else 0.0,
+            "min_logprob": float(stats.logprob_min[ii]),
+        }
+
+    def update_digraph(
+        self,
+        graph: "nx.DiGraph",
+        edges: list[tuple[int, int]],
+        add_stats: bool = True,
+    ) -> "nx.DiGraph":
+        """
+        Add nodes created since `graph` was built and refresh the weights of
+        `edges` (as returned by add_table). Existing node ids are unchanged.
+        """
+        # logprob stats of new nodes are filled in below since every new
+        # node is the target of a changed edge
+        new_nodes = range(graph.number_of_nodes(), len(self.node_ids))
+        graph.add_nodes_from((node, self.get_node_meta(node)) for node in new_nodes)
+        if add_stats:
+            for node in new_nodes:
+                graph.nodes[node]["entropy"] = 0.0
+        if self.add_token_ids:
+            for lo, hi in edges:
+                graph.nodes[hi]["token_ids"] = self.get_token_ids(hi)
+
+        edge_metas = []
+        for lo, hi in edges:
+            iedge = self.edge_index[(lo, hi)]
+            edge_meta = {"weight": int(self.edge_stats.count[iedge])}
+            if add_stats:
+                edge_meta.update(self.get_stats_meta(self.edge_stats, iedge))
+                graph.nodes[hi].update(self.get_stats_meta(self.node_stats, hi))
+            edge_metas.append((lo, hi, edge_meta))
+        graph.add_edges_from(edge_metas)
+
+        if add_stats:
+            for lo in {lo for lo, _ in edges}:
+                weights = [data["weight"] for data in graph[lo].values()]
+                graph.nodes[lo]["entropy"] = float(get_branching_entropy(
+                    np.zeros(len(weights), dtype=np.int64), weights, 1
+                )[0])
+        return graph
+
+
+def build_graph_index(
+    table: TokenTable,
+    graph_type: str,
+    add_token_ids: bool = False,
+    n_workers: int | None = 1,
+) -> TokenGraphIndex:
+    """
+    TokenGraphIndex over `table`. With `n_workers` other than 1 (None or 0
+    for one per core) partial node and edge counts of contiguous choice
+    ranges are built on a process pool and merged. Nodes, edges and counts
+    are the same as in the serial build and logprob stats equal up to
+    float rounding, since partial sums are added in a different order.
+    """
+    index = TokenGraphIndex(graph_type, add_token_ids=add_token_ids)
+    if n_workers == 1:
+        index.add_table(table)
+        return index
+    n_workers = get_n_workers(n_workers)
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        index.add_table(table, executor, n_workers)
+    return index
+
+
+def build_trie(
+    table: TokenTable,
+    add_alternatives: bool = False,
+    min_alt_prob: float = 0.01,
+    max_alternatives: int | None = None,
+    n_workers: int | None = 1,
+) -> TokenTrie:
+    """
+    TokenTrie over `table`. With `n_workers` other than 1 (None or 0 for
+    one per core) partial tries are built on a process pool and merged
+    into the same trie as the serial build (see build_trie_sharded).
+    """
+    if n_workers != 1:
+        trie, _ = build_trie_sharded(
+            table,
+            n_workers,
+            add_alternatives=add_alternatives,
+            min_alt_prob=min_alt_prob,
+            max_alternatives=max_alternatives,
+        )
+        return trie
+    trie = TokenTrie(
+        add_alternatives=add_alternatives,
+        min_alt_prob=min_alt_prob,
+        max_alternatives=max_alternatives,
+    )
+    trie.add_table(table)
+    return trie
 
 
 def build_token_graph(
-    completions: list[ChatCompletion],
+    completions: "Iterable[ChatCompletion] | TokenTable",
     graph_type: str,
     add_token_ids: bool = False,
-) -> nx.DiGraph:
+    add_stats: bool = True,
+    n_workers: int | None = 1,
+) -> "nx.DiGraph":
     """
+    Merge tokens into nodes keyed by token ("token") or token and position
+    ("token_pos") and count the transitions between them as edge weights.
+    With `add_stats` logprob statistics and branching entropy are attached
+    (see TokenGraphIndex.to_digraph). See build_graph_index for `n_workers`.
     """
+    table = as_token_table(completions)
+    with stage("build_token_index") as record:
+        index = build_graph_index(table, graph_type, add_token_ids=add_token_ids, n_workers=n_workers)
+        record.count = len(index)
+    with stage("to_digraph") as record, gc_paused():
+        graph = index.to_digraph(add_stats=add_stats)
+        record.count = graph.number_of_nodes()
+    return graph
 
-    def get_node_id_token(zt: ZtndToken):
-        return add_visual_space(zt.cctl.token)
-
-    def get_node_id_token_pos(zt: ZtndToken):
-        return "{}|{}".format(add_visual_space(zt.cctl.token), zt.token_index)
-
-    if graph_type == "token":
-        get_node_id = get_node_id_token
-    elif graph_type == "token_pos":
-        get_node_id = get_node_id_token_pos
-    else:
-        raise ValueError()
-
-
-    graph = nx.DiGraph()
-
-    # create root node
-    #---------------------------------------------------
-    root_node_id = "ROOT"
-    root_node_meta = {
-        "id": root_node_id,
-        "label": root_node_id,
-    }
-    graph.add_nodes_from([(root_node_id, root_node_meta)])
-
-    # get all token_ids at a node
-    #---------------------------------------------------
-    node_id_to_token_ids = defaultdict(list)
-    for completion in completions:
-        for zc in iter_choice(completion):
-            for zt in iter_token(zc):
-                node_id = get_node_id(zt)
-                zt_id = zt.get_id()
-                node_id_to_token_ids[node_id].append(zt_id)
-
-
-    # create token nodes
-    #---------------------------------------------------
-    for completion in completions:
-        for zc in iter_choice(completion):
-            for zt in iter_token(zc):
-                node_id = get_node_id(zt)
-                label = node_id
-                node_meta = {
-                    "id": node_id,
-                    "label": label,
-                }
-                if add_token_ids:
-                    node_meta["token_ids"] = node_id_to_token_ids[node_id],
-                graph.add_nodes_from([(node_id, node_meta)])
-
-
-    # create edges
-    #---------------------------------------------------
-    for completion in completions:
-        for zc in iter_choice(completion):
-            zts = list(iter_token(zc))
-
-            node_id_lo = root_node_id
-            node_id_hi = get_node_id(zts[0])
-            if graph.has_edge(node_id_lo, node_id_hi):
-                graph[node_id_lo][node_id_hi]["weight"] += 1
-            else:
-                graph.add_edge(
-                    node_id_lo,
-                    node_id_hi,
-                    weight=1,
-                )
-
-            for zt_lo, zt_hi in zip(zts[:-1], zts[1:]):
-                node_id_lo = get_node_id(zt_lo)
-                node_id_hi = get_node_id(zt_hi)
-
-                if graph.has_edge(node_id_lo, node_id_hi):
-                    graph[node_id_lo][node_id_hi]["weight"] += 1
-                else:
-                    graph.add_edge(
-                        node_id_lo,
-                        node_id_hi,
-                        weight=1,
-                    )
-
-    graph = nx.convert_node_labels_to_integers(graph)
 
-    return graph
+def update_token_graph(
+    graph: "nx.DiGraph",
+    index: TokenGraphIndex,
+    completions: "Iterable[ChatCompletion] | TokenTable",
+    add_stats: bool = True,
+) -> "nx.DiGraph":
+    """
+    Absorb a new batch of completions into `graph` in place. `graph` must
+    have been produced by `index.to_digraph()` (or kept in sync with it).
+    """
+    edges = index.add_table(as_token_table(completions))
+    return index.update_digraph(graph, edges, add_stats=add_stats)
 
 
 def build_token_pos_tree(
-    completions: list[ChatCompletion],
+    completions: "Iterable[ChatCompletion] | TokenTable",
     add_token_ids: bool = False,
-) -> nx.DiGraph:
+    add_stats: bool = True,
+    add_alternatives: bool = False,
+    min_alt_prob: float = 0.01,
+    max_alternatives: int | None = None,
+    n_workers: int | None = 1,
+) -> "nx.DiGraph":
     """
+    Build a prefix tree of the sampled choices. Each node is a token at a
+    position and edge weights count the choices sharing that prefix.
+    With `add_stats` logprob statistics and branching entropy are attached
+    (see TokenTrie.to_digraph). With `add_alternatives` unsampled
+    top_logprobs alternatives are added as virtual leaf children weighted
+    by probability (see TokenTrie). See build_trie for `n_workers`.
     """
-
-    def get_token(zt: ZtndToken) -> str:
-        return add_visual_space(zt.cctl.token)
-
-    def get_token_pos(zt: ZtndToken) -> str:
-        return "{}|{}".format(add_visual_space(zt.cctl.token), zt.token_index)
-
-    graph = nx.DiGraph()
-
-    # create root node
-    #---------------------------------------------------
-    root_node_id = "ROOT|-1|0"
-    root_node_meta = {"id": root_node_id, "label": root_node_id}
-    graph.add_nodes_from([(root_node_id, root_node_meta)])
-
-    # create tree
-    #---------------------------------------------------
-
-    # as soon as the next token is not in the tree, diverged = True
-
-    prefix_counter = Counter()
-    prefix_jj_counter = Counter()
-    for icomp, completion in enumerate(completions):
-        for zc in iter_choice(completion):
-
-            diverged = False
-            zts = list(iter_token(zc))
-
-            # is there an edge from root to first token?
-
-            node_id_prefix_lo = get_token_pos(zts[0])
-            node_id_lo = "{}|0".format(node_id_prefix_lo)
-            if graph.has_edge(root_node_id, node_id_lo):
-                graph[root_node_id][node_id_lo]["weight"] += 1
-            else:
-                diverged = True
-                graph.add_edge(
-                    root_node_id,
-                    node_id_lo,
-                    weight=1,
-                )
-
-            for ii, (zt_lo, zt_hi) in enumerate(zip(zts[:-1], zts[1:])):
-
-                node_id_prefix_hi = get_token_pos(zt_hi)
-                prefix_counter[node_id_prefix_hi] += 1
-                jj2 = prefix_jj_counter[node_id_prefix_hi]
-
-                if diverged:
-
-                    prefix_jj_counter[node_id_prefix_hi] += 1
-                    jj2 = prefix_jj_counter[node_id_prefix_hi]
-                    node_id_hi = f"{node_id_prefix_hi}|{jj2}"
-                    graph.add_edge(
-                        node_id_lo,
-                        node_id_hi,
-                        weight=1,
-                    )
-
-                else:
-
-                    nbrs = graph[node_id_lo]
-                    mtch_nbrs = [nbr for nbr in nbrs if nbr.startswith(node_id_prefix_hi)]
-                    if len(mtch_nbrs) == 0:
-                        diverged = True
-                        prefix_jj_counter[node_id_prefix_hi] += 1
-                        jj2 = prefix_jj_counter[node_id_prefix_hi]
-                        node_id_hi = f"{node_id_prefix_hi}|{jj2}"
-                        graph.add_edge(
-                            node_id_lo,
-                            node_id_hi,
-                            weight=1,
-                        )
-                        prefix_jj_counter[node_id_prefix_hi] += 1
-                    elif len(mtch_nbrs) == 1:
-                        node_id_hi = mtch_nbrs[0]
-                        graph[node_id_lo][node_id_hi]["weight"] += 1
-                    else:
-                        raise ValueError()
-
-                node_id_lo = node_id_hi
-
-    graph = nx.convert_node_labels_to_integers(graph, label_attribute="id")
-
-    label = {}
-    for node_id, node_meta in graph.nodes(data=True):
-        label[node_id] = node_meta["id"].split("|")[0]
-    nx.set_node_attributes(graph, label, "label")
-
-    token_index = {}
-    for node_id, node_meta in graph.nodes(data=True):
-        token_index[node_id] = int(node_meta["id"].split("|")[1])
-    nx.set_node_attributes(graph, token_index, "token_index")
+    table = as_token_table(completions)
+    with stage("build_trie") as record:
+        trie = build_trie(
+            table,
+            add_alternatives=add_alternatives,
+            min_alt_prob=min_alt_prob,
+            max_alternatives=max_alternatives,
+            n_workers=n_workers,
+        )
+        record.count = len(trie)
+    with stage("to_digraph") as record, gc_paused():
+        graph = trie.to_digraph(add_stats=add_stats)
+        record.count = graph.number_of_nodes()
+    return graph
 
 
+def build_token_dag(
+    completions: "Iterable[ChatCompletion] | TokenTable",
+    add_stats: bool = True,
+    n_workers: int | None = 1,
+) -> "nx.DiGraph":
+    """
+    Build the token position tree and minimize it into a DAG by merging
+    identical suffix subtrees, so choices that diverge and rejoin share
+    their tails. Edge weights still count the choices along each edge
+    (see minimize_trie).
+    """
+    table = as_token_table(completions)
+    with stage("build_trie") as record:
+        trie = build_trie(table, n_workers=n_workers)
+        record.count = len(trie)
+    with stage("minimize_trie") as record:
+        arrays = minimize_trie(trie, add_stats=add_stats)
+        record.count = arrays.n_nodes
+    with stage("to_digraph") as record, gc_paused():
+        graph = arrays.to_digraph()
+        record.count = graph.number_of_nodes()
     return graph
 
 
+def build_graph_arrays(
+    completions: "Iterable[ChatCompletion] | TokenTable",
+    graph_type: str,
+    add_stats: bool = True,
+    add_alternatives: bool = False,
+    min_alt_prob: float = 0.01,
+    max_alternatives: int | None = None,
+    n_workers: int | None = 1,
+) -> GraphArrays:
+    """
+    Build a "token", "token_pos", "token_pos_tree" or "token_dag" graph
+    straight into GraphArrays, with the same nodes, edges and attributes
+    as the nx builders, for exports that do not need an nx.DiGraph.
+    """
+    if graph_type not in ("token", "token_pos", "token_pos_tree", "token_dag"):
+        raise ValueError(graph_type)
+    table = as_token_table(completions)
+    with stage("build_graph_index") as record:
+        if graph_type == "token_pos_tree":
+            builder = build_trie(
+                table,
+                add_alternatives=add_alternatives,
+                min_alt_prob=min_alt_prob,
+                max_alternatives=max_alternatives,
+                n_workers=n_workers,
+            )
+        elif graph_type == "token_dag":
+            builder = build_trie(table, n_workers=n_workers)
+        else:
+            builder = build_graph_index(table, graph_type, n_workers=n_workers)
+        record.count = len(builder)
+    with stage("to_arrays") as record:
+        if graph_type == "token_dag":
+            arrays = minimize_trie(builder, add_stats=add_stats)
+        else:
+            arrays = builder.to_arrays(add_stats=add_stats)
+        record.count = arrays.n_nodes
+    return arrays
+
+
+def update_token_pos_tree(
+    graph: "nx.DiGraph",
+    trie: TokenTrie,
+    completions: "Iterable[ChatCompletion] | TokenTable",
+    add_stats: bool = True,
+) -> "nx.DiGraph":
+    """
+    Absorb a new batch of completions into `graph` in place. `graph` must
+    have been produced by `trie.to_digraph()` (or kept in sync with it).
+    """
+    leaves = trie.add_table(as_token_table(completions))
+    return trie.update_digraph(graph, leaves, add_stats=add_stats)
+
 
 if __name__ == "__main__":
 
-    from generations import load_completions
+    from ztnd.choices import iter_choice
+    from ztnd.choices import iter_token
+    from ztnd.generations import load_completions
     cpath = "../scripts/cache/2024-10-14-18-20-08/completions.json"
     completions = load_completions(cpath)
     for completion in completions:
         for zc in iter_choice(completion):
             zts = list(iter_token(zc))
 
-    token_graph = build_token_graph(completions, add_token_ids=False)
-    token_pos_graph = build_token_pos_graph(completions, add_token_ids=False)
+    token_graph = build_token_graph(completions, graph_type="token", add_token_ids=False)
+    token_pos_tree = build_token_pos_tree(completions, add_token_ids=False)
@@ -0,0 +1,183 @@
+import logging
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+from ztnd.formats import GraphArrays
+from ztnd.profiling import stage
+
+if TYPE_CHECKING:
+    import networkx as nx
+
+logger = logging.getLogger(__name__)
+
+
+def get_level_ypos(level: np.ndarray, order: np.ndarray) -> np.ndarray:
+    """
+    Give the nodes of each level unit spaced y positions centered on 0.
+
+    Within a level nodes are placed by ascending `order`. This is a single
+    group-by (lexsort on level then order) rather than a scan per level.
+    """
+    n_nodes = len(level)
+    if n_nodes == 0:
+        return np.zeros(0, dtype=np.float64)
+
+    perm = np.lexsort((order, level))
+    sorted_level = level[perm]
+    starts = np.flatnonzero(np.r_[True, sorted_level[1:] != sorted_level[:-1]])
+    counts = np.diff(np.r_[starts, n_nodes])
+
+    group_start = np.repeat(starts, counts)
+    group_count = np.repeat(counts, counts)
+    rank = np.arange(n_nodes) - group_start
+
+    ypos = np.empty(n_nodes, dtype=np.float64)
+    ypos[perm] = rank - (group_count - 1) / 2
+    return ypos
+
+
+def get_tree_order(parent: np.ndarray, level: np.ndarray) -> np.ndarray:
+    """
+    Breadth first rank of every node of a tree given as a parent array.
+
+    Nodes are integers 0..n-1, the root has parent -1, and siblings are
+    ordered by node id (which is adjacency order for trees built by
+    TokenTrie). This matches the order nx.bfs_layers visits the nodes in.
+    """
+    n_nodes = len(parent)
+    rank = np.zeros(n_nodes, dtype=np.int64)
+    if n_nodes == 0:
+        return rank
+
+    by_level = np.argsort(level, kind="stable")
+    sorted_level = level[by_level]
+    bounds = np.flatnonzero(np.r_[True, sorted_level[1:] != sorted_level[:-1], True])
+
+    next_rank = 0
+    for lo, hi in zip(bounds[:-1], bounds[1:]):
+        nodes = by_level[lo:hi]
+        if lo == 0:
+            parent_rank = np.zeros(len(nodes), dtype=np.int64)
+        else:
+            parent_rank = rank[parent[nodes]]
+        nodes = nodes[np.lexsort((nodes, parent_rank))]
+        rank[nodes] = np.arange(next_rank, next_rank + len(nodes))
+        next_rank += len(nodes)
+    return rank
+
+
+def tree_layout(parent: np.ndarray, level: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Layout a tree with x = level and unit spaced, centered y per level.
+    """
+    level = np.asarray(level)
+    xpos = level.astype(np.float64)
+    ypos = get_level_ypos(level, get_tree_order(np.asarray(parent), level))
+    return xpos, ypos
+
+
+def get_tree_parent(graph: "nx.DiGraph") -> np.ndarray | None:
+    """
+    Parent array of an integer labeled tree (nodes 0..n-1), or None if
+    `graph` is not one.
+    """
+    n_nodes = graph.number_of_nodes()
+    if list(graph.nodes) != list(range(n_nodes)) or graph.number_of_edges() != n_nodes - 1:
+        return None
+    parent = np.full(n_nodes, -1, dtype=np.int64)
+    for lo, hi in graph.edges():
+        if parent[hi] != -1:
+            return None
+        parent[hi] = lo
+    return parent
+
+
+def bfs_level_layout(
+    graph: "nx.DiGraph",
+    start_node_id,
+    level_attr: str | None = None,
+) -> tuple[dict, dict]:
+    """
+    Compute xpos / ypos dicts for `graph` with x = level and unit spaced,
+    centered y positions per level in breadth first order.
+
+    If `level_attr` names a node attribute holding the depth (e.g.
+    "token_index") and `graph` is an integer labeled tree rooted at
+    `start_node_id`, the layout is computed from arrays without a traversal.
+    Otherwise levels come from a single breadth first search, and so do
+    they if some nodes lack `level_attr` (e.g. token and token_pos graphs).
+    """
+
+    if level_attr is not None and not all(
+        level_attr in data for _, data in graph.nodes(data=True)
+    ):
+        logger.info(f"not all nodes have {level_attr!r}, using breadth first depth as level")
+        level_attr = None
+
+    parent = None
+    if level_attr is not None and start_node_id == 0:
+        parent = get_tree_parent(graph)
+
+    if parent is not None:
+        level = np.fromiter(
+            (data[level_attr] for _, data in graph.nodes(data=True)),
+            dtype=np.int64,
+            count=graph.number_of_nodes(),
+        )
+        xpos, ypos = tree_layout(parent, level)
+        nodes = range(graph.number_of_nodes())
+    else:
+        import networkx as nx
+
+        nodes = []
+        level = []
+        for depth, layer in enumerate(nx.bfs_layers(graph, start_node_id)):
+            nodes.extend(layer)
+            level.extend([depth] * len(layer))
+        if len(nodes) != graph.number_of_nodes():
+            logger.warning(
+                f"{graph.number_of_nodes() - len(nodes)} nodes are not reachable "
+                f"from {start_node_id} and were not placed"
+            )
+        level = np.array(level, dtype=np.int64)
+        if level_attr is not None:
+            level = np.array([graph.nodes[node][level_attr] for node in nodes], dtype=np.int64)
+        xpos = level.astype(np.float64)
+        ypos = get_level_ypos(level, np.arange(len(nodes)))
+
+    return (
+        dict(zip(nodes, xpos.tolist())),
+        dict(zip(nodes, ypos.tolist())),
+    )
+
+
+def set_bfs_level_layout(
+    graph: "nx.DiGraph",
+    start_node_id,
+    level_attr: str | None = None,
+) -> "nx.DiGraph":
+    import networkx as nx
+
+    with stage("bfs_level_layout") as record:
+        xpos, ypos = bfs_level_layout(graph, start_node_id, level_attr=level_attr)
+        record.count = len(xpos)
+    with stage("set_node_attributes"):
+        nx.set_node_attributes(graph, xpos, "xpos")
+        nx.set_node_attributes(graph, ypos, "ypos")
+    return graph
+
+
+def set_tree_layout_arrays(arrays: GraphArrays, level_attr: str = "token_index") -> GraphArrays:
+    """
+    Add "xpos" / "ypos" node attributes to a tree held as GraphArrays,
+    matching set_bfs_level_layout(graph, 0, level_attr) on the same tree.
+    """
+    parent = np.full(arrays.n_nodes, -1, dtype=np.int64)
+    parent[arrays.indices] = arrays.sources
+    with stage("tree_layout") as record:
+        xpos, ypos = tree_layout(parent, arrays.node_attrs[level_attr])
+        record.count = arrays.n_nodes
+    arrays.node_attrs["xpos"] = xpos
+    arrays.node_attrs["ypos"] = ypos
+    return arrays
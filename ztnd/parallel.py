@@ -0,0 +1,292 @@
+from concurrent.futures import ProcessPoolExecutor
+import logging
+import os
+
+import numpy as np
+
+from ztnd.stats import reduce_logprobs
+from ztnd.tokens import TokenTable
+from ztnd.trie import TokenTrie
+
+
+logger = logging.getLogger(__name__)
+
+
+def get_n_workers(n_workers: int | None) -> int:
+    # 0 or None means one worker per core
+    return n_workers or os.cpu_count() or 1
+
+
+def get_shard_bounds(sizes: np.ndarray, n_shards: int) -> np.ndarray:
+    """
+    Split consecutive items with `sizes` into at most `n_shards` contiguous
+    ranges of roughly equal total size. Returns n_ranges + 1 item offsets.
+    """
+    ends = np.cumsum(sizes)
+    total = int(ends[-1]) if len(ends) else 0
+    targets = np.arange(1, n_shards) * total / n_shards
+    bounds = np.searchsorted(ends, targets, side="right")
+    return np.unique(np.concatenate([[0], bounds, [len(sizes)]]))
+
+
+def count_graph_shard(
+    row_key: np.ndarray,
+    logprob: np.ndarray,
+    choice_offsets: np.ndarray,
+    first_row: int = 0,
+) -> dict[str, np.ndarray]:
+    """
+    Partial node and edge counts of a contiguous range of choices whose
+    rows start at global row `first_row`, for TokenGraphIndex.
+
+    Returns the distinct node keys of the range and its distinct
+    (lo key, hi key) edges (lo key -1 is the root), each with the global
+    row of its first occurrence and reduced logprob stats (see
+    reduce_logprobs). Every row is the target of exactly one edge, from
+    the root for the first row of a choice and from the previous row
+    otherwise, so edges are found and stored in row order.
+    """
+    node_keys, node_first, row_node = np.unique(row_key, return_index=True, return_inverse=True)
+    n_nodes = len(node_keys)
+
+    # local node n_nodes is the root
+    is_start = np.zeros(len(row_key), dtype=bool)
+    is_start[choice_offsets[:-1][choice_offsets[:-1] < choice_offsets[1:]]] = True
+    edge_lo = np.where(is_start, n_nodes, np.roll(row_node, 1))
+    edge_codes, edge_first, row_edge = np.unique(
+        edge_lo * (n_nodes + 1) + row_node, return_index=True, return_inverse=True
+    )
+    edge_lo, edge_hi = np.divmod(edge_codes, n_nodes + 1)
+
+    return {
+        "node_keys": node_keys,
+        "node_first": node_first + first_row,
+        "node_stats": reduce_logprobs(row_node, logprob, n_nodes),
+        "edge_lo": np.where(edge_lo < n_nodes, node_keys[np.minimum(edge_lo, n_nodes - 1)], -1),
+        "edge_hi": node_keys[edge_hi],
+        "edge_first": edge_first + first_row,
+        "edge_stats": reduce_logprobs(row_edge, logprob, len(edge_codes)),
+    }
+
+
+def merge_partials(
+    keys: list[np.ndarray],
+    first: list[np.ndarray],
+    stats: list[tuple],
+) -> tuple[np.ndarray, np.ndarray, tuple]:
+    """
+    Merge the distinct `keys` of several shards with the first occurrence
+    and reduced logprob stats of each key into the same for their union.
+    Counts and sums add up and minima take the minimum, so the result only
+    differs from a single reduction by float rounding.
+    """
+    union, inverse = np.unique(np.concatenate(keys), return_inverse=True)
+    union_first = np.full(len(union), np.iinfo(np.int64).max, dtype=np.int64)
+    np.minimum.at(union_first, inverse, np.concatenate(first))
+    count, logprob_sum, logprob_min, prob_mass = (np.concatenate(col) for col in zip(*stats))
+    union_min = np.full(len(union), np.inf)
+    np.minimum.at(union_min, inverse, logprob_min)
+    union_stats = (
+        np.bincount(inverse, weights=count, minlength=len(union)).astype(np.int64),
+        np.bincount(inverse, weights=logprob_sum, minlength=len(union)),
+        union_min,
+        np.bincount(inverse, weights=prob_mass, minlength=len(union)),
+    )
+    return union, union_first, union_stats
+
+
+def build_trie_shard(token_id: np.ndarray, choice_offsets: np.ndarray) -> dict[str, np.ndarray]:
+    """
+    Build the partial trie of a contiguous range of choices. Besides the
+    node columns it returns the (shard local) choice that created every
+    node and the node of every row.
+    """
+    trie = TokenTrie()
+    token_ids = token_id.tolist()
+    offsets = choice_offsets.tolist()
+    row_node = []
+    n_created = []
+    for lo, hi in zip(offsets[:-1], offsets[1:]):
+        n_nodes = len(trie)
+        trie.add_path(token_ids[lo:hi], row_node)
+        n_created.append(len(trie) - n_nodes)
+    return {
+        "parent": np.array(trie.parent, dtype=np.int64),
+        "token_id": np.array(trie.token_id, dtype=np.int64),
+        "token_index": np.array(trie.token_index, dtype=np.int64),
+        "weight": np.array(trie.weight, dtype=np.int64),
+        "creator": np.repeat(np.arange(len(n_created)), n_created),
+        "row_node": np.array(row_node, dtype=np.int64),
+    }
+
+
+def merge_trie_shards(
+    shards: list[dict[str, np.ndarray]],
+    first_choice: np.ndarray,
+    vocab: list[str],
+    **kwargs,
+) -> tuple[TokenTrie, list[np.ndarray]]:
+    """
+    Merge partial tries built over consecutive choice ranges (starting at
+    global choice `first_choice[ishard]`) into the trie that TokenTrie.add_table
+    builds serially over all of them, node numbers and jj ids included.
+
+    Partial nodes are matched level by level on (merged parent, token).
+    A merged node is created by the first choice that reaches it, so
+    sorting merged nodes by (creating choice, position) gives the serial
+    creation order. The serial jj counter of a (token, position) advances
+    by 2 for the node where a path first leaves the existing trie and by 1
+    for the nodes after it, so jj values are cumulative sums over the
+    nodes with the same key in creation order.
+
+    Also returns the shard local -> merged node map of every shard.
+    """
+    # partial nodes of all shards, roots excluded
+    sizes = [len(shard["parent"]) - 1 for shard in shards]
+    offsets = np.cumsum([0] + sizes)
+    token_id = np.concatenate([shard["token_id"][1:] for shard in shards])
+    token_index = np.concatenate([shard["token_index"][1:] for shard in shards])
+    weight = np.concatenate([shard["weight"][1:] for shard in shards])
+    creator = np.concatenate([
+        shard["creator"] + first for shard, first in zip(shards, first_choice.tolist())
+    ])
+    local_parent = np.concatenate([
+        np.where(shard["parent"][1:] > 0, shard["parent"][1:] - 1 + offset, -1)
+        for shard, offset in zip(shards, offsets[:-1].tolist())
+    ])
+
+    # match partial nodes level by level, merged ids are provisional
+    n_partial = len(token_id)
+    n_vocab = max(len(vocab), 1)
+    merged = np.full(n_partial, -1, dtype=np.int64)
+    merged_parent = []
+    merged_tid = []
+    n_merged = 0
+    order = np.argsort(token_index, kind="stable")
+    level_bounds = np.searchsorted(token_index[order], np.arange(int(token_index.max(initial=-1)) + 2))
+    for lo, hi in zip(level_bounds[:-1].tolist(), level_bounds[1:].tolist()):
+        level = order[lo:hi]
+        parents = np.where(local_parent[level] >= 0, merged[np.maximum(local_parent[level], 0)] + 1, 0)
+        keys, first, inverse = np.unique(
+            parents * n_vocab + token_id[level], return_index=True, return_inverse=True
+        )
+        merged[level] = inverse + n_merged
+        merged_parent.append(parents[first])
+        merged_tid.append(token_id[level][first])
+        n_merged += len(keys)
+
+    # provisional ids are 1.. (0 is the root), put them in creation order
+    merged_parent = np.concatenate([[-1]] + merged_parent).astype(np.int64)
+    merged_tid = np.concatenate([[-1]] + merged_tid).astype(np.int64)
+    merged_weight = np.bincount(merged + 1, weights=weight, minlength=n_merged + 1).astype(np.int64)
+    merged_weight[0] = sum(int(shard["weight"][0]) for shard in shards)
+    merged_creator = np.full(n_merged + 1, np.iinfo(np.int64).max, dtype=np.int64)
+    np.minimum.at(merged_creator, merged + 1, creator)
+    merged_creator[0] = -1
+    merged_index = np.full(n_merged + 1, -1, dtype=np.int64)
+    merged_index[merged + 1] = token_index
+
+    order = np.lexsort((merged_index, merged_creator))
+    new_id = np.empty(n_merged + 1, dtype=np.int64)
+    new_id[order] = np.arange(n_merged + 1)
+    parent = np.where(merged_parent[order] >= 0, new_id[np.maximum(merged_parent[order], 0)], -1)
+    tid = merged_tid[order]
+    pos = merged_index[order]
+    creator = merged_creator[order]
+
+    # jj of nodes below the first level
+    jj = np.zeros(n_merged + 1, dtype=np.int64)
+    deep = np.flatnonzero(pos >= 1)
+    step = np.where(creator[parent[deep]] != creator[deep], 2, 1)
+    by_key = np.lexsort((deep, pos[deep], tid[deep]))
+    key_tid = tid[deep][by_key]
+    key_pos = pos[deep][by_key]
+    total = np.cumsum(step[by_key])
+    starts = np.flatnonzero(np.r_[True, (key_tid[1:] != key_tid[:-1]) | (key_pos[1:] != key_pos[:-1])])
+    counts = np.diff(np.r_[starts, len(by_key)])
+    before_group = np.repeat(total[starts] - step[by_key][starts], counts)
+    jj[deep[by_key]] = total - step[by_key] - before_group + 1
+    ends = np.r_[starts[1:], len(by_key)] - 1
+    jj_counter = {
+        (key, kpos): count
+        for key, kpos, count in zip(
+            key_tid[ends].tolist(), key_pos[ends].tolist(), (total[ends] - before_group[ends]).tolist()
+        )
+    } if len(by_key) else {}
+
+    node_maps = [
+        np.concatenate([[0], new_id[merged[lo:hi] + 1]]).astype(np.int64)
+        for lo, hi in zip(offsets[:-1].tolist(), offsets[1:].tolist())
+    ]
+    trie = TokenTrie.from_nodes(
+        vocab,
+        parent.tolist(),
+        tid.tolist(),
+        pos.tolist(),
+        merged_weight[order].tolist(),
+        jj.tolist(),
+        jj_counter,
+        **kwargs,
+    )
+    return trie, node_maps
+
+
+def build_trie_sharded(
+    table: TokenTable,
+    n_workers: int | None = None,
+    add_alternatives: bool = False,
+    min_alt_prob: float = 0.01,
+    max_alternatives: int | None = None,
+) -> tuple[TokenTrie, list[int]]:
+    """
+    Build the same TokenTrie as TokenTrie.add_table(table) on a process
+    pool and return it with the last node of every choice (the return
+    value of add_table). Choices are split into one contiguous range per worker (balanced
+    by token count), every worker builds the partial trie of its range and
+    the partial tries are merged deterministically with merge_trie_shards.
+    Stats and alternatives are then added over the merged nodes exactly as
+    in the serial build.
+    """
+    trie_kwargs = {
+        "add_alternatives": add_alternatives,
+        "min_alt_prob": min_alt_prob,
+        "max_alternatives": max_alternatives,
+    }
+    n_workers = get_n_workers(n_workers)
+    if len(table) == 0:
+        trie = TokenTrie(**trie_kwargs)
+        return trie, trie.add_table(table)
+    n_choice_tokens = np.diff(table.choice_offsets)
+    bounds = get_shard_bounds(n_choice_tokens, n_workers)
+    token_ids = [
+        table.token_id[table.choice_offsets[lo]:table.choice_offsets[hi]]
+        for lo, hi in zip(bounds[:-1], bounds[1:])
+    ]
+    choice_offsets = [
+        table.choice_offsets[lo:hi + 1] - table.choice_offsets[lo]
+        for lo, hi in zip(bounds[:-1], bounds[1:])
+    ]
+    if len(token_ids) > 1:
+        with ProcessPoolExecutor(max_workers=min(n_workers, len(token_ids))) as executor:
+            shards = list(executor.map(build_trie_shard, token_ids, choice_offsets))
+    else:
+        shards = [build_trie_shard(token_id, offsets) for token_id, offsets in zip(token_ids, choice_offsets)]
+    logger.info(f"built {len(shards)} partial tries with {sum(len(shard['parent']) for shard in shards)} nodes")
+
+    trie, node_maps = merge_trie_shards(
+        shards,
+        bounds[:-1],
+        list(table.vocab),
+        **trie_kwargs,
+    )
+    row_node = np.concatenate(
+        [node_map[shard["row_node"]] for shard, node_map in zip(shards, node_maps)]
+    ).astype(np.int64)
+    trie.stats.add(row_node, table.logprob)
+    if trie.add_alternatives:
+        trie.add_table_alternatives(table, row_node, list(range(len(table.vocab))))
+    ends = table.choice_offsets[1:]
+    nonempty = ends > table.choice_offsets[:-1]
+    leaves = np.zeros(len(ends), dtype=np.int64)
+    leaves[nonempty] = row_node[ends[nonempty] - 1]
+    return trie, leaves.tolist()
@@ -0,0 +1,183 @@
+import networkx as nx
+import numpy as np
+import plotly.graph_objects as go
+
+
+def get_weight_range(weights: np.ndarray) -> tuple[float, float]:
+    weights = np.asarray(weights)
+    return float(weights.min()), float(weights.max())
+
+
+def normalize_weights(
+    weights: np.ndarray,
+    min_width: float = 1.0,
+    max_width: float = 41.0,
+    default_width: float = 5.0,
+) -> np.ndarray:
+    """
+    Linearly map edge weights onto [min_width, max_width]. If all weights
+    are equal every edge gets `default_width`.
+    """
+    weights = np.asarray(weights, dtype=np.float64)
+    if len(weights) == 0:
+        return weights
+    min_weight, max_weight = get_weight_range(weights)
+    weight_range = max_weight - min_weight
+    if weight_range == 0:
+        return np.full(len(weights), default_width)
+    return min_width + (max_width - min_width) * (weights - min_weight) / weight_range
+
+
+def minmax_scale(values: np.ndarray) -> np.ndarray:
+    values = np.asarray(values, dtype=np.float64)
+    value_range = values.max() - values.min()
+    if value_range == 0:
+        return np.zeros(len(values))
+    return (values - values.min()) / value_range
+
+
+def get_graph_arrays(graph: nx.DiGraph, pos: dict) -> tuple[np.ndarray, ...]:
+    """
+    Return node x/y arrays and edge endpoint index / weight arrays in node
+    and edge iteration order.
+    """
+    nodes = list(graph.nodes())
+    node_index = {node: ii for ii, node in enumerate(nodes)}
+    node_x = np.array([pos[node][0] for node in nodes], dtype=np.float64)
+    node_y = np.array([pos[node][1] for node in nodes], dtype=np.float64)
+    n_edges = graph.number_of_edges()
+    edge_lo = np.fromiter((node_index[lo] for lo, _ in graph.edges()), dtype=np.int64, count=n_edges)
+    edge_hi = np.fromiter((node_index[hi] for _, hi in graph.edges()), dtype=np.int64, count=n_edges)
+    weight = np.fromiter(
+        (data.get("weight", 1) for _, _, data in graph.edges(data=True)),
+        dtype=np.float64,
+        count=n_edges,
+    )
+    return node_x, node_y, edge_lo, edge_hi, weight
+
+
+def get_bucketed_edge_traces(
+    x0: np.ndarray,
+    y0: np.ndarray,
+    x1: np.ndarray,
+    y1: np.ndarray,
+    weight: np.ndarray,
+    n_buckets: int = 8,
+    use_gl: bool = False,
+    color: str = "#888",
+) -> list:
+    """
+    Draw edges with at most `n_buckets` line traces.
+
+    Edge widths are normalized, quantized into `n_buckets` levels, and all
+    edges of one level are drawn as a single trace whose segments are
+    separated by gaps (NaN, serialized as null). With `use_gl` the traces
+    are WebGL Scattergl traces.
+    """
+    widths = normalize_weights(weight)
+    if len(widths) == 0:
+        return []
+
+    lo, hi = widths.min(), widths.max()
+    if hi == lo:
+        bucket = np.zeros(len(widths), dtype=np.int64)
+    else:
+        bucket = np.minimum(((widths - lo) / (hi - lo) * n_buckets).astype(np.int64), n_buckets - 1)
+
+    Trace = go.Scattergl if use_gl else go.Scatter
+    traces = []
+    for ib in np.unique(bucket).tolist():
+        mask = bucket == ib
+        n_seg = int(mask.sum())
+        gap = np.full(n_seg, np.nan)
+        xs = np.column_stack([x0[mask], x1[mask], gap]).ravel()
+        ys = np.column_stack([y0[mask], y1[mask], gap]).ravel()
+        traces.append(Trace(
+            x=xs,
+            y=ys,
+            line=dict(width=float(widths[mask].mean()), color=color),
+            hoverinfo="none",
+            mode="lines",
+            showlegend=False,
+        ))
+    return traces
+
+
+def get_edge_traces(
+    graph: nx.DiGraph,
+    pos: dict,
+    n_buckets: int = 8,
+    use_gl: bool = False,
+) -> list:
+    node_x, node_y, edge_lo, edge_hi, weight = get_graph_arrays(graph, pos)
+    return get_bucketed_edge_traces(
+        node_x[edge_lo],
+        node_y[edge_lo],
+        node_x[edge_hi],
+        node_y[edge_hi],
+        weight,
+        n_buckets=n_buckets,
+        use_gl=use_gl,
+    )
+
+
+def get_node_trace(graph: nx.DiGraph, pos: dict, use_gl: bool = False):
+    Trace = go.Scattergl if use_gl else go.Scatter
+    return Trace(
+        x=np.array([pos[node][0] for node in graph.nodes()], dtype=np.float64),
+        y=np.array([pos[node][1] for node in graph.nodes()], dtype=np.float64),
+        mode="markers",
+        hoverinfo="text",
+        text=[node_meta["label"] for _, node_meta in graph.nodes(data=True)],
+        marker=dict(
+            size=10,
+            color=[],
+        ),
+    )
+
+
+def make_graph_figure(
+    graph: nx.DiGraph,
+    pos: dict,
+    n_buckets: int = 8,
+    use_gl: bool | None = None,
+) -> go.Figure:
+    """
+    Scatter figure of `graph` at node positions `pos`. WebGL traces are
+    used by default once the graph has more than 10k edges.
+    """
+    if use_gl is None:
+        use_gl = graph.number_of_edges() > 10_000
+    edge_traces = get_edge_traces(graph, pos, n_buckets=n_buckets, use_gl=use_gl)
+    node_trace = get_node_trace(graph, pos, use_gl=use_gl)
+    return go.Figure(
+        data=edge_traces + [node_trace],
+        layout=go.Layout(
+            showlegend=False,
+            hovermode="closest",
+            margin=dict(b=0, l=0, r=0, t=0),
+            xaxis=dict(showgrid=False, zeroline=False, showticklabels=False),
+            yaxis=dict(showgrid=False, zeroline=False, showticklabels=False),
+        ),
+    )
+
+
+def make_sankey_figure(graph: nx.DiGraph, pos: dict) -> go.Figure:
+    node_x, node_y, edge_lo, edge_hi, weight = get_graph_arrays(graph, pos)
+    return go.Figure(data=[go.Sankey(
+        arrangement="freeform",
+        node=dict(
+            pad=1,
+            thickness=10,
+            line=dict(color="black", width=0.5),
+            label=[meta["label"] for _, meta in graph.nodes(data=True)],
+            x=minmax_scale(node_x),
+            y=minmax_scale(node_y),
+            color="blue",
+        ),
+        link=dict(
+            source=edge_lo,
+            target=edge_hi,
+            value=weight,
+        ),
+    )])
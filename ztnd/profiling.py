@@ -0,0 +1,179 @@
+from contextlib import contextmanager
+import cProfile
+from dataclasses import asdict
+from dataclasses import dataclass
+from datetime import datetime
+import json
+import logging
+from pathlib import Path
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+from typing import Iterator
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class StageRecord:
+    """
+    Wall / CPU time, item count and memory of one pipeline stage.
+
+    `peak_bytes` is the peak traced allocation above the stage's starting
+    point and is only set when tracemalloc is enabled. `max_rss_bytes` is
+    the process high water mark at the end of the stage. A plain
+    dataclass keeps this module (imported everywhere) free of pydantic.
+    """
+
+    name: str
+    depth: int = 0
+    parent: str | None = None
+    wall_seconds: float = 0.0
+    cpu_seconds: float = 0.0
+    count: int | None = None
+    peak_bytes: int | None = None
+    max_rss_bytes: int | None = None
+
+
+def get_max_rss_bytes() -> int:
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macos
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+class Profiler:
+    """
+    Records a StageRecord for every `stage` entered while it is active.
+
+    Stages nest; each record keeps its depth and parent name. Only stages
+    entered on the thread that activated the profiler are recorded so
+    worker threads cannot interleave the stage stack. With `trace_memory`
+    tracemalloc tracks per stage peak allocations (slow, several x), and
+    with `cprofile_path` a cProfile of the whole run is dumped there.
+    """
+
+    def __init__(self, trace_memory: bool = False, cprofile_path: str | Path | None = None):
+        self.trace_memory = trace_memory
+        self.cprofile_path = cprofile_path
+        self.records: list[StageRecord] = []
+        self.stack: list[StageRecord] = []
+        # running peak of each open stage, see `stage`
+        self.peaks: list[int] = []
+        self.thread_id = None
+        self.cprofile = None
+        self.started = None
+        self.start_wall = 0.0
+        self.start_cpu = 0.0
+        self.wall_seconds = 0.0
+        self.cpu_seconds = 0.0
+
+    def start(self) -> None:
+        self.thread_id = threading.get_ident()
+        self.started = datetime.now()
+        if self.trace_memory:
+            tracemalloc.start()
+        if self.cprofile_path is not None:
+            self.cprofile = cProfile.Profile()
+            self.cprofile.enable()
+        self.start_wall = time.perf_counter()
+        self.start_cpu = time.process_time()
+
+    def stop(self) -> None:
+        self.wall_seconds = time.perf_counter() - self.start_wall
+        self.cpu_seconds = time.process_time() - self.start_cpu
+        if self.cprofile is not None:
+            self.cprofile.disable()
+            self.cprofile.dump_stats(self.cprofile_path)
+            logger.info(f"wrote cProfile stats to {self.cprofile_path}")
+        if self.trace_memory:
+            tracemalloc.stop()
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[StageRecord]:
+        record = StageRecord(
+            name=name,
+            depth=len(self.stack),
+            parent=self.stack[-1].name if self.stack else None,
+        )
+        # tracemalloc has a single peak counter. Entering a stage folds the
+        # enclosing stage's peak so far into its running max before reset.
+        if self.trace_memory:
+            current, peak = tracemalloc.get_traced_memory()
+            if self.peaks:
+                self.peaks[-1] = max(self.peaks[-1], peak)
+            tracemalloc.reset_peak()
+            start_bytes = current
+            self.peaks.append(current)
+
+        self.records.append(record)
+        self.stack.append(record)
+        start_wall = time.perf_counter()
+        start_cpu = time.process_time()
+        try:
+            yield record
+        finally:
+            record.wall_seconds = time.perf_counter() - start_wall
+            record.cpu_seconds = time.process_time() - start_cpu
+            record.max_rss_bytes = get_max_rss_bytes()
+            self.stack.pop()
+            if self.trace_memory:
+                _, peak = tracemalloc.get_traced_memory()
+                peak = max(self.peaks.pop(), peak)
+                record.peak_bytes = peak - start_bytes
+                if self.peaks:
+                    self.peaks[-1] = max(self.peaks[-1], peak)
+
+    def report(self) -> dict:
+        return {
+            "started": self.started.isoformat() if self.started else None,
+            "argv": sys.argv,
+            "wall_seconds": self.wall_seconds,
+            "cpu_seconds": self.cpu_seconds,
+            "max_rss_bytes": get_max_rss_bytes(),
+            "trace_memory": self.trace_memory,
+            "stages": [asdict(record) for record in self.records],
+        }
+
+    def write(self, path: str | Path) -> None:
+        with Path(path).open("w") as fp:
+            fp.write(json.dumps(self.report(), indent=4))
+
+
+_profiler: Profiler | None = None
+
+
+def get_profiler() -> Profiler | None:
+    return _profiler
+
+
+def start_profiler(profiler: Profiler) -> Profiler:
+    global _profiler
+    _profiler = profiler
+    profiler.start()
+    return profiler
+
+
+def stop_profiler() -> Profiler | None:
+    global _profiler
+    profiler, _profiler = _profiler, None
+    if profiler is not None:
+        profiler.stop()
+    return profiler
+
+
+@contextmanager
+def stage(name: str) -> Iterator[StageRecord]:
+    """
+    Time the enclosed block as stage `name` if a profiler is active. The
+    yielded record's `count` can be set to the number of items processed.
+    Without an active profiler this only builds a throwaway record.
+    """
+    profiler = _profiler
+    if profiler is None or profiler.thread_id != threading.get_ident():
+        yield StageRecord(name=name)
+        return
+    with profiler.stage(name) as record:
+        yield record
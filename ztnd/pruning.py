@@ -0,0 +1,340 @@
+import logging
+
+import numpy as np
+
+from ztnd.formats import GraphArrays
+
+
+logger = logging.getLogger(__name__)
+
+
+ROOT = 0
+AGGREGATE_LABEL = "<{} more>"
+
+
+def get_tree_levels(arrays: GraphArrays) -> list[np.ndarray]:
+    """
+    Nodes of a tree rooted at 0 grouped by depth, each level in adjacency
+    order. Every level is expanded with one vectorized CSR gather (no
+    sorting), so the total cost is linear in the number of nodes.
+    """
+    if arrays.n_edges != arrays.n_nodes - 1:
+        raise ValueError("not a tree, expected n_nodes - 1 edges")
+    levels = [np.array([ROOT], dtype=np.int64)]
+    n_seen = 1
+    while True:
+        frontier = levels[-1]
+        lo = arrays.indptr[frontier]
+        counts = arrays.indptr[frontier + 1] - lo
+        n_children = int(counts.sum())
+        if n_children == 0:
+            break
+        starts = np.cumsum(counts) - counts
+        edges = np.arange(n_children) - np.repeat(starts - lo, counts)
+        levels.append(arrays.indices[edges].astype(np.int64))
+        n_seen += n_children
+    if n_seen != arrays.n_nodes:
+        raise ValueError("not a tree, some nodes are not reachable from the root")
+    return levels
+
+
+def get_tree_arrays(arrays: GraphArrays, weight_attr: str) -> tuple[np.ndarray, ...]:
+    """
+    Per node parent, depth, incoming edge index and weight (the weight of
+    the incoming edge, or the summed child weights for the root).
+    """
+    levels = get_tree_levels(arrays)
+    n_nodes = arrays.n_nodes
+    parent = np.full(n_nodes, -1, dtype=np.int64)
+    parent[arrays.indices] = arrays.sources
+    depth = np.zeros(n_nodes, dtype=np.int64)
+    for ilevel, level in enumerate(levels):
+        depth[level] = ilevel
+    in_edge = np.full(n_nodes, -1, dtype=np.int64)
+    in_edge[arrays.indices] = np.arange(arrays.n_edges)
+    edge_weight = np.asarray(arrays.edge_attrs[weight_attr], dtype=np.float64)
+    weight = np.zeros(n_nodes, dtype=np.float64)
+    weight[arrays.indices] = edge_weight
+    weight[ROOT] = edge_weight[arrays.indptr[ROOT]:arrays.indptr[ROOT + 1]].sum()
+    return levels, parent, depth, in_edge, weight
+
+
+def get_sibling_rank(parent: np.ndarray, weight: np.ndarray) -> np.ndarray:
+    """
+    Rank of every node among its siblings by descending weight (ties in
+    node order). The root gets rank 0.
+    """
+    n_nodes = len(parent)
+    order = np.lexsort((np.arange(n_nodes), -weight, parent))
+    sorted_parent = parent[order]
+    starts = np.flatnonzero(np.r_[True, sorted_parent[1:] != sorted_parent[:-1]])
+    counts = np.diff(np.r_[starts, n_nodes])
+    rank = np.empty(n_nodes, dtype=np.int64)
+    rank[order] = np.arange(n_nodes) - np.repeat(starts, counts)
+    return rank
+
+
+def build_tree_arrays(
+    arrays: GraphArrays,
+    new_parent: np.ndarray,
+    edge_order: np.ndarray,
+    node_attrs: dict[str, np.ndarray],
+    node_str_attrs: dict[str, np.ndarray],
+    edge_attrs: dict[str, np.ndarray],
+    edge_str_attrs: dict[str, np.ndarray],
+    strings: list[str],
+) -> GraphArrays:
+    """
+    Assemble a tree from a parent array (root 0 with parent -1) whose
+    children are ordered by `edge_order`. Edge columns are aligned with
+    the child node of every edge.
+    """
+    n_nodes = len(new_parent)
+    children = np.flatnonzero(new_parent >= 0)
+    children = children[np.lexsort((edge_order[children], new_parent[children]))]
+    indptr = np.zeros(n_nodes + 1, dtype=np.int64)
+    np.cumsum(np.bincount(new_parent[children], minlength=n_nodes), out=indptr[1:])
+    return GraphArrays(
+        indptr=indptr,
+        indices=children,
+        strings=strings,
+        node_attrs=node_attrs,
+        node_str_attrs=node_str_attrs,
+        edge_attrs={name: col[children] for name, col in edge_attrs.items()},
+        edge_str_attrs={name: col[children] for name, col in edge_str_attrs.items()},
+        graph_attrs=dict(arrays.graph_attrs),
+    )
+
+
+def get_node_edge_cols(arrays: GraphArrays, in_edge: np.ndarray, attrs: dict) -> dict:
+    # edge columns re-indexed by the edge's child node (root gets a zero)
+    cols = {}
+    for name, col in attrs.items():
+        node_col = np.zeros(len(in_edge), dtype=col.dtype)
+        node_col[in_edge >= 0] = col[in_edge[in_edge >= 0]]
+        cols[name] = node_col
+    return cols
+
+
+def aggregate_column(
+    name: str,
+    col: np.ndarray,
+    group: np.ndarray,
+    weight: np.ndarray,
+    n_groups: int,
+) -> np.ndarray:
+    """
+    Combine the values of the nodes in each group (e.g. the dropped
+    children of one parent) into one value per group.
+    """
+    if name in ("weight", "prob_mass"):
+        return np.bincount(group, weights=col, minlength=n_groups)
+    if name == "min_logprob":
+        out = np.full(n_groups, np.inf)
+        np.minimum.at(out, group, col)
+        return out
+    if name == "mean_logprob":
+        total = np.bincount(group, weights=weight, minlength=n_groups)
+        summed = np.bincount(group, weights=col * weight, minlength=n_groups)
+        return np.divide(summed, total, out=np.zeros(n_groups), where=total > 0)
+    return np.zeros(n_groups, dtype=col.dtype)
+
+
+def prune_tree(
+    arrays: GraphArrays,
+    min_weight: float = 0.0,
+    top_k: int | None = None,
+    max_depth: int | None = None,
+    aggregate: bool = True,
+    weight_attr: str = "weight",
+) -> GraphArrays:
+    """
+    Prune a tree (e.g. from TokenTrie.to_arrays) in O(n log n) time: one
+    vectorized pass per level plus sorts for the top_k sibling ranks and
+    for grouping the dropped children.
+
+    A node is kept if its weight is at least `min_weight`, it is among the
+    `top_k` heaviest children of its parent, it is at most `max_depth`
+    edges below the root and its parent is kept. With `aggregate`, the
+    children of a kept node that were dropped by weight or top_k are
+    replaced by one "<n more>" leaf carrying their summed weight and
+    probability mass, weighted mean logprob and min logprob; it has
+    "aggregated" = n. Kept nodes stay in their original order and
+    aggregate leaves come after them.
+    """
+    levels, parent, depth, in_edge, weight = get_tree_arrays(arrays, weight_attr)
+    n_nodes = arrays.n_nodes
+
+    own = weight >= min_weight
+    if top_k is not None:
+        own &= get_sibling_rank(parent, weight) < top_k
+    if max_depth is not None:
+        own &= depth <= max_depth
+    keep = np.zeros(n_nodes, dtype=bool)
+    keep[ROOT] = True
+    for level in levels[1:]:
+        keep[level] = own[level] & keep[parent[level]]
+
+    kept = np.flatnonzero(keep)
+    new_id = np.full(n_nodes, -1, dtype=np.int64)
+    new_id[kept] = np.arange(len(kept))
+
+    node_edge_attrs = get_node_edge_cols(arrays, in_edge, arrays.edge_attrs)
+    node_edge_str_attrs = get_node_edge_cols(arrays, in_edge, arrays.edge_str_attrs)
+
+    if aggregate:
+        dropped = np.flatnonzero(~keep & (parent >= 0))
+        dropped = dropped[keep[parent[dropped]]]
+        if max_depth is not None:
+            dropped = dropped[depth[dropped] <= max_depth]
+        agg_parents, agg_group = np.unique(parent[dropped], return_inverse=True)
+    else:
+        dropped = np.zeros(0, dtype=np.int64)
+        agg_parents = np.zeros(0, dtype=np.int64)
+        agg_group = np.zeros(0, dtype=np.int64)
+    n_agg = len(agg_parents)
+    n_agg_children = np.bincount(agg_group, minlength=n_agg)
+
+    new_parent = np.concatenate([
+        np.where(parent[kept] >= 0, new_id[np.maximum(parent[kept], 0)], -1),
+        new_id[agg_parents],
+    ])
+    # aggregate leaves go after all real children of their parent
+    edge_order = np.concatenate([in_edge[kept], np.full(n_agg, arrays.n_edges)])
+
+    def extend(name: str, col: np.ndarray) -> np.ndarray:
+        agg_col = aggregate_column(name, col[dropped], agg_group, weight[dropped], n_agg)
+        return np.concatenate([col[kept], agg_col.astype(col.dtype)])
+
+    node_attrs = {name: extend(name, col) for name, col in arrays.node_attrs.items()}
+    if "token_index" in arrays.node_attrs:
+        node_attrs["token_index"][len(kept):] = arrays.node_attrs["token_index"][agg_parents] + 1
+    edge_attrs = {name: extend(name, col) for name, col in node_edge_attrs.items()}
+    if aggregate:
+        node_attrs["aggregated"] = np.concatenate([np.zeros(len(kept), dtype=np.int64), n_agg_children])
+        edge_attrs["aggregated"] = node_attrs["aggregated"]
+
+    strings = list(arrays.strings)
+    agg_labels = [AGGREGATE_LABEL.format(n) for n in n_agg_children.tolist()]
+    node_str_attrs = {}
+    for name, col in arrays.node_str_attrs.items():
+        if name == "id":
+            parent_ids = [arrays.strings[ii] for ii in col[agg_parents].tolist()]
+            values = [f"{parent_id}|more" for parent_id in parent_ids]
+        else:
+            values = agg_labels
+        node_str_attrs[name] = np.concatenate([
+            col[kept], np.arange(len(strings), len(strings) + n_agg, dtype=col.dtype)
+        ])
+        strings.extend(values)
+    edge_str_attrs = {
+        name: np.concatenate([col[kept], np.zeros(n_agg, dtype=col.dtype)])
+        for name, col in node_edge_str_attrs.items()
+    }
+
+    logger.info(f"pruned {n_nodes} nodes to {len(kept)} plus {n_agg} aggregates")
+    return build_tree_arrays(
+        arrays, new_parent, edge_order, node_attrs, node_str_attrs, edge_attrs, edge_str_attrs, strings
+    )
+
+
+def compact_chains(arrays: GraphArrays, weight_attr: str = "weight") -> GraphArrays:
+    """
+    Radix tree compaction in O(n log n) time (one vectorized pass per
+    level and a sort grouping the chain members): a node that is the only child of
+    its (non root) parent and carries all of its parent's weight (no path
+    ends at the parent) is merged into it, so unbranched chains become one
+    multi-token node.
+
+    A merged node keeps the attributes of the head of its chain except
+    "label" (the concatenated labels), "entropy" (from the tail, where the
+    chain branches), "min_logprob" (minimum over the chain) and
+    "mean_logprob" (mean over the chain). "chain_logprob" holds the summed
+    mean logprobs, i.e. the logprob of the whole segment, and "n_tokens"
+    the chain length. Edges into heads are kept as they are.
+    """
+    levels, parent, depth, in_edge, weight = get_tree_arrays(arrays, weight_attr)
+    n_nodes = arrays.n_nodes
+    out_degree = np.diff(arrays.indptr)
+
+    merge = np.zeros(n_nodes, dtype=bool)
+    nonroot = np.flatnonzero(parent > ROOT)
+    merge[nonroot] = (out_degree[parent[nonroot]] == 1) & (weight[nonroot] == weight[parent[nonroot]])
+    if "aggregated" in arrays.node_attrs:
+        merge &= arrays.node_attrs["aggregated"] == 0
+
+    head = np.arange(n_nodes)
+    for level in levels[1:]:
+        head[level] = np.where(merge[level], head[parent[level]], level)
+
+    heads = np.flatnonzero(~merge)
+    new_id = np.full(n_nodes, -1, dtype=np.int64)
+    new_id[heads] = np.arange(len(heads))
+
+    # chain members grouped by head in depth order
+    members = np.lexsort((depth, new_id[head]))
+    group_starts = np.flatnonzero(np.r_[True, head[members][1:] != head[members][:-1]])
+    group_ends = np.r_[group_starts[1:], n_nodes]
+    tails = members[group_ends - 1]
+
+    node_attrs = {}
+    for name, col in arrays.node_attrs.items():
+        if name == "entropy":
+            node_attrs[name] = col[tails]
+        elif name == "min_logprob":
+            node_attrs[name] = np.minimum.reduceat(col[members], group_starts)
+        elif name == "mean_logprob":
+            node_attrs["chain_logprob"] = np.add.reduceat(col[members], group_starts)
+            node_attrs[name] = node_attrs["chain_logprob"] / (group_ends - group_starts)
+        else:
+            node_attrs[name] = col[heads]
+    node_attrs["n_tokens"] = group_ends - group_starts
+
+    strings = list(arrays.strings)
+    node_str_attrs = {}
+    for name, col in arrays.node_str_attrs.items():
+        if name != "label":
+            node_str_attrs[name] = col[heads]
+            continue
+        labels = [arrays.strings[ii] for ii in col[members].tolist()]
+        joined = [
+            "".join(labels[lo:hi])
+            for lo, hi in zip(group_starts.tolist(), group_ends.tolist())
+        ]
+        node_str_attrs[name] = np.arange(len(strings), len(strings) + len(joined), dtype=col.dtype)
+        strings.extend(joined)
+
+    new_parent = np.where(parent[heads] >= 0, new_id[head[np.maximum(parent[heads], 0)]], -1)
+    node_edge_attrs = get_node_edge_cols(arrays, in_edge, arrays.edge_attrs)
+    node_edge_str_attrs = get_node_edge_cols(arrays, in_edge, arrays.edge_str_attrs)
+
+    logger.info(f"compacted {n_nodes} nodes into {len(heads)} chains")
+    return build_tree_arrays(
+        arrays,
+        new_parent,
+        in_edge[heads],
+        node_attrs,
+        node_str_attrs,
+        {name: col[heads] for name, col in node_edge_attrs.items()},
+        {name: col[heads] for name, col in node_edge_str_attrs.items()},
+        strings,
+    )
+
+
+def summarize_tree(
+    arrays: GraphArrays,
+    min_weight: float = 0.0,
+    top_k: int | None = None,
+    max_depth: int | None = None,
+    aggregate: bool = True,
+    compact: bool = True,
+) -> GraphArrays:
+    """
+    prune_tree followed (with `compact`) by compact_chains.
+    """
+    arrays = prune_tree(
+        arrays, min_weight=min_weight, top_k=top_k, max_depth=max_depth, aggregate=aggregate
+    )
+    if compact:
+        arrays = compact_chains(arrays)
+    return arrays
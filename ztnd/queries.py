@@ -0,0 +1,256 @@
+import heapq
+from typing import TYPE_CHECKING
+from typing import Iterable
+from typing import Sequence
+
+import numpy as np
+from pydantic import BaseModel
+
+from ztnd.graphs import as_token_table
+from ztnd.parallel import build_trie_sharded
+from ztnd.profiling import stage
+from ztnd.tokens import TokenTable
+from ztnd.trie import TokenTrie
+
+if TYPE_CHECKING:
+    from openai.types.chat.chat_completion import ChatCompletion
+
+
+class Continuation(BaseModel):
+    """
+    A token following a prefix. `count` is the number of choices that
+    continue with it, `prob` its share of the choices continuing at all,
+    and `mean_logprob` the mean logprob the model gave it. `nodes` are the
+    tree nodes it was found at (one for a token prefix, possibly several
+    for a text prefix with more than one tokenization).
+    """
+
+    token: str
+    count: int
+    prob: float
+    mean_logprob: float
+    nodes: list[int]
+
+
+class TokenTreeIndex:
+    """
+    Query layer over the TokenTrie behind build_token_pos_tree.
+
+    Node numbers are the nodes of the graph built from the same trie.
+    Token prefixes are resolved with one child lookup per token, so
+    prefix counts, path logprobs and children cost O(prefix length).
+    Cumulative path logprobs (the sum of the mean logprob of every node on
+    the path) are precomputed for all nodes, and the last node of every
+    choice is indexed by (completion id, choice index).
+    """
+
+    def __init__(self, trie: TokenTrie, choice_leaves: dict[tuple[str, int], int]):
+        self.trie = trie
+        self.choice_leaves = choice_leaves
+        trie.stats.grow(len(trie))
+        self.mean_logprob = trie.stats.logprob_mean
+        self.path_logprob = get_path_logprob(trie, self.mean_logprob)
+
+    def __len__(self) -> int:
+        return len(self.trie)
+
+    def find(self, tokens: Sequence[str]) -> int | None:
+        """
+        Node reached by the token sequence `tokens` from the root, or None.
+        """
+        node = self.trie.root
+        vocab_index = self.trie.vocab_index
+        children = self.trie.children
+        for token in tokens:
+            node = children[node].get(vocab_index.get(token))
+            if node is None:
+                return None
+        return node
+
+    def find_text(self, text: str) -> list[int]:
+        """
+        Nodes whose path spells out exactly `text`, one per tokenization
+        of it that occurs in the tree.
+        """
+        return [node for node, offset in self.iter_text_matches(text) if offset == len(text)]
+
+    def iter_text_matches(self, text: str) -> Iterable[tuple[int, int]]:
+        # depth first over the paths that stay a prefix of `text`. Yields
+        # (node, len(text)) at exact matches and (child, offset) for
+        # children whose token runs past the end of `text`.
+        vocab = self.trie.vocab
+        children = self.trie.children
+        stack = [(self.trie.root, 0)]
+        while stack:
+            node, offset = stack.pop()
+            if offset == len(text):
+                yield node, offset
+                continue
+            rest = text[offset:]
+            for tid, child in children[node].items():
+                token = vocab[tid]
+                if not token:
+                    continue
+                if rest.startswith(token):
+                    stack.append((child, offset + len(token)))
+                elif token.startswith(rest):
+                    yield child, offset
+
+    def count(self, tokens: Sequence[str]) -> int:
+        """
+        Number of choices that start with the token sequence `tokens`.
+        """
+        node = self.find(tokens)
+        return 0 if node is None else self.trie.weight[node]
+
+    def count_text(self, text: str) -> int:
+        """
+        Number of choices whose text starts with `text`, whatever their
+        tokenization and even if `text` ends inside a token.
+        """
+        return sum(self.trie.weight[node] for node, _ in self.iter_text_matches(text))
+
+    def get_path_logprob(self, tokens: Sequence[str]) -> float | None:
+        """
+        Summed logprob of the token sequence `tokens`, or None if it does
+        not occur.
+        """
+        node = self.find(tokens)
+        return None if node is None else float(self.path_logprob[node])
+
+    def get_children(self, node: int, n: int | None = None) -> list[Continuation]:
+        """
+        The `n` (default all) most frequent continuations of `node`.
+        """
+        trie = self.trie
+        items = trie.children[node].items()
+        if n is None:
+            items = sorted(items, key=lambda item: -trie.weight[item[1]])
+        else:
+            items = heapq.nlargest(n, items, key=lambda item: trie.weight[item[1]])
+        total = sum(trie.weight[child] for child in trie.children[node].values())
+        return [
+            Continuation(
+                token=trie.vocab[tid],
+                count=trie.weight[child],
+                prob=trie.weight[child] / total,
+                mean_logprob=float(self.mean_logprob[child]),
+                nodes=[child],
+            )
+            for tid, child in items
+        ]
+
+    def top_children(self, tokens: Sequence[str], n: int = 10) -> list[Continuation]:
+        """
+        The `n` most frequent tokens following the token sequence `tokens`.
+        """
+        node = self.find(tokens)
+        return [] if node is None else self.get_children(node, n)
+
+    def top_continuations(self, text: str, n: int = 10) -> list[Continuation]:
+        """
+        The `n` most frequent tokens following `text`, summed over all of
+        its tokenizations.
+        """
+        trie = self.trie
+        by_token = {}
+        for node in self.find_text(text):
+            for tid, child in trie.children[node].items():
+                by_token.setdefault(tid, []).append(child)
+        counts = {tid: sum(trie.weight[child] for child in nodes) for tid, nodes in by_token.items()}
+        total = sum(counts.values())
+        top = heapq.nlargest(n, counts, key=counts.get)
+        continuations = []
+        for tid in top:
+            nodes = by_token[tid]
+            logprob_sum = sum(float(trie.stats.logprob_sum[child]) for child in nodes)
+            continuations.append(Continuation(
+                token=trie.vocab[tid],
+                count=counts[tid],
+                prob=counts[tid] / total,
+                mean_logprob=logprob_sum / counts[tid],
+                nodes=nodes,
+            ))
+        return continuations
+
+    def get_path(self, node: int) -> list[int]:
+        """
+        Nodes from the first token down to `node` (the root excluded).
+        """
+        path = []
+        parent = self.trie.parent
+        while node != self.trie.root:
+            path.append(node)
+            node = parent[node]
+        return path[::-1]
+
+    def get_path_tokens(self, node: int) -> list[str]:
+        vocab = self.trie.vocab
+        token_id = self.trie.token_id
+        return [vocab[token_id[node]] for node in self.get_path(node)]
+
+    def get_choice_leaf(self, completion_id: str, choice_index: int) -> int:
+        return self.choice_leaves[(completion_id, choice_index)]
+
+    def get_choice_path(self, completion_id: str, choice_index: int) -> list[int]:
+        """
+        Nodes of the tokens of one choice, in order.
+        """
+        return self.get_path(self.get_choice_leaf(completion_id, choice_index))
+
+
+def get_path_logprob(trie: TokenTrie, mean_logprob: np.ndarray) -> np.ndarray:
+    """
+    Sum of `mean_logprob` over the path from the root to every node,
+    computed one level at a time.
+    """
+    parent = np.array(trie.parent, dtype=np.int64)
+    token_index = np.array(trie.token_index, dtype=np.int64)
+    path_logprob = np.zeros(len(parent))
+    order = np.argsort(token_index, kind="stable")
+    bounds = np.searchsorted(token_index[order], np.arange(int(token_index.max()) + 2))
+    for lo, hi in zip(bounds[:-1].tolist(), bounds[1:].tolist()):
+        level = order[lo:hi]
+        path_logprob[level] = path_logprob[parent[level]] + mean_logprob[level]
+    return path_logprob
+
+
+def get_choice_keys(table: TokenTable) -> list[tuple[str, int] | None]:
+    """
+    (completion id, choice index) of every choice in `table`, None for
+    choices without tokens (the table has no row to read them from).
+    """
+    starts = table.choice_offsets[:-1]
+    nonempty = starts < table.choice_offsets[1:]
+    keys = [None] * table.n_choices
+    rows = starts[nonempty]
+    for ichoice, icomp, index in zip(
+        np.flatnonzero(nonempty).tolist(),
+        table.completion[rows].tolist(),
+        table.choice_index[rows].tolist(),
+    ):
+        keys[ichoice] = (table.completion_ids[icomp], index)
+    return keys
+
+
+def build_token_tree_index(
+    completions: "Iterable[ChatCompletion] | TokenTable",
+    n_workers: int | None = 1,
+) -> TokenTreeIndex:
+    """
+    Build the token position trie of `completions` (as build_token_pos_tree
+    does) and index it for queries.
+    """
+    table = as_token_table(completions)
+    with stage("build_trie") as record:
+        if n_workers == 1:
+            trie = TokenTrie()
+            leaves = trie.add_table(table)
+        else:
+            trie, leaves = build_trie_sharded(table, n_workers)
+        record.count = len(trie)
+    with stage("build_tree_index"):
+        choice_leaves = {
+            key: leaf for key, leaf in zip(get_choice_keys(table), leaves) if key is not None
+        }
+        return TokenTreeIndex(trie, choice_leaves)
@@ -0,0 +1,98 @@
+from contextlib import contextmanager
+import gc
+import itertools
+import json
+import logging
+from pathlib import Path
+from typing import BinaryIO, Iterable, Iterator
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+logger = logging.getLogger(__name__)
+
+
+JSON_BACKENDS = ["orjson", "json"] if orjson is not None else ["json"]
+_backend = JSON_BACKENDS[0]
+
+
+def get_json_backend() -> str:
+    return _backend
+
+
+def set_json_backend(name: str) -> None:
+    """
+    Select the JSON encoder / decoder, "orjson" (the default if it is
+    installed) or the stdlib "json".
+    """
+    global _backend
+    if name not in JSON_BACKENDS:
+        raise ValueError(f"unknown or unavailable JSON backend {name!r}, choose from {JSON_BACKENDS}")
+    _backend = name
+
+
+def loads(data: bytes | str):
+    if _backend == "orjson":
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps(obj) -> bytes:
+    """
+    Compact JSON encoding of `obj` as utf-8 bytes.
+    """
+    if _backend == "orjson":
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False).encode("utf-8")
+
+
+@contextmanager
+def gc_paused() -> Iterator[None]:
+    """
+    Disable the cyclic garbage collector while building large numbers of
+    acyclic objects (decoded JSON, pydantic models). Otherwise collections
+    are triggered over and over and dominate the load time.
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def read_json(path: str | Path):
+    with gc_paused():
+        return loads(Path(path).read_bytes())
+
+
+def write_json(obj: dict, fp: BinaryIO, batch_size: int = 10_000) -> None:
+    """
+    Write a dict incrementally. Top level list (or iterator) values are
+    written one element per line in batches of `batch_size`, so the
+    encoded document is never held in memory as a whole.
+    """
+    fp.write(b"{")
+    for ii, (key, value) in enumerate(obj.items()):
+        if ii > 0:
+            fp.write(b",")
+        fp.write(b"\n" + dumps(key) + b": ")
+        if isinstance(value, (list, Iterator)):
+            write_json_list(value, fp, batch_size=batch_size)
+        else:
+            fp.write(dumps(value))
+    fp.write(b"\n}\n")
+
+
+def write_json_list(items: Iterable, fp: BinaryIO, batch_size: int = 10_000) -> None:
+    items = iter(items)
+    fp.write(b"[")
+    sep = b"\n"
+    while batch := list(itertools.islice(items, batch_size)):
+        fp.write(sep + b",\n".join(dumps(item) for item in batch))
+        sep = b",\n"
+    fp.write(b"]" if sep == b"\n" else b"\n]")
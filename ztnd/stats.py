@@ -0,0 +1,142 @@
+import numpy as np
+
+
+class LogprobStats:
+    """
+    Growable per item (node or edge) logprob accumulators.
+
+    Tracks the number of observations, the sum and minimum of their
+    logprobs and the summed probability mass exp(logprob). Storage grows
+    by doubling and batches only touch the items they observe, so adding
+    a batch costs time proportional to the batch, not to all items.
+    """
+
+    def __init__(self, size: int = 0):
+        self.size = size
+        self._count = np.zeros(size, dtype=np.int64)
+        self._logprob_sum = np.zeros(size, dtype=np.float64)
+        self._logprob_min = np.zeros(size, dtype=np.float64)
+        self._prob_mass = np.zeros(size, dtype=np.float64)
+
+    def __len__(self) -> int:
+        return self.size
+
+    # views of the first `size` items of the (larger) buffers
+    @property
+    def count(self) -> np.ndarray:
+        return self._count[:self.size]
+
+    @property
+    def logprob_sum(self) -> np.ndarray:
+        return self._logprob_sum[:self.size]
+
+    @property
+    def logprob_min(self) -> np.ndarray:
+        return self._logprob_min[:self.size]
+
+    @property
+    def prob_mass(self) -> np.ndarray:
+        return self._prob_mass[:self.size]
+
+    def grow(self, size: int) -> None:
+        if size <= self.size:
+            return
+        capacity = len(self._count)
+        if size > capacity:
+            capacity = max(size, 2 * capacity)
+            for name in ["_count", "_logprob_sum", "_logprob_min", "_prob_mass"]:
+                old = getattr(self, name)
+                new = np.zeros(capacity, dtype=old.dtype)
+                new[:self.size] = old[:self.size]
+                setattr(self, name, new)
+        self.size = size
+
+    def add(self, index: np.ndarray, logprob: np.ndarray) -> None:
+        """
+        Record one observation of `logprob[ii]` for item `index[ii]`.
+        """
+        if len(index) == 0:
+            return
+        n_items = int(index.max()) + 1
+        self.grow(n_items)
+        if len(index) * 16 >= n_items:
+            # dense batch, reduce over the whole index range without sorting
+            items, inverse, n_batch = slice(0, n_items), index, n_items
+        else:
+            items, inverse = np.unique(index, return_inverse=True)
+            n_batch = len(items)
+        self.add_reduced(items, *reduce_logprobs(inverse, logprob, n_batch))
+
+    def add_reduced(
+        self,
+        items: np.ndarray | slice,
+        count: np.ndarray,
+        logprob_sum: np.ndarray,
+        logprob_min: np.ndarray,
+        prob_mass: np.ndarray,
+    ) -> None:
+        """
+        Merge partial stats (see reduce_logprobs) of the distinct `items`,
+        which must already fit (see grow).
+        """
+        old_min = self._logprob_min[items]
+        self._logprob_min[items] = np.where(
+            self._count[items] > 0,
+            np.minimum(old_min, logprob_min),
+            np.where(count > 0, logprob_min, old_min),
+        )
+        self._count[items] += count
+        self._logprob_sum[items] += logprob_sum
+        self._prob_mass[items] += prob_mass
+
+    @property
+    def logprob_mean(self) -> np.ndarray:
+        return np.divide(
+            self.logprob_sum,
+            self.count,
+            out=np.zeros(self.size),
+            where=self.count > 0,
+        )
+
+    def get_attrs(self) -> dict[str, list]:
+        """
+        Columns for node / edge attributes. Items without observations
+        (e.g. the root) get 0.0, the logprob of a certain event.
+        """
+        return {
+            "prob_mass": self.prob_mass.tolist(),
+            "mean_logprob": self.logprob_mean.tolist(),
+            "min_logprob": self.logprob_min.tolist(),
+        }
+
+
+def reduce_logprobs(
+    inverse: np.ndarray,
+    logprob: np.ndarray,
+    n_items: int,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Count, logprob sum, logprob min (inf if unobserved) and probability
+    mass per item 0..n_items-1 of observations `logprob[ii]` of item
+    `inverse[ii]`.
+    """
+    count = np.bincount(inverse, minlength=n_items)
+    logprob_min = np.full(n_items, np.inf)
+    np.minimum.at(logprob_min, inverse, logprob)
+    return (
+        count,
+        np.bincount(inverse, weights=logprob, minlength=n_items),
+        logprob_min,
+        np.bincount(inverse, weights=np.exp(logprob), minlength=n_items),
+    )
+
+
+def get_branching_entropy(lo: np.ndarray, weight: np.ndarray, n_nodes: int) -> np.ndarray:
+    """
+    Entropy (nats) of the distribution over out-edges of every node, with
+    edge probabilities proportional to `weight`. Leaves get 0.
+    """
+    weight = np.asarray(weight, dtype=np.float64)
+    out_total = np.bincount(lo, weights=weight, minlength=n_nodes)
+    prob = weight / out_total[lo]
+    return np.bincount(lo, weights=-prob * np.log(prob), minlength=n_nodes)
@@ -0,0 +1,159 @@
+import logging
+import math
+import os
+from pathlib import Path
+import shutil
+import time
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+from ztnd.formats import is_binary_path
+from ztnd.formats import write_graph
+from ztnd.trie import TokenTrie
+
+if TYPE_CHECKING:
+    import networkx as nx
+    from openai.types.chat.chat_completion_chunk import ChatCompletionChunk
+
+
+logger = logging.getLogger(__name__)
+
+
+class TokenStreamBuilder:
+    """
+    Build a token position tree from streamed completion chunks.
+
+    Each (completion id, choice index) keeps a cursor (node, diverged) into
+    the TokenTrie that is advanced with TokenTrie.add_token as its tokens
+    arrive, so the choices of concurrent streams can interleave freely.
+    Token logprobs (and top_logprobs alternatives with `add_alternatives`)
+    are buffered and absorbed into the trie stats in batches by `flush`.
+
+    The resulting tree has the same structure, weights and stats as
+    build_token_pos_tree over the same completions, but node numbers and
+    the jj part of node ids follow token arrival order.
+    """
+
+    def __init__(
+        self,
+        add_alternatives: bool = False,
+        min_alt_prob: float = 0.01,
+        max_alternatives: int | None = None,
+    ):
+        self.trie = TokenTrie(
+            add_alternatives=add_alternatives,
+            min_alt_prob=min_alt_prob,
+            max_alternatives=max_alternatives,
+        )
+        self.min_alt_logprob = math.log(min_alt_prob)
+        self.cursors = {}
+        self.leaves = []
+        self.n_tokens = 0
+        self.pending_node = []
+        self.pending_logprob = []
+        self.pending_alt_parent = []
+        self.pending_alt_tid = []
+        self.pending_alt_logprob = []
+
+    def add_chunk(self, chunk: "ChatCompletionChunk") -> None:
+        trie = self.trie
+        for choice in chunk.choices:
+            key = (chunk.id, choice.index)
+            node, diverged = self.cursors.get(key, (trie.root, False))
+            if choice.logprobs is not None and choice.logprobs.content is not None:
+                for cctl in choice.logprobs.content:
+                    parent = node
+                    tid = trie.intern(cctl.token)
+                    node, diverged = trie.add_token(node, tid, diverged)
+                    self.pending_node.append(node)
+                    self.pending_logprob.append(cctl.logprob)
+                    if trie.add_alternatives:
+                        self.add_alternatives(parent, tid, cctl.top_logprobs or [])
+                self.n_tokens += len(choice.logprobs.content)
+            if choice.finish_reason is not None:
+                self.cursors.pop(key, None)
+                self.leaves.append(node)
+            else:
+                self.cursors[key] = (node, diverged)
+
+    def add_alternatives(self, parent: int, tid: int, top_logprobs: list) -> None:
+        for top in top_logprobs:
+            top_tid = self.trie.intern(top.token)
+            if top_tid == tid or top.logprob < self.min_alt_logprob:
+                continue
+            self.pending_alt_parent.append(parent)
+            self.pending_alt_tid.append(top_tid)
+            self.pending_alt_logprob.append(top.logprob)
+
+    def flush(self) -> None:
+        """
+        Absorb the buffered logprobs into the trie stats.
+        """
+        trie = self.trie
+        trie.stats.grow(len(trie))
+        trie.stats.add(
+            np.array(self.pending_node, dtype=np.int64),
+            np.array(self.pending_logprob, dtype=np.float64),
+        )
+        self.pending_node = []
+        self.pending_logprob = []
+        if self.pending_alt_parent:
+            trie.add_alternative_entries(
+                np.array(self.pending_alt_parent, dtype=np.int64),
+                np.array(self.pending_alt_tid, dtype=np.int64),
+                np.array(self.pending_alt_logprob, dtype=np.float64),
+            )
+            self.pending_alt_parent = []
+            self.pending_alt_tid = []
+            self.pending_alt_logprob = []
+
+    def to_digraph(self, add_stats: bool = True) -> "nx.DiGraph":
+        self.flush()
+        return self.trie.to_digraph(add_stats=add_stats)
+
+    def write(self, path: str | Path, add_stats: bool = True) -> None:
+        """
+        Write the tree so far to `path` (node-link JSON or a `.ztnd`
+        directory). The graph is written next to `path` and moved into
+        place, so readers never see a half written snapshot.
+        """
+        self.flush()
+        path = Path(path)
+        tmp_path = path.with_name(path.name + ".tmp")
+        if is_binary_path(path):
+            if tmp_path.exists():
+                shutil.rmtree(tmp_path)
+            self.trie.to_arrays(add_stats=add_stats).save(tmp_path)
+            if path.exists():
+                shutil.rmtree(path)
+            os.rename(tmp_path, path)
+        else:
+            write_graph(self.trie.to_digraph(add_stats=add_stats), tmp_path)
+            os.replace(tmp_path, path)
+
+
+class SnapshotWriter:
+    """
+    Chunk callback that feeds a TokenStreamBuilder and writes the partial
+    tree to `path` at most every `interval` seconds.
+    """
+
+    def __init__(self, builder: TokenStreamBuilder, path: str | Path, interval: float = 10.0):
+        self.builder = builder
+        self.path = Path(path)
+        self.interval = interval
+        self.last_write = time.monotonic()
+        self.n_snapshots = 0
+
+    def __call__(self, chunk: "ChatCompletionChunk") -> None:
+        self.builder.add_chunk(chunk)
+        now = time.monotonic()
+        if self.interval > 0 and now - self.last_write >= self.interval:
+            self.builder.write(self.path)
+            self.n_snapshots += 1
+            self.last_write = time.monotonic()
+            logger.info(
+                f"wrote snapshot {self.n_snapshots} with {len(self.builder.trie)} nodes "
+                f"from {self.builder.n_tokens} tokens to {self.path}"
+            )
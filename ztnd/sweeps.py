@@ -0,0 +1,204 @@
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ThreadPoolExecutor
+import itertools
+import json
+import logging
+from pathlib import Path
+
+from pydantic import BaseModel
+
+from ztnd.formats import write_graph
+from ztnd.generations import ResponseCache
+from ztnd.generations import check_store_params
+from ztnd.generations import create_completions
+from ztnd.generations import get_request_params
+from ztnd.generations import get_store_appender
+from ztnd.generations import read_store_calls
+from ztnd.generations import truncate_partial_line
+from ztnd.graphs import build_token_dag
+from ztnd.graphs import build_token_graph
+from ztnd.graphs import build_token_pos_tree
+from ztnd.tokens import load_token_table
+
+
+logger = logging.getLogger(__name__)
+
+
+GRAPH_FILE_SUFFIXES = {
+    "json": ".json",
+    "ztnd": ".ztnd",
+}
+
+
+class SweepRun(BaseModel):
+    run_id: str
+    prompt_index: int
+    prompt: str
+    model: str
+    temperature: float
+    seed: int
+
+    def get_path(self, out_path: Path) -> Path:
+        return out_path / "runs" / self.run_id
+
+
+def read_prompts(path: str | Path) -> list[str]:
+    """
+    Read prompts from a text file (one per line) or a JSONL file with a
+    "prompt" field per line.
+    """
+    path = Path(path)
+    prompts = []
+    with path.open("r") as fp:
+        for line in fp:
+            line = line.strip()
+            if not line:
+                continue
+            if path.suffix == ".jsonl":
+                prompts.append(json.loads(line)["prompt"])
+            else:
+                prompts.append(line)
+    return prompts
+
+
+def make_sweep_runs(
+    prompts: list[str],
+    models: list[str],
+    temperatures: list[float],
+    seeds: list[int],
+) -> list[SweepRun]:
+    """
+    One run per element of prompts x models x temperatures x seeds.
+    """
+    runs = []
+    grid = itertools.product(enumerate(prompts), models, temperatures, seeds)
+    for irun, ((iprompt, prompt), model, temperature, seed) in enumerate(grid):
+        runs.append(SweepRun(
+            run_id=f"run-{irun:05d}",
+            prompt_index=iprompt,
+            prompt=prompt,
+            model=model,
+            temperature=temperature,
+            seed=seed,
+        ))
+    return runs
+
+
+def fetch_sweep_run(
+    run: SweepRun,
+    out_path: Path,
+    n_api_calls: int,
+    cache: ResponseCache | None = None,
+    **kwargs,
+) -> Path:
+    """
+    Fetch the completions of one run into its completions.jsonl store,
+    making only the calls a previous attempt did not finish. Raises a
+    ValueError if that attempt used different request parameters.
+    """
+    run_path = run.get_path(out_path)
+    run_path.mkdir(parents=True, exist_ok=True)
+    messages = [{"role": "user", "content": run.prompt}]
+    request_kwargs = dict(model=run.model, seed=run.seed, temperature=run.temperature, **kwargs)
+    store_path = run_path / "completions.jsonl"
+    check_store_params(store_path, get_request_params(messages, **request_kwargs))
+    with (run_path / "run.json").open("w") as fp:
+        fp.write(run.model_dump_json(indent=4))
+
+    truncate_partial_line(store_path)
+    done_calls = read_store_calls(store_path)
+    create_completions(
+        messages,
+        **request_kwargs,
+        on_completion=get_store_appender(store_path, done_calls),
+        cache=cache,
+        call_indices=[ii for ii in range(n_api_calls) if ii not in done_calls],
+    )
+    return store_path
+
+
+def fetch_sweep(
+    runs: list[SweepRun],
+    out_path: str | Path,
+    n_api_calls: int,
+    max_concurrent_runs: int = 4,
+    cache: ResponseCache | None = None,
+    **kwargs,
+) -> None:
+    """
+    Fetch all runs, `max_concurrent_runs` at a time. Extra keyword
+    arguments are passed to create_completions (e.g. max_concurrency,
+    tokens_per_minute, n_choices_per_call).
+    """
+    out_path = Path(out_path)
+    with ThreadPoolExecutor(max_workers=max_concurrent_runs) as executor:
+        futures = [
+            executor.submit(fetch_sweep_run, run, out_path, n_api_calls, cache, **kwargs)
+            for run in runs
+        ]
+        for run, future in zip(runs, futures):
+            future.result()
+            logger.info(f"fetched {run.run_id}")
+
+
+def build_run_graphs(
+    run_path: str | Path,
+    graph_types: list[str],
+    graph_format: str = "json",
+) -> dict[str, dict]:
+    """
+    Build and write the requested graphs of one run. Runs in a worker
+    process so it only takes and returns plain data.
+    """
+    run_path = Path(run_path)
+    table = load_token_table(run_path / "completions.jsonl")
+    results = {}
+    for graph_type in graph_types:
+        if graph_type in ("token", "token_pos"):
+            graph = build_token_graph(table, graph_type=graph_type)
+        elif graph_type == "token_pos_tree":
+            graph = build_token_pos_tree(table)
+        elif graph_type == "token_dag":
+            graph = build_token_dag(table)
+        else:
+            raise ValueError(graph_type)
+        graph_path = run_path / (graph_type + GRAPH_FILE_SUFFIXES[graph_format])
+        write_graph(graph, graph_path)
+        results[graph_type] = {
+            "path": graph_path.name,
+            "n_nodes": graph.number_of_nodes(),
+            "n_edges": graph.number_of_edges(),
+        }
+    return results
+
+
+def build_sweep_graphs(
+    runs: list[SweepRun],
+    out_path: str | Path,
+    graph_types: list[str],
+    graph_format: str = "json",
+    max_workers: int | None = None,
+) -> list[dict]:
+    """
+    Build the graphs of every run in a process pool and write an index of
+    all runs (paths relative to `out_path`) to <out_path>/index.jsonl.
+    """
+    out_path = Path(out_path)
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(
+                build_run_graphs, str(run.get_path(out_path)), graph_types, graph_format
+            )
+            for run in runs
+        ]
+        index = []
+        for run, future in zip(runs, futures):
+            record = run.model_dump()
+            record["path"] = str(run.get_path(out_path).relative_to(out_path))
+            record["graphs"] = future.result()
+            index.append(record)
+
+    with (out_path / "index.jsonl").open("w") as fp:
+        for record in index:
+            fp.write(json.dumps(record) + "\n")
+    return index
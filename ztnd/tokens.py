@@ -0,0 +1,227 @@
+from array import array
+from dataclasses import dataclass
+from pathlib import Path
+from typing import TYPE_CHECKING, Iterable
+
+import numpy as np
+
+from ztnd.generations import iter_completions
+from ztnd.generations import load_completions
+from ztnd.serialization import gc_paused
+
+if TYPE_CHECKING:
+    from openai.types.chat.chat_completion import ChatCompletion
+
+
+def add_visual_space(text: str) -> str:
+#    return text.replace(" ", "\u2420") # SP symbol for space
+    return text.replace(" ", "\u2423") # open box
+
+
+@dataclass
+class TokenTable:
+    """
+    Columnar, array-backed view of every sampled token in a set of completions.
+
+    Row r describes one token. Rows of a single choice are contiguous and in
+    token order; choice c spans rows choice_offsets[c]:choice_offsets[c+1].
+    Token strings are interned in `vocab` and referenced by `token_id`, and
+    completion ids are interned in `completion_ids` and referenced by
+    `completion`. The raw bytes of token id t (as first seen) are
+    bytes_data[bytes_offsets[t]:bytes_offsets[t+1]], so they are stored
+    once per vocab entry rather than per row. The top_logprobs alternatives
+    of row r are the entries top_offsets[r]:top_offsets[r+1] of
+    top_token_id / top_logprob.
+
+    Without alternatives a row costs 32 bytes, plus 12 bytes per
+    alternative.
+    """
+
+    completion_ids: list[str]
+    vocab: list[str]
+    completion: np.ndarray
+    choice_index: np.ndarray
+    token_index: np.ndarray
+    token_id: np.ndarray
+    logprob: np.ndarray
+    bytes_offsets: np.ndarray
+    bytes_data: np.ndarray
+    choice_offsets: np.ndarray
+    top_offsets: np.ndarray
+    top_token_id: np.ndarray
+    top_logprob: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.token_id)
+
+    @property
+    def n_choices(self) -> int:
+        return len(self.choice_offsets) - 1
+
+    @property
+    def labels(self) -> list[str]:
+        """Vocab entries with visual spaces, indexed by token id."""
+        return [add_visual_space(token) for token in self.vocab]
+
+    def get_token_uid(self, row: int) -> str:
+        return "{}-{}-{}".format(
+            self.completion_ids[self.completion[row]],
+            self.choice_index[row],
+            self.token_index[row],
+        )
+
+    def get_bytes(self, row: int) -> bytes:
+        tid = self.token_id[row]
+        lo, hi = self.bytes_offsets[tid], self.bytes_offsets[tid + 1]
+        return self.bytes_data[lo:hi].tobytes()
+
+    def get_choice_text(self, choice: int) -> str:
+        lo, hi = self.choice_offsets[choice], self.choice_offsets[choice + 1]
+        return "".join(self.vocab[tid] for tid in self.token_id[lo:hi].tolist())
+
+    @property
+    def nbytes(self) -> int:
+        """Size of the array columns (not counting the interned strings)."""
+        return sum(
+            getattr(self, name).nbytes
+            for name in self.__dataclass_fields__
+            if isinstance(getattr(self, name), np.ndarray)
+        )
+
+    def iter_tokens(self) -> Iterable["TokenRecord"]:
+        for row in range(len(self)):
+            yield TokenRecord(self, row)
+
+
+class TokenRecord:
+    """
+    Lightweight view of one row of a TokenTable, the slotted counterpart
+    of ZtndToken. Fields are read from the table on access.
+    """
+
+    __slots__ = ("table", "row")
+
+    def __init__(self, table: TokenTable, row: int):
+        self.table = table
+        self.row = row
+
+    @property
+    def completion_id(self) -> str:
+        return self.table.completion_ids[self.table.completion[self.row]]
+
+    @property
+    def choice_index(self) -> int:
+        return int(self.table.choice_index[self.row])
+
+    @property
+    def token_index(self) -> int:
+        return int(self.table.token_index[self.row])
+
+    @property
+    def token(self) -> str:
+        return self.table.vocab[self.table.token_id[self.row]]
+
+    @property
+    def logprob(self) -> float:
+        return float(self.table.logprob[self.row])
+
+    @property
+    def bytes(self) -> bytes:
+        return self.table.get_bytes(self.row)
+
+    @property
+    def top_logprobs(self) -> list[tuple[str, float]]:
+        table = self.table
+        lo, hi = table.top_offsets[self.row], table.top_offsets[self.row + 1]
+        return [
+            (table.vocab[tid], logprob)
+            for tid, logprob in zip(table.top_token_id[lo:hi].tolist(), table.top_logprob[lo:hi].tolist())
+        ]
+
+    def get_id(self) -> str:
+        return self.table.get_token_uid(self.row)
+
+
+def build_token_table(completions: Iterable["ChatCompletion"]) -> TokenTable:
+    """
+    Extract all sampled tokens from `completions` in a single pass.
+
+    Choices without logprobs raise a ValueError, choices with an empty
+    logprobs.content contribute no rows (but still get a choice span).
+    """
+
+    completion_ids = []
+    vocab = []
+    vocab_index = {}
+
+    completion = array("i")
+    choice_index = array("i")
+    token_index = array("i")
+    token_id = array("i")
+    logprob = array("d")
+    bytes_offsets = array("q", [0])
+    bytes_data = bytearray()
+    choice_offsets = array("q", [0])
+    top_offsets = array("q", [0])
+    top_token_id = array("i")
+    top_logprob = array("d")
+
+    def intern(token: str, token_bytes: list[int] | None) -> int:
+        tid = vocab_index.get(token)
+        if tid is None:
+            tid = len(vocab)
+            vocab_index[token] = tid
+            vocab.append(token)
+            if token_bytes is not None:
+                bytes_data.extend(token_bytes)
+            bytes_offsets.append(len(bytes_data))
+        return tid
+
+    for completion_obj in completions:
+        icomp = len(completion_ids)
+        completion_ids.append(completion_obj.id)
+        for choice in completion_obj.choices:
+            if choice.logprobs is None:
+                raise ValueError("choice.logprobs is None")
+            if choice.logprobs.content is None:
+                raise ValueError("choice.logprobs.content is None")
+            for ii, cctl in enumerate(choice.logprobs.content):
+                completion.append(icomp)
+                choice_index.append(choice.index)
+                token_index.append(ii)
+                token_id.append(intern(cctl.token, cctl.bytes))
+                logprob.append(cctl.logprob)
+                for top in cctl.top_logprobs or []:
+                    top_token_id.append(intern(top.token, top.bytes))
+                    top_logprob.append(top.logprob)
+                top_offsets.append(len(top_token_id))
+            choice_offsets.append(len(token_id))
+
+    return TokenTable(
+        completion_ids=completion_ids,
+        vocab=vocab,
+        completion=np.frombuffer(completion, dtype=np.int32),
+        choice_index=np.frombuffer(choice_index, dtype=np.int32),
+        token_index=np.frombuffer(token_index, dtype=np.int32),
+        token_id=np.frombuffer(token_id, dtype=np.int32),
+        logprob=np.frombuffer(logprob, dtype=np.float64),
+        bytes_offsets=np.frombuffer(bytes_offsets, dtype=np.int64),
+        bytes_data=np.frombuffer(bytes(bytes_data), dtype=np.uint8),
+        choice_offsets=np.frombuffer(choice_offsets, dtype=np.int64),
+        top_offsets=np.frombuffer(top_offsets, dtype=np.int64),
+        top_token_id=np.frombuffer(top_token_id, dtype=np.int32),
+        top_logprob=np.frombuffer(top_logprob, dtype=np.float64),
+    )
+
+
+def load_token_table(path: str | Path) -> TokenTable:
+    """
+    Build a TokenTable from a completions file. JSONL stores are consumed
+    one completion at a time, so their ChatCompletion models are never all
+    in memory together.
+    """
+    path = Path(path)
+    with gc_paused():
+        if path.suffix == ".jsonl":
+            return build_token_table(iter_completions(path))
+        return build_token_table(load_completions(path))
@@ -0,0 +1,481 @@
+from typing import TYPE_CHECKING, Iterable
+
+import numpy as np
+
+from ztnd.formats import GraphArrays
+from ztnd.stats import LogprobStats
+from ztnd.stats import get_branching_entropy
+from ztnd.tokens import TokenTable
+from ztnd.tokens import add_visual_space
+from ztnd.tokens import build_token_table
+
+if TYPE_CHECKING:
+    import networkx as nx
+    from openai.types.chat.chat_completion import ChatCompletion
+
+
+class TokenTrie:
+    """
+    Prefix trie over sampled token sequences.
+
+    Nodes are integers in creation order with the root at 0. Node n is
+    reached from parent[n] by token vocab[token_id[n]] at position
+    token_index[n] and weight[n] paths pass through it. children[n] maps
+    token id -> child node so each token is placed in O(1).
+
+    jj[n] reproduces the "tok|pos|jj" disambiguation counter of the
+    original string based tree so that to_digraph keeps the same "id"
+    attributes. stats accumulates the logprobs of the tokens placed at
+    each node.
+
+    With `add_alternatives` the unsampled top_logprobs alternatives at each
+    position are collected as "virtual" children of the preceding node,
+    keyed by (parent, token id) and weighted by their summed probability
+    (an expected count). Alternatives below `min_alt_prob` are dropped on
+    insertion and at most `max_alternatives` virtual children per node
+    (largest mass first) are emitted, which keeps the expansion bounded.
+    Virtual children are leaves and are not part of the trie itself, so a
+    later sample of the same token becomes a real child and replaces it.
+    """
+
+    root = 0
+
+    def __init__(
+        self,
+        add_alternatives: bool = False,
+        min_alt_prob: float = 0.01,
+        max_alternatives: int | None = None,
+    ):
+        self.vocab = []
+        self.vocab_index = {}
+        self.parent = [-1]
+        self.token_id = [-1]
+        self.token_index = [-1]
+        self.weight = [0]
+        self.jj = [0]
+        self.children = [{}]
+        self.jj_counter = {}
+        self.stats = LogprobStats(1)
+        self.add_alternatives = add_alternatives
+        self.min_alt_prob = min_alt_prob
+        self.max_alternatives = max_alternatives
+        self.alt_index = {}
+        self.alt_keys = []
+        self.alt_stats = LogprobStats()
+
+    @classmethod
+    def from_nodes(
+        cls,
+        vocab: list[str],
+        parent: list[int],
+        token_id: list[int],
+        token_index: list[int],
+        weight: list[int],
+        jj: list[int],
+        jj_counter: dict[tuple[int, int], int],
+        **kwargs,
+    ) -> "TokenTrie":
+        """
+        Rebuild a trie from its node columns (root first), e.g. as merged
+        by ztnd.parallel. Stats are left empty.
+        """
+        trie = cls(**kwargs)
+        for token in vocab:
+            trie.intern(token)
+        trie.parent = parent
+        trie.token_id = token_id
+        trie.token_index = token_index
+        trie.weight = weight
+        trie.jj = jj
+        trie.jj_counter = jj_counter
+        trie.children = [{} for _ in parent]
+        for node, (lo, tid) in enumerate(zip(parent[1:], token_id[1:]), start=1):
+            trie.children[lo][tid] = node
+        trie.stats.grow(len(trie))
+        return trie
+
+    def __len__(self) -> int:
+        return len(self.parent)
+
+    def intern(self, token: str) -> int:
+        tid = self.vocab_index.get(token)
+        if tid is None:
+            tid = len(self.vocab)
+            self.vocab_index[token] = tid
+            self.vocab.append(token)
+        return tid
+
+    def add_node(self, parent: int, tid: int, jj: int) -> int:
+        node = len(self.parent)
+        self.parent.append(parent)
+        self.token_id.append(tid)
+        self.token_index.append(self.token_index[parent] + 1)
+        self.weight.append(1)
+        self.jj.append(jj)
+        self.children.append({})
+        self.children[parent][tid] = node
+        return node
+
+    def add_path(self, tids: list[int], path: list[int] | None = None) -> int:
+        """
+        Insert one token sequence (trie vocab ids) and return its last node.
+        If `path` is given the node of every token is appended to it.
+        """
+        if path is None:
+            path = []
+        if len(tids) == 0:
+            return self.root
+
+        self.weight[self.root] += 1
+        jj_counter = self.jj_counter
+        children = self.children
+
+        # first level nodes are always "tok|0|0"
+        node = children[self.root].get(tids[0])
+        if node is None:
+            diverged = True
+            node = self.add_node(self.root, tids[0], 0)
+        else:
+            diverged = False
+            self.weight[node] += 1
+        path.append(node)
+
+        for pos, tid in enumerate(tids[1:], start=1):
+            key = (tid, pos)
+            if not diverged:
+                child = children[node].get(tid)
+                if child is not None:
+                    self.weight[child] += 1
+                    node = child
+                    path.append(node)
+                    continue
+                diverged = True
+                jj = jj_counter.get(key, 0) + 1
+                jj_counter[key] = jj + 1
+            else:
+                jj = jj_counter.get(key, 0) + 1
+                jj_counter[key] = jj
+            node = self.add_node(node, tid, jj)
+            path.append(node)
+
+        return node
+
+    def add_token(self, node: int, tid: int, diverged: bool) -> tuple[int, bool]:
+        """
+        Extend a path that currently ends at `node` by one token, for
+        sequences that arrive a token at a time (see TokenStreamBuilder).
+        Start a path at the root with diverged=False and pass the returned
+        (node, diverged) back in with the next token.
+
+        Unlike add_path the children of a node created on a diverged path
+        are still looked up, because another path may have reached it
+        since. Node numbers and jj values follow token arrival order.
+        """
+        if node == self.root:
+            self.weight[self.root] += 1
+        child = self.children[node].get(tid)
+        if child is not None:
+            self.weight[child] += 1
+            return child, diverged
+        if node == self.root:
+            jj = 0
+        else:
+            key = (tid, self.token_index[node] + 1)
+            jj = self.jj_counter.get(key, 0) + 1
+            self.jj_counter[key] = jj if diverged else jj + 1
+        return self.add_node(node, tid, jj), True
+
+    def add_table(self, table: TokenTable) -> list[int]:
+        """
+        Insert every choice in `table` and return the last node of each.
+        """
+        remap = [self.intern(token) for token in table.vocab]
+        token_ids = table.token_id.tolist()
+        choice_offsets = table.choice_offsets.tolist()
+        leaves = []
+        row_node = []
+        for lo, hi in zip(choice_offsets[:-1], choice_offsets[1:]):
+            leaves.append(self.add_path([remap[tid] for tid in token_ids[lo:hi]], row_node))
+        row_node = np.array(row_node, dtype=np.int64)
+        self.stats.grow(len(self))
+        self.stats.add(row_node, table.logprob)
+        if self.add_alternatives:
+            self.add_table_alternatives(table, row_node, remap)
+        return leaves
+
+    def add_table_alternatives(
+        self,
+        table: TokenTable,
+        row_node: np.ndarray,
+        remap: list[int],
+    ) -> None:
+        n_top = np.diff(table.top_offsets)
+        top_row = np.repeat(np.arange(len(table)), n_top)
+        top_tid = np.array(remap, dtype=np.int64)[table.top_token_id]
+        sampled_tid = np.array(remap, dtype=np.int64)[table.token_id][top_row]
+        keep = (top_tid != sampled_tid) & (table.top_logprob >= np.log(self.min_alt_prob))
+
+        parent = np.array(self.parent, dtype=np.int64)[row_node[top_row[keep]]]
+        self.add_alternative_entries(parent, top_tid[keep], table.top_logprob[keep])
+
+    def add_alternative_entries(
+        self,
+        parent: np.ndarray,
+        top_tid: np.ndarray,
+        top_logprob: np.ndarray,
+    ) -> None:
+        """
+        Accumulate already filtered alternatives `top_tid` (trie vocab ids)
+        seen as children of `parent`.
+        """
+        n_vocab = len(self.vocab)
+        keys, inverse = np.unique(parent * n_vocab + top_tid, return_inverse=True)
+        batch_index = np.zeros(len(keys), dtype=np.int64)
+        for ikey, key in enumerate(keys.tolist()):
+            alt_key = divmod(key, n_vocab)
+            ii = self.alt_index.get(alt_key)
+            if ii is None:
+                ii = len(self.alt_keys)
+                self.alt_index[alt_key] = ii
+                self.alt_keys.append(alt_key)
+            batch_index[ikey] = ii
+        self.alt_stats.add(batch_index[inverse], top_logprob)
+
+    def get_alternatives(self) -> list[tuple[int, int, int]]:
+        """
+        (parent, token id, alt stats index) of every emitted virtual child,
+        ordered by parent and then by descending probability mass.
+        """
+        by_parent = {}
+        for ii, (parent, tid) in enumerate(self.alt_keys):
+            if tid in self.children[parent]:
+                continue
+            by_parent.setdefault(parent, []).append((parent, tid, ii))
+        alternatives = []
+        for parent in sorted(by_parent):
+            alts = sorted(by_parent[parent], key=lambda alt: -self.alt_stats.prob_mass[alt[2]])
+            alternatives.extend(alts[:self.max_alternatives])
+        return alternatives
+
+    def add_completions(self, completions: Iterable["ChatCompletion"]) -> list[int]:
+        return self.add_table(build_token_table(completions))
+
+    def get_label(self, node: int) -> str:
+        if node == self.root:
+            return "ROOT"
+        return add_visual_space(self.vocab[self.token_id[node]])
+
+    def get_id(self, node: int) -> str:
+        return "{}|{}|{}".format(self.get_label(node), self.token_index[node], self.jj[node])
+
+    def get_entropy(self, node: int) -> float:
+        weights = [self.weight[child] for child in self.children[node].values()]
+        return float(get_branching_entropy(np.zeros(len(weights), dtype=np.int64), weights, 1)[0])
+
+    def get_node_meta(self, node: int, add_stats: bool = True) -> dict:
+        node_meta = {
+            "id": self.get_id(node),
+            "label": self.get_label(node),
+            "token_index": self.token_index[node],
+        }
+        if add_stats:
+            node_meta.update(self.get_stats_meta(node))
+            node_meta["entropy"] = self.get_entropy(node)
+        return node_meta
+
+    def get_stats_meta(self, node: int) -> dict:
+        count = int(self.stats.count[node])
+        return {
+            "prob_mass": float(self.stats.prob_mass[node]),
+            "mean_logprob": float(self.stats.logprob_sum[node]) / count if count else 0.0,
+            "min_logprob": float(self.stats.logprob_min[node]),
+        }
+
+    def get_stats_attrs(self) -> tuple[dict[str, list], list[float]]:
+        attrs = self.stats.get_attrs()
+        parent = np.array(self.parent[1:], dtype=np.int64)
+        entropy = get_branching_entropy(parent, self.weight[1:], len(self)).tolist()
+        return attrs, entropy
+
+    def to_digraph(self, add_stats: bool = True) -> "nx.DiGraph":
+        """
+        Convert to an integer labeled nx.DiGraph with "id", "label" and
+        "token_index" node attributes and "weight" edge attributes.
+
+        With `add_stats` nodes and edges also carry the probability mass,
+        mean and min logprob of their tokens, and nodes carry the entropy
+        of their branching distribution.
+        """
+        import networkx as nx
+
+        labels = [add_visual_space(token) for token in self.vocab]
+        graph = nx.DiGraph()
+        nodes = [(self.root, {"id": "ROOT|-1|0", "label": "ROOT", "token_index": -1})]
+        for node in range(1, len(self)):
+            label = labels[self.token_id[node]]
+            token_index = self.token_index[node]
+            nodes.append((node, {
+                "id": "{}|{}|{}".format(label, token_index, self.jj[node]),
+                "label": label,
+                "token_index": token_index,
+            }))
+        edges = [
+            (self.parent[node], node, {"weight": self.weight[node]})
+            for node in range(1, len(self))
+        ]
+
+        if add_stats:
+            attrs, entropy = self.get_stats_attrs()
+            for name, col in attrs.items():
+                for node, node_meta in nodes:
+                    node_meta[name] = col[node]
+                for _, node, edge_meta in edges:
+                    edge_meta[name] = col[node]
+            for node, node_meta in nodes:
+                node_meta["entropy"] = entropy[node]
+
+        if self.add_alternatives:
+            for _, node_meta in nodes:
+                node_meta["virtual"] = 0
+            for _, _, edge_meta in edges:
+                edge_meta["virtual"] = 0
+            self.add_virtual_nodes(nodes, edges, labels, add_stats)
+
+        graph.add_nodes_from(nodes)
+        graph.add_edges_from(edges)
+        return graph
+
+    def add_virtual_nodes(
+        self,
+        nodes: list[tuple[int, dict]],
+        edges: list[tuple[int, int, dict]],
+        labels: list[str],
+        add_stats: bool,
+    ) -> None:
+        """
+        Append the virtual children from get_alternatives after the trie
+        nodes. Their edge weight is the expected count (summed probability).
+        """
+        jj_counter = {}
+        alt_attrs = self.alt_stats.get_attrs()
+        for parent, tid, ii in self.get_alternatives():
+            node = len(nodes)
+            label = labels[tid]
+            token_index = self.token_index[parent] + 1
+            jj = jj_counter.get((tid, token_index), 0) + 1
+            jj_counter[(tid, token_index)] = jj
+            node_meta = {
+                "id": "{}|{}|v{}".format(label, token_index, jj),
+                "label": label,
+                "token_index": token_index,
+            }
+            edge_meta = {"weight": alt_attrs["prob_mass"][ii]}
+            if add_stats:
+                for name, col in alt_attrs.items():
+                    node_meta[name] = col[ii]
+                    edge_meta[name] = col[ii]
+                node_meta["entropy"] = 0.0
+            node_meta["virtual"] = 1
+            edge_meta["virtual"] = 1
+            nodes.append((node, node_meta))
+            edges.append((parent, node, edge_meta))
+
+    def update_digraph(
+        self,
+        graph: "nx.DiGraph",
+        leaves: list[int],
+        add_stats: bool = True,
+    ) -> "nx.DiGraph":
+        """
+        Bring `graph` up to date after paths ending at `leaves` were added.
+
+        Nodes created since `graph` was built are appended with the same
+        integer ids and only the edges on the new paths are re-weighted, so
+        the cost is proportional to the new tokens rather than the tree.
+        """
+        if self.add_alternatives:
+            raise ValueError("update_digraph does not support virtual alternatives")
+        graph.add_nodes_from(
+            (node, self.get_node_meta(node, add_stats=add_stats))
+            for node in range(graph.number_of_nodes(), len(self))
+        )
+        seen = set()
+        for node in leaves:
+            while node != self.root and node not in seen:
+                seen.add(node)
+                node = self.parent[node]
+        # parents before children keeps new edges in creation order
+        edges = []
+        for node in sorted(seen):
+            edge_meta = {"weight": self.weight[node]}
+            if add_stats:
+                stats_meta = self.get_stats_meta(node)
+                edge_meta.update(stats_meta)
+                graph.nodes[node].update(stats_meta)
+                graph.nodes[node]["entropy"] = self.get_entropy(node)
+            edges.append((self.parent[node], node, edge_meta))
+        if add_stats and seen:
+            graph.nodes[self.root]["entropy"] = self.get_entropy(self.root)
+        graph.add_edges_from(edges)
+        return graph
+
+    def to_arrays(self, add_stats: bool = True) -> GraphArrays:
+        """
+        Convert straight to CSR GraphArrays with the same nodes, edges and
+        attributes as to_digraph, without building an nx.DiGraph. Virtual
+        alternatives are appended after the trie nodes as in to_digraph.
+        """
+        alternatives = self.get_alternatives() if self.add_alternatives else []
+        n_nodes = len(self) + len(alternatives)
+        alt_parent = [parent for parent, _, _ in alternatives]
+        alt_tid = [tid for _, tid, _ in alternatives]
+        alt_ii = np.array([ii for _, _, ii in alternatives], dtype=np.int64)
+
+        parent = np.array(self.parent + alt_parent, dtype=np.int64)
+        # children were created after their parent and in adjacency order,
+        # and virtual children come after all trie nodes, so a stable sort
+        # by parent gives the CSR edge list
+        children = np.argsort(parent[1:], kind="stable") + 1
+        indptr = np.zeros(n_nodes + 1, dtype=np.int64)
+        np.cumsum(np.bincount(parent[1:], minlength=n_nodes), out=indptr[1:])
+
+        strings = ["ROOT"] + [add_visual_space(token) for token in self.vocab]
+        label = np.array(self.token_id + alt_tid, dtype=np.int32) + 1
+        token_index = np.array(self.token_index, dtype=np.int64)
+        alt_token_index = token_index[alt_parent] + 1
+        ids = [self.get_id(node) for node in range(len(self))]
+        jj_counter = {}
+        for tid, pos in zip(alt_tid, alt_token_index.tolist()):
+            jj = jj_counter.get((tid, pos), 0) + 1
+            jj_counter[(tid, pos)] = jj
+            ids.append("{}|{}|v{}".format(strings[tid + 1], pos, jj))
+        strings += ids
+        id_index = np.arange(len(ids), dtype=np.int32) + len(strings) - len(ids)
+
+        node_attrs = {"token_index": np.concatenate([token_index, alt_token_index])}
+        weight = np.array(self.weight, dtype=np.int64)
+        if alternatives:
+            weight = np.concatenate([weight, self.alt_stats.prob_mass[alt_ii]])
+        edge_attrs = {"weight": weight[children]}
+        if add_stats:
+            attrs, entropy = self.get_stats_attrs()
+            alt_attrs = self.alt_stats.get_attrs()
+            for name, col in attrs.items():
+                col = np.concatenate([col, np.array(alt_attrs[name])[alt_ii]])
+                node_attrs[name] = col
+                edge_attrs[name] = col[children]
+            node_attrs["entropy"] = np.concatenate([entropy, np.zeros(len(alternatives))])
+        if self.add_alternatives:
+            virtual = np.zeros(n_nodes, dtype=np.int64)
+            virtual[len(self):] = 1
+            node_attrs["virtual"] = virtual
+            edge_attrs["virtual"] = virtual[children]
+
+        return GraphArrays(
+            indptr=indptr,
+            indices=children,
+            strings=strings,
+            node_attrs=node_attrs,
+            node_str_attrs={"id": id_index, "label": label},
+            edge_attrs=edge_attrs,
+        )
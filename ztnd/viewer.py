@@ -0,0 +1,439 @@
+from dataclasses import replace
+import html
+import json
+import logging
+from pathlib import Path
+import shutil
+
+import numpy as np
+
+from ztnd.formats import GraphArrays
+from ztnd.layout import set_tree_layout_arrays
+
+
+logger = logging.getLogger(__name__)
+
+
+MANIFEST_VERSION = 1
+
+
+def get_level_bands(level_counts: list[int], chunk_nodes: int) -> list[tuple[int, int]]:
+    """
+    Group consecutive levels into (lo, hi) bands of at least `chunk_nodes`
+    nodes (except the last) and never split a level. Top levels of a token
+    tree are small, so the first band holds many of them.
+    """
+    bands = []
+    lo = 0
+    n_nodes = 0
+    for ilevel, count in enumerate(level_counts):
+        n_nodes += count
+        if n_nodes >= chunk_nodes:
+            bands.append((lo, ilevel + 1))
+            lo = ilevel + 1
+            n_nodes = 0
+    if lo < len(level_counts):
+        bands.append((lo, len(level_counts)))
+    return bands
+
+
+class ChunkWriter:
+    """
+    Packs little endian 4 byte typed columns (and utf-8 string columns as
+    offsets + bytes) into one buffer and records where each one starts.
+    """
+
+    def __init__(self):
+        self.parts = []
+        self.n_bytes = 0
+        self.columns = {}
+
+    def add_array(self, name: str, values: np.ndarray, dtype: str) -> None:
+        data = np.ascontiguousarray(values, dtype=np.dtype(dtype).newbyteorder("<")).tobytes()
+        self.columns[name] = {"dtype": dtype, "offset": self.n_bytes, "length": len(values)}
+        self.add_bytes(data)
+
+    def add_strings(self, name: str, values: list[str]) -> None:
+        encoded = [value.encode("utf-8") for value in values]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(el) for el in encoded], out=offsets[1:])
+        self.add_array(name + ".offsets", offsets, "u4")
+        self.columns[name] = {"dtype": "str", "offset": self.n_bytes, "length": int(offsets[-1])}
+        self.add_bytes(b"".join(encoded))
+
+    def add_bytes(self, data: bytes) -> None:
+        # keep every column 4 byte aligned for typed array views
+        data += b"\0" * (-len(data) % 4)
+        self.parts.append(data)
+        self.n_bytes += len(data)
+
+    def write(self, path: Path) -> None:
+        with path.open("wb") as fp:
+            for part in self.parts:
+                fp.write(part)
+
+
+def get_column_dtype(arr: np.ndarray) -> str:
+    return "i4" if np.issubdtype(arr.dtype, np.integer) else "f4"
+
+
+def write_viewer_bundle(
+    arrays: GraphArrays,
+    path: str | Path,
+    level_attr: str = "token_index",
+    chunk_nodes: int = 20_000,
+    title: str = "ztnd",
+) -> dict:
+    """
+    Write a static viewer for a tree or DAG to the directory `path`:
+    index.html (no external dependencies), manifest.json and one binary
+    chunk per band of consecutive levels in chunks/.
+
+    The page draws the first band as soon as it arrives and streams in the
+    deeper ones, so large trees show their top levels immediately. Nodes
+    are renumbered by (level, ypos) so that every band is a contiguous
+    node range, and edges are stored in the band of their target. The
+    original node number is kept in the "node" column. Numeric node and
+    edge attributes are stored as float32 / int32, "label" and "id" as
+    strings. Without "xpos" / "ypos" a level layout on `level_attr` is
+    computed first (see set_tree_layout_arrays), `arrays` is not modified.
+
+    Browsers do not fetch from file:// URLs, serve the directory with
+    e.g. `python -m http.server`. Returns the manifest.
+    """
+    path = Path(path)
+    if "xpos" not in arrays.node_attrs or "ypos" not in arrays.node_attrs:
+        # lay out a copy with its own node_attrs, the columns are shared
+        arrays = replace(arrays, node_attrs=dict(arrays.node_attrs))
+        set_tree_layout_arrays(arrays, level_attr=level_attr)
+    xpos = arrays.node_attrs["xpos"]
+    ypos = arrays.node_attrs["ypos"]
+
+    order = np.lexsort((ypos, xpos))
+    new_id = np.empty(arrays.n_nodes, dtype=np.int64)
+    new_id[order] = np.arange(arrays.n_nodes)
+    _, level_starts, level_counts = np.unique(xpos[order], return_index=True, return_counts=True)
+    bands = get_level_bands(level_counts.tolist(), chunk_nodes)
+
+    targets = new_id[arrays.indices]
+    sources = new_id[arrays.sources]
+    edge_order = np.argsort(targets, kind="stable")
+    targets = targets[edge_order]
+    sources = sources[edge_order]
+    edge_bounds = np.searchsorted(targets, np.r_[level_starts, arrays.n_nodes])
+
+    node_cols = {
+        name: arr[order] for name, arr in arrays.node_attrs.items() if name not in ("xpos", "ypos")
+    }
+    node_strs = {name: arrays.get_node_strs(name) for name in ("label", "id") if name in arrays.node_str_attrs}
+    edge_cols = {name: arr[edge_order] for name, arr in arrays.edge_attrs.items()}
+
+    if path.exists():
+        shutil.rmtree(path / "chunks", ignore_errors=True)
+    (path / "chunks").mkdir(parents=True, exist_ok=True)
+
+    chunks = []
+    for ichunk, (lo_level, hi_level) in enumerate(bands):
+        node_lo = int(level_starts[lo_level])
+        node_hi = int(level_starts[hi_level]) if hi_level < len(level_starts) else arrays.n_nodes
+        edge_lo = int(edge_bounds[lo_level])
+        edge_hi = int(edge_bounds[hi_level])
+        nodes = order[node_lo:node_hi]
+
+        writer = ChunkWriter()
+        writer.add_array("node", nodes, "i4")
+        writer.add_array("xpos", xpos[nodes], "f4")
+        writer.add_array("ypos", ypos[nodes], "f4")
+        for name, arr in node_cols.items():
+            writer.add_array(name, arr[node_lo:node_hi], get_column_dtype(arr))
+        for name, values in node_strs.items():
+            writer.add_strings(name, [values[node] for node in nodes.tolist()])
+        edge_writer_cols = {"source": sources[edge_lo:edge_hi], "target": targets[edge_lo:edge_hi]}
+        for name, arr in edge_writer_cols.items():
+            writer.add_array("edge." + name, arr, "u4")
+        for name, arr in edge_cols.items():
+            writer.add_array("edge." + name, arr[edge_lo:edge_hi], get_column_dtype(arr))
+
+        chunk_path = Path("chunks") / f"chunk-{ichunk:04d}.bin"
+        writer.write(path / chunk_path)
+        chunks.append({
+            "path": chunk_path.as_posix(),
+            "levels": [float(xpos[order[node_lo]]), float(xpos[order[node_hi - 1]])],
+            "nodes": [node_lo, node_hi],
+            "edges": [edge_lo, edge_hi],
+            "n_bytes": writer.n_bytes,
+            "columns": writer.columns,
+        })
+
+    manifest = {
+        "version": MANIFEST_VERSION,
+        "title": title,
+        "n_nodes": arrays.n_nodes,
+        "n_edges": arrays.n_edges,
+        "node_columns": {"node": "i4", "xpos": "f4", "ypos": "f4"}
+            | {name: get_column_dtype(arr) for name, arr in node_cols.items()}
+            | {name: "str" for name in node_strs},
+        "edge_columns": {"source": "u4", "target": "u4"}
+            | {name: get_column_dtype(arr) for name, arr in edge_cols.items()},
+        "extent": [
+            float(xpos.min(initial=0)), float(xpos.max(initial=0)),
+            float(ypos.min(initial=0)), float(ypos.max(initial=0)),
+        ],
+        "chunks": chunks,
+    }
+    with (path / "manifest.json").open("w") as fp:
+        fp.write(json.dumps(manifest, indent=1))
+    with (path / "index.html").open("w", encoding="utf-8") as fp:
+        fp.write(VIEWER_HTML.replace("__TITLE__", html.escape(title)))
+    logger.info(f"wrote viewer bundle with {len(chunks)} chunks for {arrays.n_nodes} nodes to {path}")
+    return manifest
+
+
+VIEWER_HTML = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>__TITLE__</title>
+<style>
+  html, body { margin: 0; height: 100%; overflow: hidden; font: 12px sans-serif; background: #fff; }
+  #view { display: block; width: 100%; height: 100%; cursor: grab; }
+  #bar { position: absolute; top: 0; left: 0; right: 0; padding: 4px 8px; background: rgba(255,255,255,0.85); }
+  #tip { position: absolute; display: none; padding: 4px 6px; background: #222; color: #eee;
+         white-space: pre; pointer-events: none; border-radius: 3px; }
+</style>
+</head>
+<body>
+<canvas id="view"></canvas>
+<div id="bar">
+  <b>__TITLE__</b>
+  color <select id="color"></select>
+  <span id="status">loading manifest</span>
+</div>
+<div id="tip"></div>
+<script>
+"use strict";
+const canvas = document.getElementById("view");
+const ctx = canvas.getContext("2d");
+const statusEl = document.getElementById("status");
+const tip = document.getElementById("tip");
+const colorSelect = document.getElementById("color");
+const TYPES = { f4: Float32Array, i4: Int32Array, u4: Uint32Array };
+
+let manifest = null;
+const nodes = {};
+const edges = {};
+let nLoaded = 0;
+let nEdgesLoaded = 0;
+// view transform, screen = (world - center) * scale + size / 2
+const view = { cx: 0, cy: 0, kx: 1, ky: 1 };
+let colorRange = [0, 1];
+
+function allocate() {
+  for (const [name, dtype] of Object.entries(manifest.node_columns)) {
+    nodes[name] = dtype === "str" ? new Array(manifest.n_nodes) : new TYPES[dtype](manifest.n_nodes);
+  }
+  for (const [name, dtype] of Object.entries(manifest.edge_columns)) {
+    edges[name] = new TYPES[dtype](manifest.n_edges);
+  }
+}
+
+function readChunk(chunk, buffer) {
+  const decoder = new TextDecoder();
+  const [nodeLo, nodeHi] = chunk.nodes;
+  const [edgeLo, edgeHi] = chunk.edges;
+  for (const [name, col] of Object.entries(chunk.columns)) {
+    if (name.endsWith(".offsets")) continue;
+    const isEdge = name.startsWith("edge.");
+    const key = isEdge ? name.slice(5) : name;
+    if (col.dtype === "str") {
+      const offsets = chunk.columns[name + ".offsets"];
+      const offs = new Uint32Array(buffer, offsets.offset, offsets.length);
+      const bytes = new Uint8Array(buffer, col.offset, col.length);
+      for (let ii = 0; ii < offs.length - 1; ii++) {
+        nodes[key][nodeLo + ii] = decoder.decode(bytes.subarray(offs[ii], offs[ii + 1]));
+      }
+    } else {
+      const values = new TYPES[col.dtype](buffer, col.offset, col.length);
+      (isEdge ? edges : nodes)[key].set(values, isEdge ? edgeLo : nodeLo);
+    }
+  }
+  nLoaded = nodeHi;
+  nEdgesLoaded = edgeHi;
+}
+
+function fit() {
+  const [x0, x1, y0, y1] = manifest.extent;
+  const w = canvas.width, h = canvas.height;
+  view.cx = (x0 + x1) / 2;
+  view.cy = (y0 + y1) / 2;
+  view.kx = 0.9 * w / Math.max(x1 - x0, 1);
+  view.ky = 0.9 * h / Math.max(y1 - y0, 1);
+}
+
+function resize() {
+  canvas.width = canvas.clientWidth * devicePixelRatio;
+  canvas.height = canvas.clientHeight * devicePixelRatio;
+  scheduleDraw();
+}
+
+function colorOf(value) {
+  const [lo, hi] = colorRange;
+  const t = hi > lo ? Math.min(Math.max((value - lo) / (hi - lo), 0), 1) : 0.5;
+  // blue -> yellow -> red
+  const r = Math.round(255 * Math.min(1, 2 * t));
+  const g = Math.round(255 * (t < 0.5 ? 0.4 + 1.2 * t : 2 - 2 * t));
+  const b = Math.round(255 * Math.max(0, 1 - 2 * t));
+  return `rgb(${r},${g},${b})`;
+}
+
+function updateColorRange() {
+  const col = nodes[colorSelect.value];
+  if (!col) return;
+  let lo = Infinity, hi = -Infinity;
+  for (let ii = 0; ii < nLoaded; ii++) {
+    const v = col[ii];
+    if (Number.isFinite(v)) { if (v < lo) lo = v; if (v > hi) hi = v; }
+  }
+  colorRange = [lo, hi];
+}
+
+let drawPending = false;
+function scheduleDraw() {
+  if (!drawPending) { drawPending = true; requestAnimationFrame(draw); }
+}
+
+function draw() {
+  drawPending = false;
+  if (!manifest) return;
+  const w = canvas.width, h = canvas.height;
+  const { cx, cy, kx, ky } = view;
+  const sx = (x) => (x - cx) * kx + w / 2;
+  const sy = (y) => (y - cy) * ky + h / 2;
+  const xpos = nodes.xpos, ypos = nodes.ypos;
+  ctx.clearRect(0, 0, w, h);
+
+  // edges, width by log weight
+  const weight = edges.weight;
+  ctx.strokeStyle = "rgba(80,80,80,0.35)";
+  for (const [lo, hi, width] of [[0, 2, 0.5], [2, 10, 1], [10, 100, 2], [100, Infinity, 3]]) {
+    ctx.lineWidth = width * devicePixelRatio;
+    ctx.beginPath();
+    for (let ii = 0; ii < nEdgesLoaded; ii++) {
+      const wt = weight ? weight[ii] : 1;
+      if (wt < lo || wt >= hi) continue;
+      const s = edges.source[ii], t = edges.target[ii];
+      const x0 = sx(xpos[s]), x1 = sx(xpos[t]);
+      if ((x0 < 0 && x1 < 0) || (x0 > w && x1 > w)) continue;
+      const y0 = sy(ypos[s]), y1 = sy(ypos[t]);
+      if ((y0 < 0 && y1 < 0) || (y0 > h && y1 > h)) continue;
+      ctx.moveTo(x0, y0);
+      ctx.lineTo(x1, y1);
+    }
+    ctx.stroke();
+  }
+
+  // nodes
+  const col = nodes[colorSelect.value];
+  const size = Math.max(2, Math.min(8, ky / 2)) * devicePixelRatio;
+  const showLabels = kx > 40 * devicePixelRatio && ky > 10 * devicePixelRatio && nodes.label;
+  ctx.font = `${11 * devicePixelRatio}px sans-serif`;
+  ctx.textBaseline = "middle";
+  let nLabels = 0;
+  for (let ii = 0; ii < nLoaded; ii++) {
+    const x = sx(xpos[ii]), y = sy(ypos[ii]);
+    if (x < -size || x > w + size || y < -size || y > h + size) continue;
+    ctx.fillStyle = col ? colorOf(col[ii]) : "#36c";
+    ctx.fillRect(x - size / 2, y - size / 2, size, size);
+    if (showLabels && nLabels < 3000) {
+      ctx.fillStyle = "#111";
+      ctx.fillText(nodes.label[ii], x + size, y);
+      nLabels++;
+    }
+  }
+}
+
+function nearestNode(px, py) {
+  const w = canvas.width, h = canvas.height;
+  let best = -1, bestDist = (8 * devicePixelRatio) ** 2;
+  for (let ii = 0; ii < nLoaded; ii++) {
+    const dx = (nodes.xpos[ii] - view.cx) * view.kx + w / 2 - px;
+    const dy = (nodes.ypos[ii] - view.cy) * view.ky + h / 2 - py;
+    const dist = dx * dx + dy * dy;
+    if (dist < bestDist) { best = ii; bestDist = dist; }
+  }
+  return best;
+}
+
+let drag = null;
+canvas.addEventListener("mousedown", (ev) => { drag = [ev.clientX, ev.clientY]; canvas.style.cursor = "grabbing"; });
+window.addEventListener("mouseup", () => { drag = null; canvas.style.cursor = "grab"; });
+canvas.addEventListener("mousemove", (ev) => {
+  if (drag) {
+    view.cx -= (ev.clientX - drag[0]) * devicePixelRatio / view.kx;
+    view.cy -= (ev.clientY - drag[1]) * devicePixelRatio / view.ky;
+    drag = [ev.clientX, ev.clientY];
+    tip.style.display = "none";
+    scheduleDraw();
+    return;
+  }
+  if (!manifest) return;
+  const node = nearestNode(ev.clientX * devicePixelRatio, ev.clientY * devicePixelRatio);
+  if (node < 0) { tip.style.display = "none"; return; }
+  const lines = [];
+  for (const name of Object.keys(manifest.node_columns)) {
+    const value = nodes[name][node];
+    lines.push(`${name}: ${typeof value === "number" && !Number.isInteger(value) ? value.toFixed(4) : value}`);
+  }
+  tip.textContent = lines.join("\\n");
+  tip.style.left = `${ev.clientX + 12}px`;
+  tip.style.top = `${ev.clientY + 12}px`;
+  tip.style.display = "block";
+});
+canvas.addEventListener("wheel", (ev) => {
+  ev.preventDefault();
+  const factor = Math.exp(-ev.deltaY * 0.002);
+  const px = ev.clientX * devicePixelRatio, py = ev.clientY * devicePixelRatio;
+  const wx = (px - canvas.width / 2) / view.kx + view.cx;
+  const wy = (py - canvas.height / 2) / view.ky + view.cy;
+  // shift zooms x only, alt zooms y only
+  if (!ev.altKey) view.kx *= factor;
+  if (!ev.shiftKey) view.ky *= factor;
+  view.cx = wx - (px - canvas.width / 2) / view.kx;
+  view.cy = wy - (py - canvas.height / 2) / view.ky;
+  scheduleDraw();
+}, { passive: false });
+canvas.addEventListener("dblclick", () => { fit(); scheduleDraw(); });
+colorSelect.addEventListener("change", () => { updateColorRange(); scheduleDraw(); });
+window.addEventListener("resize", resize);
+
+async function main() {
+  try {
+    manifest = await (await fetch("manifest.json")).json();
+  } catch (err) {
+    statusEl.textContent = "could not load manifest.json, serve this directory over http (python -m http.server)";
+    return;
+  }
+  allocate();
+  for (const [name, dtype] of Object.entries(manifest.node_columns)) {
+    if (dtype === "str" || ["node", "xpos", "ypos"].includes(name)) continue;
+    colorSelect.add(new Option(name, name));
+  }
+  if (manifest.node_columns.entropy) colorSelect.value = "entropy";
+  resize();
+  fit();
+  for (const chunk of manifest.chunks) {
+    const buffer = await (await fetch(chunk.path)).arrayBuffer();
+    readChunk(chunk, buffer);
+    updateColorRange();
+    statusEl.textContent =
+      `levels ${manifest.chunks[0].levels[0]}..${chunk.levels[1]}, ` +
+      `${nLoaded.toLocaleString()} / ${manifest.n_nodes.toLocaleString()} nodes ` +
+      `(drag to pan, wheel to zoom, shift / alt for one axis, double click to fit)`;
+    scheduleDraw();
+  }
+}
+main();
+</script>
+</body>
+</html>
+"""